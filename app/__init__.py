@@ -1,32 +1,64 @@
 import os
+import time
+from collections import OrderedDict
+
 from flask import Flask
 from flask_mail import Mail
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_assets import Environment
-from flask_wtf import CsrfProtect
-from flask_compress import Compress
 from flask_rq import RQ
+from flask_wtf import CsrfProtect
 
 from config import config
-from .assets import app_css, app_js, vendor_css, vendor_js
+from .cache import TieredCache
+from .database import SQLAlchemy
+from .instrumentation import Instrumentation
+from .profiler import Profiler
+from .static_files import Compression, init_static
+from .view_cache import ResponseCache
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 mail = Mail()
 db = SQLAlchemy()
 csrf = CsrfProtect()
-compress = Compress()
+compress = Compression()
+# Logged in users and their roles, see `load_user`
+user_cache = TieredCache('USER_CACHE')
+response_cache = ResponseCache()
+instrumentation = Instrumentation()
+profiler = Profiler()
 
 # Set up Flask-Login
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
 login_manager.login_view = 'account.login'
 
+# Application shared by the background jobs of this process
+_job_app = None
+
+
+class StartupPhases(OrderedDict):
+    """Seconds `create_app` spent in each phase, in order."""
+
+    def __init__(self):
+        super(StartupPhases, self).__init__()
+        self.last = time.time()
 
-def create_app(config_name):
+    def done(self, phase):
+        now = time.time()
+        self[phase] = now - self.last
+        self.last = now
+
+
+def create_app(config_name, **settings):
+    """
+    Create an app from a named config, with `settings` overriding it. The
+    time taken by each phase is kept in `app.extensions['startup']`.
+    """
+    phases = StartupPhases()
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    app.config.update(settings)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     # not using sqlalchemy event system, hence disabling it
 
@@ -36,30 +68,32 @@ def create_app(config_name):
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
     config[config_name].init_app(app)
+    phases.done('config')
 
     # Set up extensions
     mail.init_app(app)
     db.init_app(app)
+    if app.config['INSTRUMENTATION']:
+        # Before Flask-Compress, so response sizes are the compressed ones
+        instrumentation.init_app(app)
+    if app.config['PROFILER']:
+        profiler.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
     compress.init_app(app)
+    init_static(app)
+    user_cache.init_app(app)
+    response_cache.init_app(app)
     RQ(app)
 
     # Register Jinja template functions
     from .utils import register_template_utils
     register_template_utils(app)
+    phases.done('extensions')
 
-    # Set up asset pipeline
-    assets_env = Environment(app)
-    dirs = ['assets/styles', 'assets/scripts']
-    for path in dirs:
-        assets_env.append_path(os.path.join(basedir, path))
-    assets_env.url_expire = True
-
-    assets_env.register('app_css', app_css)
-    assets_env.register('app_js', app_js)
-    assets_env.register('vendor_css', vendor_css)
-    assets_env.register('vendor_js', vendor_js)
+    if app.config['ASSETS_PIPELINE']:
+        init_assets(app)
+    phases.done('assets')
 
     # Configure SSL if platform supports it
     if not app.debug and not app.testing and not app.config['SSL_DISABLE']:
@@ -76,4 +110,50 @@ def create_app(config_name):
     from .admin import admin as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
 
+    from .api import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix='/api')
+    phases.done('blueprints')
+
+    app.extensions['startup'] = phases
     return app
+
+
+def init_assets(app):
+    """
+    Link pages to the bundles `manage.py build_assets` built, or build
+    them on request with Flask-Assets.
+    """
+    from .asset_manifest import asset_urls, load_manifest
+    app.add_template_global(asset_urls)
+    if app.config['ASSETS_USE_MANIFEST']:
+        manifest = load_manifest(app)
+        if manifest is not None:
+            app.extensions['asset_manifest'] = manifest
+            return
+        app.logger.warning('No asset manifest at %s, building assets on '
+                           'request. Run manage.py build_assets.',
+                           app.config['ASSETS_MANIFEST_FILE'])
+    from .assets import init_environment
+    init_environment(app)
+
+
+def set_job_app(app):
+    """Make background jobs in this process run in `app`."""
+    global _job_app
+    _job_app = app
+
+
+def job_app():
+    """
+    Return the application a background job should run in: the current one
+    inside an app context, otherwise one app per process, created on first
+    use unless `manage.py run_worker` already handed its own over.
+    """
+    from flask import current_app, has_app_context
+    if has_app_context():
+        return current_app._get_current_object()
+    if _job_app is None:
+        # Emails are the only templates jobs render; they use no assets.
+        set_job_app(create_app(os.getenv('FLASK_CONFIG') or 'default',
+                               ASSETS_PIPELINE=False))
+    return _job_app
@@ -1,11 +1,12 @@
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import (current_user, login_required, login_user,
                          logout_user)
-from flask_rq import get_queue
+from sqlalchemy.orm import undefer
 
 from . import account
 from .. import db
-from ..email import send_email
+from ..email import MailUser, send_email
+from ..jobs import enqueue
 from ..models import User
 from .forms import (ChangeEmailForm, ChangePasswordForm, CreatePasswordForm,
                     LoginForm, RegistrationForm, RequestResetPasswordForm,
@@ -17,7 +18,8 @@ def login():
     """Log in an existing user."""
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
+        user = User.query.options(undefer('password_hash')) \
+            .filter_by(email=form.email.data).first()
         if user is not None and user.password_hash is not None and \
                 user.verify_password(form.password.data):
             login_user(user, form.remember_me.data)
@@ -42,12 +44,12 @@ def register():
         db.session.commit()
         token = user.generate_confirmation_token()
         confirm_link = url_for('account.confirm', token=token, _external=True)
-        get_queue().enqueue(
+        enqueue(
             send_email,
             recipient=user.email,
             subject='Confirm Your Account',
             template='account/email/confirm',
-            user=user,
+            user=MailUser.of(user),
             confirm_link=confirm_link)
         flash('A confirmation link has been sent to {}.'.format(user.email),
               'warning')
@@ -78,17 +80,18 @@ def reset_password_request():
         return redirect(url_for('main.index'))
     form = RequestResetPasswordForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
+        user = User.query.options(undefer('password_hash')) \
+            .filter_by(email=form.email.data).first()
         if user:
             token = user.generate_password_reset_token()
             reset_link = url_for(
                 'account.reset_password', token=token, _external=True)
-            get_queue().enqueue(
+            enqueue(
                 send_email,
                 recipient=user.email,
                 subject='Reset Your Password',
                 template='account/email/reset_password',
-                user=user,
+                user=MailUser.of(user),
                 reset_link=reset_link,
                 next=request.args.get('next'))
         flash('A password reset link has been sent to {}.'
@@ -104,7 +107,8 @@ def reset_password(token):
         return redirect(url_for('main.index'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
+        user = User.query.options(undefer('password_hash')) \
+            .filter_by(email=form.email.data).first()
         if user is None:
             flash('Invalid email address.', 'form-error')
             return redirect(url_for('main.index'))
@@ -146,14 +150,12 @@ def change_email_request():
             token = current_user.generate_email_change_token(new_email)
             change_email_link = url_for(
                 'account.change_email', token=token, _external=True)
-            get_queue().enqueue(
+            enqueue(
                 send_email,
                 recipient=new_email,
                 subject='Confirm Your New Email',
                 template='account/email/change_email',
-                # current_user is a LocalProxy, we want the underlying user
-                # object
-                user=current_user._get_current_object(),
+                user=MailUser.of(current_user),
                 change_email_link=change_email_link)
             flash('A confirmation link has been sent to {}.'.format(new_email),
                   'warning')
@@ -180,13 +182,12 @@ def confirm_request():
     """Respond to new user's request to confirm their account."""
     token = current_user.generate_confirmation_token()
     confirm_link = url_for('account.confirm', token=token, _external=True)
-    get_queue().enqueue(
+    enqueue(
         send_email,
         recipient=current_user.email,
         subject='Confirm Your Account',
         template='account/email/confirm',
-        # current_user is a LocalProxy, we want the underlying user object
-        user=current_user._get_current_object(),
+        user=MailUser.of(current_user),
         confirm_link=confirm_link)
     flash('A new confirmation link has been sent to {}.'.format(
         current_user.email), 'warning')
@@ -245,12 +246,12 @@ def join_from_invite(user_id, token):
             user_id=user_id,
             token=token,
             _external=True)
-        get_queue().enqueue(
+        enqueue(
             send_email,
             recipient=new_user.email,
             subject='You Are Invited To Join',
             template='account/email/invite',
-            user=new_user,
+            user=MailUser.of(new_user),
             invite_link=invite_link)
     return redirect(url_for('main.index'))
 
@@ -1,7 +1,8 @@
 from flask_wtf import Form
 from wtforms import ValidationError
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
-from wtforms.fields import PasswordField, StringField, SubmitField
+from wtforms.fields import (BooleanField, PasswordField, StringField,
+                            SubmitField)
 from wtforms.fields.html5 import EmailField
 from wtforms.validators import Email, EqualTo, InputRequired, Length
 from flask_wtf.file import FileField, FileAllowed, FileRequired
@@ -41,8 +42,27 @@ class AddNewDataForm(Form):
     upload = FileField('file', validators=[
         FileRequired()
     ])
+    overwrite = BooleanField('Overwrite days that were already imported')
     submit = SubmitField('Add')
 
+#################################################
+#                                               #
+#               UploadReportForm                #
+#                                               #
+#################################################
+class UploadReportForm(Form):
+    network = QuerySelectField(
+        'Network',
+        validators=[InputRequired()],
+        get_label='name',
+        query_factory=lambda: db.session.query(Channels))
+
+    upload = FileField('Report covering any number of sites', validators=[
+        FileRequired()
+    ])
+    overwrite = BooleanField('Overwrite days that were already imported')
+    submit = SubmitField('Import')
+
 #################################################
 #                                               #
 #               AddNewSiteForm                  #
@@ -1,23 +1,38 @@
-from flask import abort, flash, redirect, render_template, url_for, request, current_app
+from flask import (abort, flash, jsonify, redirect, render_template, url_for,
+                   request, current_app, Response)
 from flask_login import current_user, login_required
 from flask_rq import get_queue
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 
 from .forms import (ChangeAccountTypeForm, ChangeUserEmailForm, InviteUserForm,
-                    NewUserForm, AddNewDataForm, AddNewSite, AddNewNetworkForm)
+                    NewUserForm, AddNewDataForm, AddNewSite, AddNewNetworkForm,
+                    UploadReportForm)
 from . import admin
-from .. import db
+from .. import db, profiler, response_cache
+from ..database import pool_status
 from ..decorators import admin_required
-from ..email import send_email
-from ..models import Role, User, EditableHTML, Sites, Channels, UserData
+from ..email import MailUser, send_email
+from ..ingest import get_parser, ingest_report
+from ..jobs import enqueue, enqueue_stats
+from ..models import (Role, User, EditableHTML, Sites, Channels,
+                      USER_SORT_KEYS)
+from ..view_cache import cached
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import json
 import os
-import csv
-from datetime import datetime
+import pstats
+import uuid
+
+USERS_PER_PAGE = 50
+MAX_USERS_PER_PAGE = 200
 
 
 @admin.route('/')
 @login_required
 @admin_required
+@cached(vary='role')
 def index():
     """Admin dashboard page."""
     return render_template('admin/index.html')
@@ -80,12 +95,12 @@ def invite_user():
             user_id=user.id,
             token=token,
             _external=True)
-        get_queue().enqueue(
+        enqueue(
             send_email,
             recipient=user.email,
             subject='You Are Invited To Join',
             template='account/email/invite',
-            user=user,
+            user=MailUser.of(user),
             invite_link=invite_link, )
         flash('User {} successfully invited'.format(user.full_name()),
               'form-success')
@@ -95,12 +110,80 @@ def invite_user():
 @admin.route('/users')
 @login_required
 @admin_required
+@cached(vary='role', tags=('users', ))
 def registered_users():
-    """View all registered users."""
-    users=User.query.all()
-    roles=Role.query.all()
+    """View the first page of registered users; the rest load as JSON."""
+    users, next_page = users_page(request.args)
+    roles = Role.query.all()
     return render_template(
-        'admin/registered_users.html', users=users, roles=roles)
+        'admin/registered_users.html',
+        users=users,
+        next_page=next_page,
+        roles=roles)
+
+
+@admin.route('/users.json')
+@login_required
+@admin_required
+def registered_users_data():
+    """A page of registered users for incremental loading and search."""
+    users, next_page = users_page(request.args)
+    return jsonify(
+        users=[{
+            'id': u.id,
+            'first_name': u.first_name,
+            'email': u.email,
+            'role': u.role.name if u.role else None,
+            'url': url_for('admin.user_info', user_id=u.id)
+        } for u in users],
+        next=next_page)
+
+
+def users_page(args):
+    """
+    Return `(users, next page cursor)` for the registered users listing.
+    Users are sorted case-insensitively by `sort` (`first_name` or
+    `email`), optionally narrowed to a `role` id and to names or emails
+    starting with `q`. Pages are keyset-paginated on the indexed sort key
+    and id, so any page costs one index range scan, and roles are joined
+    in the same query.
+    """
+    sort = args.get('sort', 'first_name')
+    key = USER_SORT_KEYS.get(sort)
+    if key is None:
+        abort(400)
+    limit = max(1, min(args.get('limit', USERS_PER_PAGE, type=int),
+                       MAX_USERS_PER_PAGE))
+    query = db.session.query(User, key).options(joinedload('role'))
+
+    search = args.get('q', '').strip().lower()
+    if search:
+        # A range rather than LIKE, so the expression indexes are used.
+        query = query.filter(or_(*[
+            and_(k >= search, k < search + u'\uffff')
+            for k in USER_SORT_KEYS.values()
+        ]))
+    role_id = args.get('role', type=int)
+    if role_id:
+        query = query.filter(User.role_id == role_id)
+    cursor = args.get('after')
+    if cursor:
+        try:
+            value, user_id = json.loads(
+                urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError):
+            abort(400)
+        query = query.filter(
+            or_(key > value, and_(key == value, User.id > user_id)))
+
+    rows = query.order_by(key, User.id).limit(limit + 1).all()
+    next_page = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, value = rows[-1]
+        next_page = urlsafe_b64encode(
+            json.dumps([value, last.id]).encode('utf-8')).decode('ascii')
+    return [user for user, _ in rows], next_page
 
 
 @admin.route('/user/<int:user_id>')
@@ -147,49 +230,135 @@ def network_file_path(network):
 
 #################################################
 #                                               #
-#               To DATE                         #
+#               Report ingest                   #
 #                                               #
 #################################################
+def enqueue_report(form, site_ids=None):
+    """
+    Save the uploaded report under a name of its own and queue its
+    import, which deletes the file when done. Returns the RQ job id, or
+    None (with a flashed error) if the network has no parser.
+    """
+    network = form.network.data.name
+    if get_parser(network) is None:
+        flash('There is no report parser for {}.'.format(network),
+              'form-error')
+        return None
+    file = request.files['upload']
+    # Uploads of the same file waiting in the queue must not overwrite
+    # each other.
+    path = os.path.join(network_file_path(network), '{}-{}'.format(
+        uuid.uuid4().hex, secure_filename(file.filename)))
+    file.save(path)
+    try:
+        job = enqueue(
+            ingest_report,
+            kwargs={
+                'path': path,
+                'network': network,
+                'channel_id': form.network.data.id,
+                'site_ids': site_ids,
+                'overwrite': form.overwrite.data
+            },
+            timeout=current_app.config['INGEST_JOB_TIMEOUT'])
+    except Exception:
+        os.remove(path)
+        raise
+    flash('The report is being imported in the background.', 'form-info')
+    return job.id
+
+
+@admin.route('/ingest/<job_id>')
+@login_required
+@admin_required
+def ingest_status(job_id):
+    """Report the progress of a background report import."""
+    job = get_queue().fetch_job(job_id)
+    if job is None:
+        abort(404)
+    error = None
+    if job.exc_info:
+        error = job.exc_info.strip().splitlines()[-1]
+    return jsonify(
+        id=job.id,
+        status=job.get_status(),
+        progress=job.meta,
+        result=job.result,
+        error=error)
+
+
+@admin.route('/cache/stats')
+@login_required
+@admin_required
+def cache_stats():
+    """Response cache hits, misses and skips per endpoint."""
+    return jsonify(response_cache.stats())
 
-def parse_date(dateString, format):
-    return datetime.strptime(dateString, format).date()
 
-#################################################
-#                                               #
-#               Data parser                     #
-#                                               #
-#################################################
-def file_parser(network, file, site):
-    if network == '33across':
-        return parse_33across(os.path.join(network_file_path(network),file), site)
-
-def parse_33across(file, site):
-    
-    date_format = '%Y-%m-%d'
-    """ifile  = open(os.path.join(current_app.config['UPLOAD_FOLDER']) + '/' + file, 'rt')
-    reader = csv.DictReader(next(ifile), delimiter=',')"""
-    with open(file) as csvfile:
-        next(csvfile)
-        reader=csv.DictReader(csvfile)
-        # next(reader)
-        data = {}
-        for line in reader:
-            if line['Login'].lower()==site.lower():
-                data_str = str(line['Date'])
-                #print(data_str)
-                date = parse_date(data_str, date_format)
-                revenue=0
-                if data_str in data:
-                    revenue = data[data_str]['revenue'] + float(line['Estimated Revenue'].replace('$', ''))
-                    #print('IS')
-                else:
-                    #data[data_str] = {'revenue': float(line['Estimated Revenue'].replace('$', ''))}
-                    revenue = float(line['Estimated Revenue'].replace('$', ''))
-                data[data_str] = {'revenue':revenue, 'day':date}
-                #print(data)
-            else:
-                print('not site...:::' + line['Login'].lower())
-    return data
+@admin.route('/jobs/stats')
+@login_required
+@admin_required
+def job_stats():
+    """Payload size and enqueue latency per job type, for this process."""
+    return jsonify(enqueue_stats())
+
+
+@admin.route('/db/pool')
+@login_required
+@admin_required
+def db_pool():
+    """Connections in use and checkout waits of this process's pool."""
+    return jsonify(pool_status(db.engine))
+
+
+def endpoint_profiles():
+    if not profiler.enabled:
+        abort(404)
+    return profiler.profiles()
+
+
+@admin.route('/profiles')
+@login_required
+@admin_required
+def profiles():
+    """Profiled requests and their total time per endpoint."""
+    return jsonify({
+        endpoint: {
+            'samples': profile.samples,
+            'seconds': profile.seconds
+        }
+        for endpoint, profile in endpoint_profiles().items()
+    })
+
+
+@admin.route('/profiles/<endpoint>')
+@login_required
+@admin_required
+def download_profile(endpoint):
+    """
+    An endpoint's profile as a pstats file, or as text sorted by the
+    `sort` argument with `?format=text`.
+    """
+    profile = endpoint_profiles().get(endpoint)
+    if profile is None:
+        abort(404)
+    if request.args.get('format') == 'text':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            abort(400)
+        return Response(profile.text(sort), mimetype='text/plain')
+    return Response(profile.dump(), mimetype='application/octet-stream',
+                    headers={'Content-Disposition':
+                             'attachment; filename={}.prof'.format(endpoint)})
+
+
+@admin.route('/profiles/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_profiles():
+    endpoint_profiles()
+    profiler.reset()
+    return 'OK', 200
 
 #################################################
 #                                               #
@@ -200,9 +369,7 @@ def parse_33across(file, site):
 @login_required
 @admin_required
 def add_data(user_id):
-    txt=0
-    #data=''
-    """Change a user's email."""
+    """Import a network report for one of the user's sites."""
     user=User.query.filter_by(id=user_id).first()
     if user is None:
         abort(404)
@@ -211,46 +378,29 @@ def add_data(user_id):
     form=AddNewDataForm()
     form.site.query=query
 
+    job_id = None
     if form.validate_on_submit():
-        # return'success' + str(request.files)
-        network = form.network.data.name
-        if request.method == 'POST':
-            if 'upload' not in request.files:
-                flash('no file')
-                return 'fail'
-            """else:
-                return 'success'"""
-            file=request.files['upload']
-            filename=secure_filename(file.filename)
-
-            """file.save(os.path.join(current_app.config[
-                      'UPLOAD_FOLDER'], filename))"""
-            file.save(os.path.join(network_file_path(network),filename))
-            
-            data=file_parser(network, filename,form.site.data.link)
-            for k in data:
-                print(txt)
-                txt += 1
-                q = UserData.query.filter_by(day=data[k]['day']).filter_by(site=form.site.data.id).first()
-                #print(type(q))
-                #print(q.revenue)
-                if not q:
-                    to_db = UserData(
-                            user_id=user_id,
-                            day=data[k]['day'],
-                            channel = form.network.data.id,
-                            site = form.site.data.id,
-                            #country = '',
-                            #position = '',
-                            revenue = data[k]['revenue']
-                            )
-                    db.session.add(to_db)
-                else:
-                    print('exists...')
-            db.session.commit()
-
-
-    return render_template('admin/manage_user.html', user=user, form=form, txt=txt)
+        job_id = enqueue_report(form, site_ids=[form.site.data.id])
+
+    return render_template('admin/manage_user.html', user=user, form=form,
+                           job_id=job_id)
+
+#################################################
+#                                               #
+#               Upload Report                   #
+#                                               #
+#################################################
+@admin.route('/upload-report', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def upload_report():
+    """Import a network report for every site it mentions in one pass."""
+    form = UploadReportForm()
+    job_id = None
+    if form.validate_on_submit():
+        job_id = enqueue_report(form)
+    return render_template('admin/upload_report.html', form=form,
+                           job_id=job_id)
 
 #################################################
 #                                               #
@@ -349,13 +499,6 @@ def update_editor_contents():
     edit_data=request.form.get('edit_data')
     editor_name=request.form.get('editor_name')
 
-    editor_contents=EditableHTML.query.filter_by(
-        editor_name=editor_name).first()
-    if editor_contents is None:
-        editor_contents=EditableHTML(editor_name=editor_name)
-    editor_contents.value=edit_data
-
-    db.session.add(editor_contents)
-    db.session.commit()
+    EditableHTML.set_editable_html(editor_name, edit_data)
 
     return 'OK', 200
@@ -0,0 +1,119 @@
+import hashlib
+import json
+from datetime import date, datetime, timedelta
+
+from flask import current_app, jsonify, request
+from flask_login import current_user, login_required
+
+from . import api
+from ..view_cache import cached, cached_version
+from ..models import GRANULARITIES, RevenueVersion, periods, revenue_series
+
+# Longest range, in periods, a single request may ask for
+MAX_PERIODS = {'day': 731, 'month': 120}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def bad_request(message):
+    response = jsonify(error=message)
+    response.status_code = 400
+    return response
+
+
+def parse_day(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise BadRequest('{} must be a YYYY-MM-DD date'.format(name))
+
+
+def revenue_args():
+    """Validate the `/revenue` query arguments into a dict."""
+    today = date.today()
+    last_day = parse_day('end', today - timedelta(days=1))
+    first_day = parse_day('start', last_day - timedelta(days=29))
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        raise BadRequest('granularity must be one of ' +
+                         ', '.join(GRANULARITIES))
+    if first_day > last_day:
+        raise BadRequest('start must not be after end')
+    if len(periods(first_day, last_day, granularity)) > \
+            MAX_PERIODS[granularity]:
+        raise BadRequest('at most {} periods of a {} can be requested'.format(
+            MAX_PERIODS[granularity], granularity))
+
+    user_id = current_user.id
+    if 'user_id' in request.args and current_user.is_admin():
+        user_id = request.args.get('user_id', type=int) or user_id
+    return {
+        'user_id': user_id,
+        'first_day': first_day,
+        'last_day': last_day,
+        'granularity': granularity,
+        'site_ids': sorted(set(request.args.getlist('site', type=int))),
+        'channel_ids': sorted(set(request.args.getlist('channel', type=int)))
+    }
+
+
+def revenue_version():
+    """
+    The rollup version and today's date, as the default range of
+    `/revenue` ends yesterday.
+    """
+    return [RevenueVersion.current(), date.today().isoformat()]
+
+
+def compact_json(payload):
+    return current_app.response_class(
+        json.dumps(payload, separators=(',', ':')),
+        mimetype='application/json')
+
+
+@api.route('/revenue')
+@login_required
+@cached(vary='user', version=revenue_version, flashes=False)
+def revenue():
+    """
+    A user's revenue per site as compact JSON. Query arguments are
+    `start` and `end` (YYYY-MM-DD, by default the 30 days before today),
+    `granularity` (`day` or `month`), any number of `site` and `channel`
+    ids and, for administrators, `user_id`.
+
+    The strong ETag combines the rollup version, bumped by every ingest
+    and site change, and today's date with the arguments, so a client
+    revalidating unchanged data gets a 304 after a single version lookup.
+    """
+    try:
+        args = revenue_args()
+    except BadRequest as e:
+        return bad_request(str(e))
+
+    version = cached_version(revenue_version)
+    key = json.dumps([version, sorted(args.items())], default=str)
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        keys, sites = revenue_series(**args)
+        response = compact_json({
+            'granularity': args['granularity'],
+            'start': args['first_day'].isoformat(),
+            'end': args['last_day'].isoformat(),
+            'periods': [key.isoformat() for key in keys],
+            'sites': [{
+                'id': site_id,
+                'label': link,
+                'data': data
+            } for site_id, link, data in sites]
+        })
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,28 @@
+"""
+Bundle URLs for templates, from the manifest `manage.py build_assets`
+writes or, without one, from Flask-Assets. Importing this module does not
+load Flask-Assets.
+"""
+import json
+
+from flask import current_app, url_for
+
+# Characters of the content hash put in built file names
+HASH_LENGTH = 12
+
+
+def load_manifest(app):
+    """Read ASSETS_MANIFEST_FILE, returning None if it has not been built."""
+    try:
+        with open(app.config['ASSETS_MANIFEST_FILE']) as f:
+            return json.load(f)
+    except (IOError, OSError):
+        return None
+
+
+def asset_urls(name):
+    """Return the URLs to include for the bundle `name`."""
+    manifest = current_app.extensions.get('asset_manifest')
+    if manifest is not None:
+        return [url_for('static', filename=manifest[name])]
+    return current_app.jinja_env.assets_environment[name].urls()
@@ -1,4 +1,30 @@
-from flask_assets import Bundle
+"""
+CSS and JS bundles.
+
+In development Flask-Assets builds the bundles on request. For deploys,
+`manage.py build_assets` builds them once and writes each bundle next to
+its Flask-Assets output under a name carrying a hash of its contents
+(`scripts/vendor.<hash>.js`), with gzip and, if the `brotli` package is
+installed, brotli compressed copies beside it. A manifest maps bundle
+names to those files. With ASSETS_USE_MANIFEST set, pages link to the
+files in the manifest and Flask-Assets is not loaded at all; see
+app/asset_manifest.py.
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+
+from flask_assets import Bundle, Environment
+
+from .asset_manifest import HASH_LENGTH
+
+try:
+    import brotli
+except ImportError:  # brotli compressed copies are optional
+    brotli = None
 
 app_css = Bundle('app.scss', filters='scss', output='styles/app.css')
 
@@ -6,11 +32,121 @@ app_js = Bundle('app.js', filters='jsmin', output='scripts/app.js')
 
 vendor_css = Bundle('vendor/semantic.min.css', output='styles/vendor.css')
 
+# Scripts every page needs; the inline scripts in templates use jQuery.
 vendor_js = Bundle(
     'vendor/jquery.min.js',
     'vendor/semantic.min.js',
     'vendor/tablesort.min.js',
-    'vendor/zxcvbn.js',
-    'vendor/chart.min.js',
     filters='jsmin',
     output='scripts/vendor.js')
+
+# Scripts only some pages need, loaded by those templates with the
+# `scripts` macro in macros/asset_macros.html.
+password_js = Bundle(
+    'vendor/zxcvbn.js', filters='jsmin', output='scripts/password.js')
+
+chart_js = Bundle(
+    'vendor/chart.min.js', filters='jsmin', output='scripts/chart.js')
+
+BUNDLES = {
+    'app_css': app_css,
+    'app_js': app_js,
+    'chart_js': chart_js,
+    'password_js': password_js,
+    'vendor_css': vendor_css,
+    'vendor_js': vendor_js
+}
+
+
+def init_environment(app):
+    """Set up Flask-Assets for `app` with the bundles above."""
+    assets_env = Environment(app)
+    dirs = ['assets/styles', 'assets/scripts']
+    for path in dirs:
+        assets_env.append_path(os.path.join(app.root_path, path))
+    assets_env.url_expire = True
+
+    for name, bundle in sorted(BUNDLES.items()):
+        assets_env.register(name, bundle)
+    return assets_env
+
+
+def fingerprint(path, data):
+    """Return `path` with a hash of `data` before its extension."""
+    root, ext = os.path.splitext(path)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return '{}.{}{}'.format(root, digest, ext)
+
+
+def gzipped(data):
+    out = io.BytesIO()
+    # No file name or time in the header, so builds are reproducible.
+    with gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                       fileobj=out, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build_assets(app, names=None):
+    """
+    Build the bundles in `names` (all by default) into fingerprinted,
+    compressed files in the static folder and write their manifest to
+    ASSETS_MANIFEST_FILE. Returns the manifest.
+    """
+    assets_env = getattr(app.jinja_env, 'assets_environment', None) or \
+        init_environment(app)
+    manifest = {}
+    with app.app_context():
+        for name in sorted(names or BUNDLES):
+            bundle = assets_env[name]
+            bundle.build(force=True)
+            with open(os.path.join(app.static_folder, bundle.output),
+                      'rb') as f:
+                data = f.read()
+            path = fingerprint(bundle.output, data)
+            target = os.path.join(app.static_folder, path)
+            write(target, data)
+            write(target + '.gz', gzipped(data))
+            if brotli is not None:
+                write(target + '.br', brotli.compress(data))
+            manifest[name] = path
+    with open(app.config['ASSETS_MANIFEST_FILE'], 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def compress_static(app):
+    """
+    Write compressed siblings of the other text files in the static
+    folder at least COMPRESS_MIN_SIZE bytes long, unless they are up to
+    date. Returns the number of files compressed.
+    """
+    from .static_files import ENCODINGS, compressible
+
+    count = 0
+    for root, dirs, files in os.walk(app.static_folder):
+        for filename in files:
+            mimetype = mimetypes.guess_type(filename)[0]
+            if mimetype is None or not compressible(mimetype):
+                continue
+            path = os.path.join(root, filename)
+            if os.path.getsize(path) < app.config['COMPRESS_MIN_SIZE']:
+                continue
+            mtime = os.path.getmtime(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                if os.path.exists(path + suffix) and \
+                        os.path.getmtime(path + suffix) >= mtime:
+                    continue
+                write(path + suffix, brotli.compress(data)
+                      if encoding == 'br' else gzipped(data))
+                count += 1
+    return count
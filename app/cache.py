@@ -0,0 +1,265 @@
+"""
+Small caches shared by the app.
+
+`LRUCache` is an in-process least recently used cache whose entries expire
+after a TTL. `RedisCache` stores JSON values in Redis so every web process
+shares them. `TieredCache` puts the two together as a Flask extension:
+reads go to the in-process tier first and fall back to Redis, which is
+only used when `<PREFIX>_REDIS` is set. Its settings are read from the
+app config under a prefix:
+
+    <PREFIX>_SIZE   entries kept in process
+    <PREFIX>_TTL    seconds an entry lives in either tier
+    <PREFIX>_REDIS  also use Redis as a second tier
+
+`Invalidations` tells every process to drop its copies of changed data,
+over Redis pub/sub when CACHE_PUBSUB is set.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from redis import RedisError, StrictRedis
+
+# Redis channel on which invalidations are announced
+INVALIDATION_CHANNEL = 'invalidate'
+# Seconds between attempts to resubscribe after losing Redis
+RESUBSCRIBE_DELAY = 5
+# Functions dropping this process's copies, by kind of data
+_handlers = {}
+
+
+class LRUCache(object):
+    def __init__(self, size=1024, ttl=60, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < self.clock():
+                return None
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+            self.entries[key] = (value, self.clock() + (ttl or self.ttl))
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache(object):
+    def __init__(self, redis, prefix, ttl=60):
+        self.redis = redis
+        self.prefix = prefix + ':'
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.redis.get(self.prefix + str(key))
+        return None if value is None else json.loads(value.decode('utf-8'))
+
+    def set(self, key, value):
+        self.redis.setex(self.prefix + str(key), self.ttl, json.dumps(value))
+
+    def delete(self, key):
+        self.redis.delete(self.prefix + str(key))
+
+
+def redis_connection(app):
+    """Connect to the Redis server RQ is configured to use."""
+    return StrictRedis(
+        host=app.config['RQ_DEFAULT_HOST'],
+        port=app.config['RQ_DEFAULT_PORT'],
+        db=app.config['RQ_DEFAULT_DB'],
+        password=app.config['RQ_DEFAULT_PASSWORD'])
+
+
+class TieredCache(object):
+    """
+    An in-process `LRUCache` backed by an optional `RedisCache`. Values
+    must be JSON serializable. Redis errors are logged and treated as
+    misses, so the cache degrades to the in-process tier.
+    """
+
+    def __init__(self, prefix, app=None):
+        self.prefix = prefix
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        ttl = config.get(self.prefix + '_TTL', 60)
+        tiers = [LRUCache(config.get(self.prefix + '_SIZE', 1024), ttl)]
+        if config.get(self.prefix + '_REDIS'):
+            tiers.append(RedisCache(redis_connection(app),
+                                    self.prefix.lower(), ttl))
+        app.extensions[self.extension] = tiers
+
+    @property
+    def extension(self):
+        return 'cache:' + self.prefix
+
+    @property
+    def tiers(self):
+        return current_app.extensions[self.extension]
+
+    def get(self, key):
+        local, remote = self._split()
+        value = local.get(key)
+        if value is None and remote is not None:
+            value = self._remote(remote.get, key)
+            if value is not None:
+                local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        local, remote = self._split()
+        local.set(key, value)
+        if remote is not None:
+            self._remote(remote.set, key, value)
+
+    def delete(self, key):
+        local, remote = self._split()
+        local.delete(key)
+        if remote is not None:
+            self._remote(remote.delete, key)
+
+    def clear(self):
+        """Empty the in-process tier; Redis entries expire by TTL."""
+        self.tiers[0].clear()
+
+    def forget(self, key=None):
+        """Drop `key`, or every entry if None, from the in-process tier."""
+        if key is None:
+            self.clear()
+        else:
+            self.tiers[0].delete(key)
+
+    def _split(self):
+        tiers = self.tiers
+        return tiers[0], tiers[1] if len(tiers) > 1 else None
+
+    def _remote(self, method, *args):
+        try:
+            return method(*args)
+        except RedisError as e:
+            current_app.logger.warning('%s cache: %s', self.prefix, e)
+            return None
+
+
+def invalidation_handler(kind):
+    """
+    Register a function dropping this process's copy of `kind` data. It
+    is called in an app context with the key to drop, or None for all.
+    """
+    def decorator(f):
+        _handlers[kind] = f
+        return f
+
+    return decorator
+
+
+class Invalidations(object):
+    """
+    Drops data every process keeps a copy of. `publish(kind, key)` runs
+    the handler registered for `kind` here and announces it on a Redis
+    channel, on which a listener thread in every process runs its own
+    handler. Whenever the listener (re)subscribes, every handler is run
+    with None, as announcements made while unsubscribed were missed.
+    `subscribed` is False while announcements may be missed, e.g. when
+    Redis is unreachable. Without CACHE_PUBSUB other processes only see
+    changes once their copies expire.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.redis = None
+        if app.config['CACHE_PUBSUB']:
+            self.redis = redis_connection(app)
+        self.subscribed = self.redis is None
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def listening(self):
+        """Start the listener if needed and return `subscribed`."""
+        self.start_listener()
+        return self.subscribed
+
+    def invalidate(self, kind, key=None):
+        """Run the handler of `kind` in this process."""
+        if has_app_context():
+            _handlers[kind](key)
+        else:
+            with self.app.app_context():
+                _handlers[kind](key)
+
+    def publish(self, kind, key=None):
+        self.invalidate(kind, key)
+        if self.redis is None:
+            return
+        message = kind if key is None else '{}:{}'.format(kind, key)
+        try:
+            self.redis.publish(INVALIDATION_CHANNEL, message)
+        except RedisError as e:
+            self.app.logger.warning('Could not announce %s: %s', message, e)
+
+    def start_listener(self):
+        if self.redis is None or \
+                (self.listener is not None and self.listener.is_alive()):
+            return
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen)
+                self.listener.daemon = True
+                self.listener.start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        for kind in list(_handlers):
+                            self.invalidate(kind)
+                        self.subscribed = True
+                    elif message['type'] == 'message':
+                        kind, _, key = \
+                            message['data'].decode('utf-8').partition(':')
+                        if kind in _handlers:
+                            self.invalidate(kind, key or None)
+            except RedisError as e:
+                self.app.logger.warning('Invalidation listener: %s', e)
+            self.subscribed = False
+            time.sleep(RESUBSCRIBE_DELAY)
+
+
+def invalidations():
+    """Return the current app's `Invalidations`."""
+    extensions = current_app.extensions
+    result = extensions.get('invalidations')
+    if result is None:
+        result = extensions['invalidations'] = Invalidations(
+            current_app._get_current_object())
+    return result
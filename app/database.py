@@ -0,0 +1,185 @@
+"""
+Database connection pool.
+
+Flask-SQLAlchemy sizes the pool from SQLALCHEMY_POOL_SIZE,
+SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_TIMEOUT and
+SQLALCHEMY_POOL_RECYCLE. `SQLAlchemy` here adds to that:
+
+- connections are tested with `SELECT 1` when checked out, when
+  SQLALCHEMY_POOL_PRE_PING is set, so one the server closed is replaced
+  instead of failing a request;
+- in web requests, PostgreSQL aborts statements running longer than
+  SQLALCHEMY_STATEMENT_TIMEOUT seconds. The limit is set per
+  transaction with SET LOCAL, so background jobs and `manage.py`
+  commands, which may rebuild rollups over the whole history, run
+  without it;
+- SQLite databases in a file get a pool too when a pool size is set,
+  rather than a new connection per checkout;
+- the pool counts checkouts, the time spent getting a connection and
+  checkouts that timed out. `pool_status` reports them with the
+  connections in use, served at /admin/db/pool and /metrics.
+
+Every process has its own pool, so the database sees up to workers x
+(SQLALCHEMY_POOL_SIZE + SQLALCHEMY_MAX_OVERFLOW) connections.
+"""
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats(object):
+    """Checkout counters of one pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.disconnects = 0
+
+    def record(self, seconds, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds,
+                'timeouts': self.timeouts,
+                'disconnects': self.disconnects
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """A `QueuePool` recording in `stats` how long checkouts wait."""
+
+    def __init__(self, creator, stats=None, **kw):
+        super(TimedQueuePool, self).__init__(creator, **kw)
+        self.stats = stats or PoolStats()
+        self._getting = threading.local()
+
+    def _do_get(self):
+        # QueuePool._do_get calls itself again when it loses a race for
+        # an overflow slot; only time the outermost call.
+        if getattr(self._getting, 'active', False):
+            return super(TimedQueuePool, self)._do_get()
+        self._getting.active = True
+        start = time.time()
+        try:
+            connection = super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.time() - start, timed_out=True)
+            raise
+        finally:
+            self._getting.active = False
+        self.stats.record(time.time() - start)
+        return connection
+
+    def recreate(self):
+        # Keep counting across `engine.dispose()`.
+        pool = super(TimedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def pre_ping(stats):
+    """Return a checkout listener replacing connections that are gone."""
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            with stats.lock:
+                stats.disconnects += 1
+            # The pool discards this connection and checks out another.
+            raise exc.DisconnectionError()
+    return checkout
+
+
+def limit_statements():
+    """Have the statements of this request time out."""
+    g.statement_timeout = current_app.config.get(
+        'SQLALCHEMY_STATEMENT_TIMEOUT')
+
+
+@event.listens_for(Engine, 'begin')
+def statement_timeout(conn):
+    """Limit the statements of a transaction begun in a web request."""
+    timeout = has_app_context() and g.get('statement_timeout')
+    if timeout and conn.dialect.name == 'postgresql':
+        # SET LOCAL lasts until the transaction ends. Run on the DBAPI
+        # connection so request metrics do not count it.
+        cursor = conn.connection.cursor()
+        cursor.execute('SET LOCAL statement_timeout = {:d}'.format(
+            int(timeout * 1000)))
+        cursor.close()
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    def init_app(self, app):
+        super(SQLAlchemy, self).init_app(app)
+        # Only requests run before_request handlers; `manage.py` commands
+        # run in a test request context that skips them.
+        app.before_request(limit_statements)
+
+    def apply_driver_hacks(self, app, info, options):
+        config = app.config
+        in_memory = info.database in (None, '', ':memory:')
+        if info.drivername == 'sqlite' and not in_memory and \
+                options.get('pool_size'):
+            options['poolclass'] = TimedQueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = \
+                False
+        elif info.drivername == 'sqlite':
+            # Flask-SQLAlchemy picks StaticPool or NullPool, neither of
+            # which takes these.
+            for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(option, None)
+        else:
+            options.setdefault('poolclass', TimedQueuePool)
+
+        if options.get('poolclass') is TimedQueuePool:
+            options['stats'] = stats = PoolStats()
+            if config.get('SQLALCHEMY_POOL_PRE_PING'):
+                options.setdefault('pool_events', []).append(
+                    (pre_ping(stats), 'checkout'))
+
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+
+def pool_status(engine):
+    """
+    Return the size and use of `engine`'s pool and, if it is timed, its
+    checkout counters.
+    """
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            # Negative while fewer than `size` connections are open
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool._timeout
+        })
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        status.update(stats.as_dict())
+    return status
@@ -1,20 +1,388 @@
-import os
+import atexit
+import smtplib
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 
-from flask import render_template
-from flask_mail import Message
+from flask import current_app, render_template
+from flask_mail import Connection, Message
+from markupsafe import escape
 
-from app import create_app
+from app import job_app
 
-from . import mail
+# SMTP failures worth retrying on a fresh connection: dropped or refused
+# connections, timeouts and 4xx (temporary) replies.
+TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                    socket.error)
+
+
+def is_transient(error):
+    # SMTP errors are OSErrors too, so check their reply code first.
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class SMTPPool(object):
+    """
+    Keeps up to `size` authenticated SMTP connections open between sends.
+    A connection idle for more than `keepalive` seconds is checked with a
+    NOOP before it is handed out again.
+    """
+
+    def __init__(self, app, size=1, keepalive=60):
+        self.state = app.extensions['mail']
+        self.size = size
+        self.keepalive = keepalive
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                connection, since = self.idle.pop()
+            if time.time() - since < self.keepalive or self.alive(connection):
+                return connection
+            self.discard(connection)
+        connection = Connection(self.state).__enter__()
+        self.opened += 1
+        return connection
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((connection, time.time()))
+                return
+        self.discard(connection)
+
+    @staticmethod
+    def alive(connection):
+        if connection.host is None:  # sending is suppressed
+            return True
+        try:
+            return connection.host.noop()[0] == 250
+        except (smtplib.SMTPException, socket.error):
+            return False
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, socket.error):
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.discard(connection)
+
+
+class BatchMailer(object):
+    """
+    Sends messages over pooled SMTP connections. A message failing with a
+    transient error is retried on a new connection up to `max_retries`
+    times, waiting `backoff` seconds and doubling the wait after each
+    attempt. With a batch size of 1 every message is sent, and any error
+    raised, before `send` returns. Inside `batches(size)` messages are
+    queued and sent `size` per connection instead, and whatever is left
+    is sent when the block ends.
+    """
+
+    def __init__(self, app, batch_size=1, pool_size=1, keepalive=60,
+                 max_retries=3, backoff=0.5, sleep=time.sleep):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.pool = SMTPPool(app, pool_size, keepalive)
+        self.queue = deque()
+        self.flush_lock = threading.Lock()
+        self.stats = {'sent': 0, 'failed': 0, 'retries': 0, 'batches': 0}
+
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        return cls(app,
+                   pool_size=config['MAIL_POOL_SIZE'],
+                   keepalive=config['MAIL_KEEPALIVE'],
+                   max_retries=config['MAIL_MAX_RETRIES'],
+                   backoff=config['MAIL_RETRY_BACKOFF'])
+
+    def send(self, message):
+        self.queue.append(message)
+        if len(self.queue) >= self.batch_size:
+            self.flush()
+
+    @contextmanager
+    def batches(self, size):
+        """Send the messages of this block `size` per connection."""
+        previous, self.batch_size = self.batch_size, size
+        try:
+            yield self
+            self.flush()
+        finally:
+            self.batch_size = previous
+            # Unsent after an error; the failed job is retried as a whole.
+            self.queue.clear()
+
+    def flush(self):
+        """Send everything queued so far, one batch per connection."""
+        with self.flush_lock, self.app.app_context():
+            while self.queue:
+                batch = []
+                while self.queue and len(batch) < self.batch_size:
+                    batch.append(self.queue.popleft())
+                self.send_batch(batch)
+
+    def send_batch(self, batch):
+        connection = None
+        try:
+            for i, message in enumerate(batch):
+                try:
+                    connection = self.deliver(connection, message)
+                except Exception:
+                    # Keep the rest of the batch for the next flush.
+                    self.queue.extendleft(reversed(batch[i + 1:]))
+                    raise
+        finally:
+            if connection is not None:
+                self.pool.release(connection)
+        self.stats['batches'] += 1
+
+    def deliver(self, connection, message):
+        """Send one message, returning the connection to keep using."""
+        attempt = 0
+        while True:
+            try:
+                if connection is None:
+                    connection = self.pool.acquire()
+                connection.send(message)
+                self.stats['sent'] += 1
+                return connection
+            except Exception as e:
+                if not is_transient(e):
+                    self.stats['failed'] += 1
+                    if self.batch_size == 1:
+                        raise
+                    self.app.logger.error('Dropping email to %s: %s',
+                                          ', '.join(message.send_to), e)
+                    return connection
+                if connection is not None:
+                    self.pool.discard(connection)
+                    connection = None
+                if attempt >= self.max_retries:
+                    self.stats['failed'] += 1
+                    raise
+                self.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+                self.stats['retries'] += 1
+
+    def close(self):
+        if self.queue:
+            self.flush()
+        self.pool.close()
+
+
+# Mailer shared by the jobs of this worker process
+_mailer = None
+
+
+def get_mailer():
+    global _mailer
+    if _mailer is None:
+        _mailer = BatchMailer.from_config(job_app())
+    return _mailer
+
+
+@atexit.register
+def close_mailer():
+    global _mailer
+    if _mailer is not None:
+        _mailer.close()
+        _mailer = None
+
+
+# Wraps the index of a per-recipient field in a rendered skeleton.
+MARKER = '\x1f'
+# Skeletons kept per app, least recently used dropped first.
+SKELETON_CACHE_SIZE = 64
+
+
+class Field(object):
+    """
+    Stands in for a per-recipient template variable while a skeleton is
+    rendered. Attribute lookups and calls are recorded, so `user.email`
+    and `user.full_name()` can be replayed against each recipient, and
+    printing the field leaves a marker in the output.
+    """
+
+    def __init__(self, paths, path):
+        self._paths = paths
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return Field(self._paths, self._path + (name, ))
+
+    def __call__(self):
+        return Field(self._paths, self._path + ((), ))
+
+    def __str__(self):
+        index = self._paths.setdefault(self._path, len(self._paths))
+        return '{0}{1}{0}'.format(MARKER, index)
+
+    def __bool__(self):
+        raise TypeError('{} differs per recipient and cannot be tested in '
+                        'a bulk email template'.format('.'.join(
+                            p for p in self._path if p != ())))
+
+    __nonzero__ = __bool__
+    __len__ = __iter__ = __bool__
+
+
+def resolve(value, path):
+    """Follow a recorded `Field` path, looking items up like Jinja."""
+    for step in path:
+        if step == ():
+            value = value()
+        else:
+            try:
+                value = getattr(value, step)
+            except AttributeError:
+                value = value[step]
+    return value
+
+
+class EmailSkeleton(object):
+    """
+    An email template rendered once with its per-recipient `fields` left
+    as markers. `render` then only joins the static text with each
+    recipient's values, escaping them for the HTML part. Fields must be
+    printed as-is: filters or conditions on them cannot be replayed.
+    """
+
+    def __init__(self, template, fields, **context):
+        paths = {}
+        context.update((name, Field(paths, (name, ))) for name in fields)
+        self.text = render_template(template + '.txt',
+                                    **context).split(MARKER)
+        self.html = render_template(template + '.html',
+                                    **context).split(MARKER)
+        self.paths = sorted(paths, key=paths.get)
+
+    def render(self, **values):
+        """Return the `(text, html)` bodies for one recipient."""
+        resolved = [
+            str(resolve(values[path[0]], path[1:])) for path in self.paths
+        ]
+        return (self.join(self.text, resolved),
+                self.join(self.html, [escape(value) for value in resolved]))
+
+    @staticmethod
+    def join(parts, values):
+        parts = list(parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = values[int(parts[i])]
+        return ''.join(parts)
+
+
+def get_skeleton(template, fields, **context):
+    """Return the current app's cached skeleton for a template."""
+    cache = current_app.extensions.setdefault('email_skeletons',
+                                              OrderedDict())
+    key = (template, tuple(sorted(fields)), tuple(sorted(context.items())))
+    try:
+        skeleton = cache.pop(key, None)
+    except TypeError:  # unhashable shared context
+        return EmailSkeleton(template, fields, **context)
+    if skeleton is None:
+        skeleton = EmailSkeleton(template, fields, **context)
+        if len(cache) >= SKELETON_CACHE_SIZE:
+            cache.popitem(last=False)
+    cache[key] = skeleton
+    return skeleton
+
+
+class MailUser(object):
+    """
+    The parts of a `User` the email templates use, passed to `send_email`
+    jobs instead of the ORM instance so the payload stays a few plain
+    values and the worker needs no database session to render it.
+    """
+    __slots__ = ('id', 'name', 'email')
+
+    def __init__(self, id, name, email):
+        self.id = id
+        self.name = name
+        self.email = email
+
+    @classmethod
+    def of(cls, user):
+        return cls(user.id, user.full_name(), user.email)
+
+    def full_name(self):
+        return self.name
+
+    def __reduce__(self):
+        return MailUser, (self.id, self.name, self.email)
+
+    def __repr__(self):
+        return '<MailUser {}>'.format(self.id)
+
+
+def make_message(app, recipient, subject, body, html):
+    msg = Message(
+        app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
+        sender=app.config['EMAIL_SENDER'],
+        recipients=[recipient])
+    msg.body = body
+    msg.html = html
+    return msg
 
 
 def send_email(recipient, subject, template, **kwargs):
-    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    """
+    Send one email before the job returns, so delivery errors fail the
+    job and RQ sees them.
+    """
+    app = job_app()
     with app.app_context():
-        msg = Message(
-            app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
-            sender=app.config['EMAIL_SENDER'],
-            recipients=[recipient])
-        msg.body = render_template(template + '.txt', **kwargs)
-        msg.html = render_template(template + '.html', **kwargs)
-        mail.send(msg)
+        try:
+            body, html = get_skeleton(template, kwargs).render(**kwargs)
+        except TypeError:  # the template tests a field; render it fully
+            body = render_template(template + '.txt', **kwargs)
+            html = render_template(template + '.html', **kwargs)
+    get_mailer().send(make_message(app, recipient, subject, body, html))
+
+
+def send_bulk_email(recipients, subject, template, **context):
+    """
+    Send `template` to many recipients, rendering it once. `recipients`
+    holds one dict per email with its `recipient` address and the fields
+    that differ per recipient (say `user` and `invite_link`); `context`
+    is shared by all of them. Messages go out MAIL_BATCH_SIZE per SMTP
+    connection and all are sent before the job ends. Returns the number
+    of messages sent.
+    """
+    app = job_app()
+    mailer = get_mailer()
+    count, fields, skeleton = 0, None, None
+    with app.app_context(), mailer.batches(app.config['MAIL_BATCH_SIZE']):
+        for values in recipients:
+            values = dict(values)
+            recipient = values.pop('recipient')
+            if set(values) != fields:
+                fields = set(values)
+                skeleton = get_skeleton(template, fields, **context)
+            body, html = skeleton.render(**values)
+            mailer.send(make_message(app, recipient, subject, body, html))
+            count += 1
+    return count
@@ -0,0 +1,8 @@
+"""
+Report ingest: turning uploaded network reports into `user_earning` rows.
+"""
+from .bulk import IngestResult, bulk_upsert_user_data, rows_from_parsed  # noqa
+from .parsers import (PARSERS, ReportParser, date_parser, get_parser,  # noqa
+                      iter_report, parse_33across, register_parser)
+from .routing import SiteRouter  # noqa
+from .jobs import JobProgress, ingest_report, run_ingest  # noqa
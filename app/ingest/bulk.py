@@ -0,0 +1,240 @@
+import sqlite3
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import and_, func, literal_column, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Insert
+
+from .. import db
+from ..models import UserData
+
+# SQLite learnt INSERT ... ON CONFLICT in 3.24.
+SQLITE_UPSERT_VERSION = (3, 24, 0)
+# The unique index on user_earning that identifies a row.
+KEY_COLUMNS = ('site', 'channel', 'day')
+# Columns replaced when an existing row is overwritten.
+UPDATE_COLUMNS = ('user_id', 'revenue')
+
+
+class IngestResult(object):
+    """Counts and the affected range of a bulk ingest."""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.batches = 0
+        self.first_day = None
+        self.last_day = None
+        self.user_ids = set()
+        self.site_ids = set()
+
+    @property
+    def changed(self):
+        return self.inserted + self.updated
+
+    def track(self, row):
+        day = row['day']
+        if self.first_day is None or day < self.first_day:
+            self.first_day = day
+        if self.last_day is None or day > self.last_day:
+            self.last_day = day
+        self.user_ids.add(row['user_id'])
+        self.site_ids.add(row['site'])
+
+    def __str__(self):
+        return '{} rows inserted, {} updated, {} skipped'.format(
+            self.inserted, self.updated, self.skipped)
+
+
+class SQLiteUpsert(Insert):
+    """
+    INSERT ... ON CONFLICT for SQLite (3.24+), which SQLAlchemy 1.1 has no
+    construct for. With `update_columns` the conflicting row is updated
+    only when one of those columns actually changes. With `add_columns`
+    the inserted values are added to those of the conflicting row.
+    """
+
+    def __init__(self, table, index_elements, update_columns=(),
+                 add_columns=(), **kw):
+        super(SQLiteUpsert, self).__init__(table, **kw)
+        self.index_elements = index_elements
+        self.update_columns = update_columns
+        self.add_columns = add_columns
+
+
+@compiles(SQLiteUpsert, 'sqlite')
+def compile_sqlite_upsert(insert, compiler, **kw):
+    sql = compiler.visit_insert(insert, **kw)
+    sql += ' ON CONFLICT ({}) '.format(', '.join(insert.index_elements))
+    if insert.add_columns:
+        return sql + 'DO UPDATE SET {}'.format(', '.join(
+            '{0} = {1}.{0} + excluded.{0}'.format(c, insert.table.name)
+            for c in insert.add_columns))
+    if not insert.update_columns:
+        return sql + 'DO NOTHING'
+    return sql + 'DO UPDATE SET {} WHERE {}'.format(
+        ', '.join('{0} = excluded.{0}'.format(c)
+                  for c in insert.update_columns),
+        ' OR '.join('{0}.{1} IS NOT excluded.{1}'.format(
+            insert.table.name, c) for c in insert.update_columns))
+
+
+def rows_from_parsed(records, user_id, site_id, channel_id):
+    """Turn the `(day, revenue)` records of a parser into rows."""
+    for day, revenue in records:
+        yield {
+            'user_id': user_id,
+            'site': site_id,
+            'channel': channel_id,
+            'day': day,
+            'revenue': revenue
+        }
+
+
+def _key(row):
+    return tuple(row[c] for c in KEY_COLUMNS)
+
+
+def _batches(rows, size):
+    """
+    Group rows into batches of up to `size` keys, summing the revenue of
+    rows sharing a key within a batch.
+    """
+    batch = OrderedDict()
+    for row in rows:
+        key = _key(row)
+        if key in batch:
+            batch[key]['revenue'] += row['revenue']
+            continue
+        batch[key] = dict(row)
+        if len(batch) == size:
+            yield list(batch.values())
+            batch = OrderedDict()
+    if batch:
+        yield list(batch.values())
+
+
+def _upsert_postgresql(table, batch, update, result):
+    stmt = postgresql.insert(table).values(batch)
+    if not update:
+        stmt = stmt.on_conflict_do_nothing(index_elements=KEY_COLUMNS) \
+            .returning(*[table.c[c] for c in KEY_COLUMNS])
+        inserted = set(tuple(row) for row in db.session.execute(stmt))
+        result.inserted += len(inserted)
+        result.skipped += len(batch) - len(inserted)
+        return set(_key(row) for row in batch) - inserted
+    changed = [table.c[c].isnot_distinct_from(stmt.excluded[c])
+               for c in UPDATE_COLUMNS]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_=dict((c, stmt.excluded[c]) for c in UPDATE_COLUMNS),
+        where=~and_(*changed)).returning(literal_column('(xmax = 0)'))
+    # xmax is zero for freshly inserted tuples and set for updated ones.
+    outcome = [row[0] for row in db.session.execute(stmt)]
+    inserted = sum(1 for was_inserted in outcome if was_inserted)
+    result.inserted += inserted
+    result.updated += len(outcome) - inserted
+    result.skipped += len(batch) - len(outcome)
+    return set()
+
+
+def _add_postgresql(table, batch):
+    stmt = postgresql.insert(table).values(batch)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={'revenue': table.c.revenue + stmt.excluded.revenue}))
+
+
+def _existing(table, batch):
+    """Return the keys of the rows in `batch` that are in `table`."""
+    key = tuple_(*[table.c[c] for c in KEY_COLUMNS])
+    return set(tuple(row) for row in db.session.execute(
+        db.select([table.c[c] for c in KEY_COLUMNS]).where(
+            key.in_([_key(row) for row in batch]))))
+
+
+def _upsert_sqlite(table, batch, update, result):
+    # SQLite reports no keys and counts inserts and updates alike, so the
+    # rows that already exist are looked up first to tell them apart.
+    existing = _existing(table, batch)
+    if not update:
+        stmt = SQLiteUpsert(table, KEY_COLUMNS).values(batch)
+        db.session.execute(stmt)
+        result.inserted += len(batch) - len(existing)
+        result.skipped += len(existing)
+        return existing
+    stmt = SQLiteUpsert(table, KEY_COLUMNS, UPDATE_COLUMNS).values(batch)
+    changed = db.session.execute(stmt).rowcount
+    inserted = len(batch) - len(existing)
+    result.inserted += inserted
+    result.updated += changed - inserted
+    result.skipped += len(existing) - (changed - inserted)
+    return set()
+
+
+def _add_sqlite(table, batch):
+    db.session.execute(SQLiteUpsert(
+        table, KEY_COLUMNS, add_columns=('revenue',)).values(batch))
+
+
+# For each dialect: a function writing a batch of new keys, which
+# returns the keys it left alone, and one adding a batch to the rows
+# written for its keys by earlier batches.
+UPSERTS = {
+    'postgresql': (_upsert_postgresql, _add_postgresql),
+    'sqlite': (_upsert_sqlite, _add_sqlite),
+}
+
+
+def bulk_upsert_user_data(rows, update=False, batch_size=None,
+                          progress=None):
+    """
+    Write `user_earning` rows with one multi-row INSERT ... ON CONFLICT
+    statement per batch, reading `rows` one batch at a time. Rows whose
+    (site, channel, day) already exists are skipped, or overwritten when
+    `update` is set. Rows sharing a key are summed: within a batch before
+    writing, and across batches by adding to the row an earlier batch
+    wrote. Only the keys seen so far are kept in memory for that, not the
+    rows. Everything is committed at the end and the returned IngestResult
+    holds the counts and the range to refresh rollups for. `progress` is
+    called with the running IngestResult after each batch.
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in UPSERTS:
+        raise ValueError('Bulk ingest does not support {}'.format(dialect))
+    if dialect == 'sqlite' and \
+            sqlite3.sqlite_version_info < SQLITE_UPSERT_VERSION:
+        raise ValueError(
+            'Bulk ingest needs SQLite 3.24 or later, this is {}'.format(
+                sqlite3.sqlite_version))
+    upsert, add = UPSERTS[dialect]
+    batch_size = batch_size or current_app.config['INGEST_BATCH_SIZE']
+    table = UserData.__table__
+
+    result = IngestResult()
+    # Whether this run wrote the row of each key seen so far.
+    written = {}
+    for batch in _batches(rows, batch_size):
+        new, repeated = [], []
+        for row in batch:
+            result.track(row)
+            key = _key(row)
+            if key not in written:
+                new.append(row)
+            elif written[key]:
+                repeated.append(row)
+        if new:
+            left_alone = upsert(table, new, update, result)
+            for row in new:
+                key = _key(row)
+                written[key] = key not in left_alone
+        if repeated:
+            add(table, repeated)
+        result.batches += 1
+        if progress is not None:
+            progress(result)
+    db.session.commit()
+    return result
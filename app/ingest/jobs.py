@@ -0,0 +1,123 @@
+import os
+import time
+
+from rq import get_current_job
+
+from ..models import Sites, refresh_revenue_rollups
+from .bulk import bulk_upsert_user_data
+from .parsers import get_parser, iter_report
+from .routing import SiteRouter
+
+
+class JobProgress(object):
+    """
+    Publishes ingest progress in the meta of the current RQ job, at most
+    once per `interval` seconds. Outside of a worker it only counts.
+    """
+
+    def __init__(self, job=None, interval=1.0):
+        self.job = job
+        self.interval = interval
+        self.started = time.time()
+        self.stage_started = self.started
+        self.saved = 0
+        self.meta = {
+            'stage': 'queued',
+            'rows_parsed': 0,
+            'rows_written': 0,
+            'rate': 0.0
+        }
+
+    def stage(self, name):
+        self.stage_started = time.time()
+        self.update(True, stage=name, rate=0.0)
+
+    def update(self, force=False, **fields):
+        self.meta.update(fields)
+        now = time.time()
+        if self.job is None or (not force and
+                                now - self.saved < self.interval):
+            return
+        self.meta['elapsed'] = round(now - self.started, 2)
+        self.job.meta.update(self.meta)
+        self.job.save()
+        self.saved = now
+
+    def rate(self, count):
+        elapsed = time.time() - self.stage_started
+        return round(count / elapsed, 1) if elapsed > 0 else 0.0
+
+    def parsed(self, records):
+        """Pass `records` through while counting them."""
+        count = 0
+        for count, record in enumerate(records, 1):
+            if count % 1000 == 0:
+                self.update(rows_parsed=count, rate=self.rate(count))
+            yield record
+        self.update(True, rows_parsed=count, rate=self.rate(count))
+
+    def written(self, result):
+        """
+        Progress callback for `bulk_upsert_user_data`, which writes while
+        the report is still being parsed.
+        """
+        self.update(rows_written=result.inserted + result.updated +
+                    result.skipped)
+
+
+def run_ingest(path, network, channel_id, site_ids=None, overwrite=False,
+               progress=None):
+    """
+    Parse the report at `path` with the parser registered for `network`
+    and bulk-write it for `site_ids`, or for every site it mentions when
+    None. Returns a summary dict; the job result shown by the status view.
+    """
+    progress = progress or JobProgress()
+    parser = get_parser(network)
+    if parser is None:
+        raise ValueError('There is no report parser for {}.'.format(network))
+
+    if site_ids is None:
+        router = SiteRouter()
+        links = None
+    else:
+        router = SiteRouter(Sites.query.filter(Sites.id.in_(site_ids)).all())
+        links = list(router.index)
+
+    progress.stage('ingesting')
+    records = progress.parsed(iter_report(path, parser, links))
+    result = bulk_upsert_user_data(
+        router.rows(records, channel_id), update=overwrite,
+        progress=progress.written)
+
+    if result.changed:
+        progress.stage('refreshing')
+        refresh_revenue_rollups(
+            result.first_day, result.last_day, user_ids=result.user_ids)
+
+    summary = {
+        'inserted': result.inserted,
+        'updated': result.updated,
+        'skipped': result.skipped,
+        'sites': len(result.site_ids),
+        'unmatched': sorted(router.unmatched),
+        'message': str(result)
+    }
+    progress.update(True, stage='done')
+    return summary
+
+
+def ingest_report(path, network, channel_id, site_ids=None, overwrite=False):
+    """
+    RQ job wrapping `run_ingest` in an application context. The uploaded
+    report at `path` is deleted once the job finishes, whatever the
+    outcome.
+    """
+    from .. import job_app
+    try:
+        with job_app().app_context():
+            return run_ingest(path, network, channel_id, site_ids,
+                              overwrite, JobProgress(get_current_job()))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
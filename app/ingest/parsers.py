@@ -0,0 +1,120 @@
+import csv
+from datetime import datetime
+
+# Report parsers by lower-cased `Channels.name`.
+PARSERS = {}
+
+
+def date_parser(date_format):
+    """Return a cached `str -> date` parser; reports repeat a few dates."""
+    cache = {}
+
+    def parse(value):
+        day = cache.get(value)
+        if day is None:
+            day = cache[value] = datetime.strptime(value, date_format).date()
+        return day
+
+    return parse
+
+
+class ReportParser(object):
+    """
+    Describes one network's CSV report: which header holds the day, the
+    site and the revenue, how dates and amounts are written (currency
+    symbol, thousands and decimal separators) and how many banner lines
+    precede the header. All parsers share `iter_report`.
+    """
+
+    def __init__(self, channel, day_column, site_column, revenue_column,
+                 date_format='%Y-%m-%d', currency='$', thousands=',',
+                 decimal='.', skip_lines=0, delimiter=','):
+        self.channel = channel
+        self.day_column = day_column
+        self.site_column = site_column
+        self.revenue_column = revenue_column
+        self.date_format = date_format
+        self.currency = currency
+        self.thousands = thousands
+        self.decimal = decimal
+        self.skip_lines = skip_lines
+        self.delimiter = delimiter
+
+    def amount(self, value):
+        value = value.strip(self.currency + ' ')
+        if self.thousands and self.thousands in value:
+            value = value.replace(self.thousands, '')
+        if self.decimal != '.':
+            value = value.replace(self.decimal, '.')
+        return float(value) if value else 0.0
+
+    def __repr__(self):
+        return '<ReportParser \'%s\'>' % self.channel
+
+
+def register_parser(parser):
+    PARSERS[parser.channel.lower()] = parser
+    return parser
+
+
+def get_parser(channel):
+    """Return the parser for a channel name, or None if there is none."""
+    return PARSERS.get(channel.lower())
+
+
+def iter_report(file, parser, sites=None):
+    """
+    Stream a report in one pass and yield `(site, day, revenue)` with the
+    site lower-cased and the revenue summed per site over each run of
+    rows sharing a date. Reports are grouped by date, so this holds one
+    day's worth of sites in memory. Only `sites` are kept when given.
+    A site and day may be yielded again if its rows are not contiguous;
+    the bulk ingest sums records sharing a key.
+    """
+    if sites is not None:
+        sites = set(site.lower() for site in sites)
+    parse_day = date_parser(parser.date_format)
+    amount = parser.amount
+    with open(file) as csvfile:
+        for _ in range(parser.skip_lines):
+            next(csvfile)
+        reader = csv.reader(csvfile, delimiter=parser.delimiter)
+        header = next(reader)
+        day_col = header.index(parser.day_column)
+        site_col = header.index(parser.site_column)
+        revenue_col = header.index(parser.revenue_column)
+        width = max(day_col, site_col, revenue_col)
+
+        current, totals = None, {}
+        for line in reader:
+            if len(line) <= width:
+                continue
+            site = line[site_col].lower()
+            if sites is not None and site not in sites:
+                continue
+            day = line[day_col]
+            if day != current:
+                if totals:
+                    current_day = parse_day(current)
+                    for key, revenue in totals.items():
+                        yield key, current_day, revenue
+                current, totals = day, {}
+            totals[site] = totals.get(site, 0.0) + amount(line[revenue_col])
+        if totals:
+            current_day = parse_day(current)
+            for key, revenue in totals.items():
+                yield key, current_day, revenue
+
+
+def parse_33across(file, site):
+    """Stream `(day, revenue)` for `site` out of a 33across report."""
+    for _, day, revenue in iter_report(file, PARSERS['33across'], [site]):
+        yield day, revenue
+
+
+register_parser(ReportParser(
+    '33across',
+    day_column='Date',
+    site_column='Login',
+    revenue_column='Estimated Revenue',
+    skip_lines=1))  # "Generated at:" banner above the header
@@ -0,0 +1,34 @@
+from ..models import Sites
+
+
+class SiteRouter(object):
+    """
+    Routes parsed `(site, day, revenue)` records to the `Sites` row whose
+    link matches case-insensitively, using a lookup index built with one
+    query. Sites missing from the index are collected in `unmatched`.
+    """
+
+    def __init__(self, sites=None):
+        if sites is None:
+            sites = Sites.query.order_by(Sites.id).all()
+        self.index = {}
+        for site in sites:
+            # Links are unique but only case-sensitively; the oldest wins.
+            self.index.setdefault(site.link.lower(), (site.id, site.user_id))
+        self.unmatched = set()
+
+    def rows(self, records, channel_id):
+        """Turn parsed records into `user_earning` rows for `channel_id`."""
+        index = self.index
+        for site, day, revenue in records:
+            target = index.get(site)
+            if target is None:
+                self.unmatched.add(site)
+                continue
+            yield {
+                'user_id': target[1],
+                'site': target[0],
+                'channel': channel_id,
+                'day': day,
+                'revenue': revenue
+            }
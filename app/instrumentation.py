@@ -0,0 +1,228 @@
+"""
+Per-endpoint request metrics.
+
+With INSTRUMENTATION set, every request records its wall time, the number
+of SQL statements it ran and the time spent in them, the time spent
+rendering templates and the size of the response, per endpoint. Requests
+slower than SLOW_REQUEST_THRESHOLD seconds are logged with that breakdown.
+
+The numbers are served in the Prometheus text format at `/metrics`,
+along with the response cache counters and the database pool's use.
+They are kept per process, so every worker is scraped on its own. When
+METRICS_TOKEN is set the endpoint requires it as a bearer token.
+"""
+import copy
+import threading
+import time
+
+from flask import (Response, abort, current_app, g, has_request_context,
+                   request)
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class RequestMetrics(object):
+    """Counters for the request being handled, kept on `g`."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.templates = []
+
+
+class EndpointStats(object):
+    """Totals and a duration histogram for one endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.bytes = 0
+
+    def record(self, seconds, metrics, size):
+        self.count += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.queries += metrics.queries
+        self.query_seconds += metrics.query_seconds
+        self.template_seconds += metrics.template_seconds
+        self.bytes += size
+
+
+def _metrics():
+    if has_request_context():
+        return getattr(g, 'request_metrics', None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _metrics() is not None:
+        conn.info.setdefault('query_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    metrics = _metrics()
+    started = conn.info.get('query_start')
+    if metrics is not None and started:
+        metrics.queries += 1
+        metrics.query_seconds += time.time() - started.pop()
+
+
+def _before_render_template(app, template, context):
+    metrics = _metrics()
+    if metrics is not None:
+        metrics.templates.append(time.time())
+
+
+def _template_rendered(app, template, context):
+    metrics = _metrics()
+    if metrics is not None and metrics.templates:
+        metrics.template_seconds += time.time() - metrics.templates.pop()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Instrumentation(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['instrumentation'] = {
+            'stats': {},
+            'lock': threading.Lock()
+        }
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        before_render_template.connect(_before_render_template, app)
+        template_rendered.connect(_template_rendered, app)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    @property
+    def state(self):
+        return current_app.extensions['instrumentation']
+
+    def start(self):
+        g.request_metrics = RequestMetrics()
+
+    def finish(self, response):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return response
+        seconds = time.time() - metrics.start
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+        endpoint = request.endpoint or '<unmatched>'
+        state = self.state
+        with state['lock']:
+            state['stats'].setdefault(endpoint, EndpointStats()).record(
+                seconds, metrics, size or 0)
+        threshold = current_app.config.get('SLOW_REQUEST_THRESHOLD')
+        if threshold is not None and seconds >= threshold:
+            current_app.logger.warning(
+                'Slow request: %s %s (%s) took %.0f ms, %d queries in '
+                '%.0f ms, templates %.0f ms, %d bytes', request.method,
+                request.full_path.rstrip('?'), endpoint, 1000 * seconds,
+                metrics.queries, 1000 * metrics.query_seconds,
+                1000 * metrics.template_seconds, size or 0)
+        return response
+
+    def stats(self):
+        """Return `{endpoint: EndpointStats}` copies."""
+        state = self.state
+        with state['lock']:
+            return copy.deepcopy(state['stats'])
+
+    def render(self):
+        """Return the metrics in the Prometheus text format."""
+        from . import db, response_cache
+        from .database import pool_status
+
+        stats = sorted(self.stats().items())
+        lines = [
+            '# HELP http_request_duration_seconds Time spent handling '
+            'requests.',
+            '# TYPE http_request_duration_seconds histogram'
+        ]
+        for endpoint, s in stats:
+            label = 'endpoint="{}"'.format(_label(endpoint))
+            for bound, count in zip(LATENCY_BUCKETS, s.buckets):
+                lines.append('http_request_duration_seconds_bucket'
+                             '{{{},le="{}"}} {}'.format(label, bound, count))
+            lines.append('http_request_duration_seconds_bucket'
+                         '{{{},le="+Inf"}} {}'.format(label, s.count))
+            lines.append('http_request_duration_seconds_sum{{{}}} {}'.format(
+                label, s.seconds))
+            lines.append('http_request_duration_seconds_count{{{}}} {}'
+                         .format(label, s.count))
+        counters = (
+            ('db_queries_total', 'SQL statements executed.', 'queries'),
+            ('db_query_seconds_total', 'Time spent in SQL statements.',
+             'query_seconds'),
+            ('template_render_seconds_total', 'Time spent rendering '
+             'templates.', 'template_seconds'),
+            ('http_response_bytes_total', 'Bytes in response bodies.',
+             'bytes'))
+        for name, help, attribute in counters:
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} counter'.format(name))
+            for endpoint, s in stats:
+                lines.append('{}{{endpoint="{}"}} {}'.format(
+                    name, _label(endpoint), getattr(s, attribute)))
+        lines.append('# HELP response_cache_requests_total Cached views '
+                     'served from the cache (hit), rendered (miss) or '
+                     'bypassing it (skip).')
+        lines.append('# TYPE response_cache_requests_total counter')
+        for endpoint, counts in sorted(response_cache.stats().items()):
+            for result, count in sorted(counts.items()):
+                lines.append('response_cache_requests_total{{endpoint="{}",'
+                             'result="{}"}} {}'.format(
+                                 _label(endpoint), result, count))
+        pool = pool_status(db.engine)
+        gauges = (
+            ('db_pool_size', 'Connections the pool keeps open.', 'size'),
+            ('db_pool_checked_out', 'Connections in use.', 'checked_out'),
+            ('db_pool_overflow', 'Connections open beyond the pool size.',
+             'overflow'))
+        counters = (
+            ('db_pool_checkouts_total', 'Connections checked out.',
+             'checkouts'),
+            ('db_pool_wait_seconds_total', 'Time spent getting a '
+             'connection.', 'wait_seconds'),
+            ('db_pool_timeouts_total', 'Checkouts that gave up waiting '
+             'for a connection.', 'timeouts'),
+            ('db_pool_disconnects_total', 'Dead connections replaced on '
+             'checkout.', 'disconnects'))
+        for kind, metrics in (('gauge', gauges), ('counter', counters)):
+            for name, help, key in metrics:
+                if key in pool:
+                    lines.append('# HELP {} {}'.format(name, help))
+                    lines.append('# TYPE {} {}'.format(name, kind))
+                    lines.append('{} {}'.format(name, pool[key]))
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != \
+                'Bearer ' + token:
+            abort(403)
+        return Response(self.render(),
+                        mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,89 @@
+"""
+Enqueueing background jobs.
+
+Views enqueue through `enqueue` rather than `get_queue().enqueue` so job
+payloads stay compact: arguments must be ids and plain values (emails get
+a `MailUser` instead of a `User`), never ORM objects, which pickle their
+session state and need a database session in the worker to be of use.
+Every enqueue records the size of the pickled payload and the time taken
+to push it to Redis, per job type.
+"""
+import threading
+import time
+
+from flask import current_app
+from flask_rq import get_queue
+
+from . import db
+
+
+class EnqueueStats(object):
+    """Payload size and enqueue latency of one job type."""
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.max_bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, size, seconds):
+        self.count += 1
+        self.bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_bytes': self.bytes / self.count if self.count else 0,
+            'max_bytes': self.max_bytes,
+            'avg_ms': 1000 * self.seconds / self.count if self.count else 0,
+            'max_ms': 1000 * self.max_seconds
+        }
+
+
+# EnqueueStats by job type, for this process
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def job_type(func):
+    if isinstance(func, str):
+        return func
+    return '{}.{}'.format(func.__module__, func.__name__)
+
+
+def check_payload(values):
+    for value in values:
+        if isinstance(value, db.Model):
+            raise TypeError('Pass the id of {!r} to the job instead of the '
+                            'instance'.format(value))
+
+
+def enqueue(func, *args, **kwargs):
+    """
+    Queue `func` like `Queue.enqueue` and record its payload size and
+    enqueue latency. Raises TypeError for ORM instances in the arguments.
+    """
+    check_payload(args)
+    check_payload(kwargs.values())
+    check_payload(kwargs.get('args') or ())
+    check_payload((kwargs.get('kwargs') or {}).values())
+    start = time.time()
+    job = get_queue().enqueue(func, *args, **kwargs)
+    elapsed = time.time() - start
+    size = len(job.data)
+    name = job_type(func)
+    with _stats_lock:
+        _stats.setdefault(name, EnqueueStats()).record(size, elapsed)
+    current_app.logger.debug('Enqueued %s: %d bytes in %.1f ms', name, size,
+                             1000 * elapsed)
+    return job
+
+
+def enqueue_stats():
+    """Return the recorded stats as `{job type: {...}}`."""
+    with _stats_lock:
+        return {name: stats.as_dict() for name, stats in _stats.items()}
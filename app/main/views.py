@@ -1,5 +1,6 @@
 from flask import render_template, request
-from ..models import EditableHTML
+from ..models import CHART_COLORS, EditableHTML
+from ..view_cache import cached
 from werkzeug import secure_filename
 import os
 from config import config
@@ -13,12 +14,13 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1] in ALLOWED_EXTENSIONS
 
 @main.route('/')
+@cached(vary='user', tags=('revenue', ))
 def index():
-    
-    return render_template('main/index.html')
+    return render_template('main/index.html', chart_colors=CHART_COLORS)
 
 
 @main.route('/about')
+@cached(vary='role', tags=('editable:about', ))
 def about():
     editable_html_obj = EditableHTML.get_editable_html('about')
     return render_template('main/about.html',
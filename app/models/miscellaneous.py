@@ -1,4 +1,9 @@
-from .. import db
+import threading
+
+from flask import current_app
+
+from .. import db, response_cache
+from ..cache import invalidation_handler, invalidations
 
 
 class EditableHTML(db.Model):
@@ -8,9 +13,81 @@ class EditableHTML(db.Model):
 
     @staticmethod
     def get_editable_html(editor_name):
+        """
+        Return the block named `editor_name`, read from the in-process
+        cache when possible. The object is not attached to the session;
+        change blocks with `set_editable_html`.
+        """
+        cache = editable_html_cache()
+        value, version = cache.get(editor_name)
+        if value is None:
+            editable_html_obj = EditableHTML.query.filter_by(
+                editor_name=editor_name).first()
+            value = editable_html_obj.value if editable_html_obj else ''
+            cache.set(editor_name, value or '', version)
+        return EditableHTML(editor_name=editor_name, value=value)
+
+    @staticmethod
+    def set_editable_html(editor_name, value):
+        """Save a block and drop it from every process's cache."""
         editable_html_obj = EditableHTML.query.filter_by(
             editor_name=editor_name).first()
-
         if editable_html_obj is None:
-            editable_html_obj = EditableHTML(editor_name=editor_name, value='')
+            editable_html_obj = EditableHTML(editor_name=editor_name)
+        editable_html_obj.value = value
+        db.session.add(editable_html_obj)
+        db.session.commit()
+        invalidations().publish('editable_html', editor_name)
         return editable_html_obj
+
+
+class EditableHTMLCache(object):
+    """
+    Editable blocks by name, kept in each process. An edit is announced
+    through `invalidations()`, so every process drops the block along
+    with the response cache's `editable:<name>` tag. Every drop bumps
+    `version`, and a block read from the database is only stored if no
+    drop happened in the meantime. While edits made by other processes
+    may be missed, e.g. when Redis is unreachable, reads go to the
+    database.
+    """
+
+    def __init__(self):
+        self.blocks = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        """Return `(value or None, version)` for a block."""
+        if not invalidations().listening():
+            return None, self.version
+        return self.blocks.get(name), self.version
+
+    def set(self, name, value, version):
+        with self.lock:
+            if invalidations().subscribed and version == self.version:
+                self.blocks[name] = value
+
+    def invalidate(self, name=None):
+        """Drop the block `name`, or every block if None."""
+        with self.lock:
+            self.version += 1
+            names = [name] if name is not None else list(self.blocks)
+            for dropped in names:
+                self.blocks.pop(dropped, None)
+        response_cache.invalidate(
+            *['editable:' + dropped for dropped in names])
+
+
+def editable_html_cache():
+    """Return the current app's `EditableHTMLCache`."""
+    extensions = current_app.extensions
+    cache = extensions.get('editable_html')
+    if cache is None:
+        cache = extensions['editable_html'] = EditableHTMLCache()
+    return cache
+
+
+@invalidation_handler('editable_html')
+def _drop_editable_html(name):
+    editable_html_cache().invalidate(name)
@@ -0,0 +1,195 @@
+"""
+Pre-aggregated revenue rollup.
+
+The dashboard chart and the revenue API read revenue per user, site,
+channel and day from `revenue_site_daily` instead of summing the raw
+`user_earning` rows, by day or by month and with or without a channel
+filter, so their cost depends on the requested range and not on how much
+history has been ingested. The rollup is maintained
+incrementally by `refresh_revenue_rollups` after every ingest and can be
+rebuilt from scratch with `python manage.py rebuild_rollups`. Every
+refresh, and every change to a user's sites, which the responses list,
+bumps `RevenueVersion`. Revenue API responses use it as their ETag so
+clients can revalidate without recomputing anything.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import and_, event, extract, func
+from sqlalchemy.orm import Session, object_session
+
+from .. import db, response_cache
+from .user import Sites, UserData
+
+GRANULARITIES = ('day', 'month')
+
+
+# Rollup channel of earnings without one
+NO_CHANNEL = 0
+
+
+class SiteRevenueDaily(db.Model):
+    __tablename__ = 'revenue_site_daily'
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    site_id = db.Column(
+        db.Integer, db.ForeignKey('user_sites.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    channel = db.Column(db.Integer, primary_key=True, default=NO_CHANNEL)
+    revenue = db.Column(db.Integer, default=0)
+
+
+class RevenueVersion(db.Model):
+    """A single row counting the rollup refreshes so far."""
+    __tablename__ = 'revenue_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current():
+        version = db.session.query(RevenueVersion.version).filter_by(
+            id=1).scalar()
+        return version or 0
+
+    @staticmethod
+    def bump(connection=None):
+        """
+        Increment the version within the caller's transaction, or on
+        `connection` from within a flush.
+        """
+        execute = (connection or db.session).execute
+        table = RevenueVersion.__table__
+        updated = execute(table.update().where(
+            table.c.id == 1).values(version=table.c.version + 1))
+        if not updated.rowcount:
+            execute(table.insert().values(id=1, version=1))
+
+
+@event.listens_for(Sites, 'after_insert')
+@event.listens_for(Sites, 'after_update')
+@event.listens_for(Sites, 'after_delete')
+def _sites_changed(mapper, connection, target):
+    RevenueVersion.bump(connection)
+    object_session(target).info['revenue_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_revenue_pages(session):
+    if session.info.pop('revenue_changed', False):
+        response_cache.invalidate('revenue')
+
+
+def periods(first_day, last_day, granularity='day'):
+    """Return the days or first days of months covering the range."""
+    if granularity == 'month':
+        result = []
+        year, month = first_day.year, first_day.month
+        while (year, month) <= (last_day.year, last_day.month):
+            result.append(date(year, month, 1))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return result
+    return [first_day + timedelta(days=i)
+            for i in range((last_day - first_day).days + 1)]
+
+
+def revenue_series(user_id, first_day, last_day, granularity='day',
+                   site_ids=None, channel_ids=None):
+    """
+    Return `(periods, sites)` for a user's revenue from `first_day` to
+    `last_day`, where `sites` is a `(site id, link, totals)` tuple per
+    site with `totals` aligned to `periods` and zero-filled. Sums come
+    from the daily rollup in one grouped query, which adds up the
+    channels unless `channel_ids` picks some.
+    """
+    source = SiteRevenueDaily.__table__
+    join = _scope(and_(source.c.site_id == Sites.id,
+                       source.c.user_id == user_id,
+                       source.c.day.between(first_day, last_day)),
+                  source.c.channel, channel_ids)
+    if granularity == 'month':
+        period = (extract('year', source.c.day),
+                  extract('month', source.c.day))
+    else:
+        period = (source.c.day, )
+
+    query = db.session.query(Sites.id, Sites.link, func.sum(
+        source.c.revenue), *period) \
+        .outerjoin(source, join) \
+        .filter(Sites.user_id == user_id)
+    if site_ids:
+        query = query.filter(Sites.id.in_(site_ids))
+    rows = query.group_by(Sites.id, Sites.link, *period).order_by(Sites.id)
+
+    keys = periods(first_day, last_day, granularity)
+    index = dict((key, i) for i, key in enumerate(keys))
+    sites, totals = [], {}
+    for row in rows:
+        site_id, link, revenue = row[:3]
+        data = totals.get(site_id)
+        if data is None:
+            data = totals[site_id] = [0] * len(keys)
+            sites.append((site_id, link, data))
+        if row[3] is None:
+            continue  # a site without revenue in the range
+        key = row[3] if granularity == 'day' else \
+            date(int(row[3]), int(row[4]), 1)
+        data[index[key]] = revenue or 0
+    return keys, sites
+
+
+def _scope(clause, column, ids):
+    """Restrict `clause` to rows whose `column` is in `ids`, if given."""
+    if ids:
+        return and_(clause, column.in_(ids))
+    return clause
+
+
+def _replace(model, where, select):
+    """Delete the rollup rows matching `where` and re-insert `select`."""
+    table = model.__table__
+    db.session.execute(table.delete().where(where))
+    db.session.execute(table.insert().from_select(
+        [c.name for c in select.c], select))
+
+
+def refresh_revenue_rollups(first_day, last_day, user_ids=None):
+    """
+    Recompute the rollup covering `first_day`..`last_day` for the given
+    users from `user_earning`. Passing None for `user_ids` refreshes every
+    user in the range. The work is bounded by the ingested range, so
+    calling this after each upload keeps the rollup current without
+    rescanning the whole history.
+    """
+    raw = UserData.__table__
+    by_user = _scope(raw.c.day.between(first_day, last_day), raw.c.user_id,
+                     user_ids)
+    channel = func.coalesce(raw.c.channel, NO_CHANNEL)
+    site_daily = SiteRevenueDaily.__table__
+    _replace(SiteRevenueDaily,
+             _scope(site_daily.c.day.between(first_day, last_day),
+                    site_daily.c.user_id, user_ids),
+             db.select([
+                 raw.c.user_id.label('user_id'),
+                 raw.c.site.label('site_id'),
+                 raw.c.day.label('day'),
+                 channel.label('channel'),
+                 func.sum(raw.c.revenue).label('revenue')
+             ]).where(and_(by_user, raw.c.user_id.isnot(None),
+                           raw.c.site.isnot(None)))
+             .group_by(raw.c.user_id, raw.c.site, raw.c.day, channel))
+
+    RevenueVersion.bump()
+    db.session.commit()
+    response_cache.invalidate('revenue')
+
+
+def rebuild_revenue_rollups():
+    """Drop every rollup row and recompute them from `user_earning`."""
+    first_day, last_day = db.session.query(
+        func.min(UserData.day), func.max(UserData.day)).one()
+    db.session.execute(SiteRevenueDaily.__table__.delete())
+    if first_day is None:
+        RevenueVersion.bump()
+        db.session.commit()
+        response_cache.invalidate('revenue')
+        return
+    refresh_revenue_rollups(first_day, last_day)
@@ -3,11 +3,23 @@ from flask_login import AnonymousUserMixin, UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from itsdangerous import BadSignature, SignatureExpired
 from werkzeug.security import check_password_hash, generate_password_hash
-from sqlalchemy import desc, asc, between
+from sqlalchemy import event, func, literal_column
+from sqlalchemy.orm import Session, joinedload, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
 import json
-from datetime import datetime, timedelta
+import time
+from datetime import date, timedelta
+from types import MappingProxyType
 
-from .. import db, login_manager
+from .. import db, login_manager, response_cache, user_cache
+from ..cache import invalidation_handler, invalidations
+
+
+CHART_COLORS = [
+    "rgba(255, 99, 132, 0.9)",
+    "rgba(23, 233, 76, 0.9)"
+]
 
 
 class Permission:
@@ -41,6 +53,15 @@ class Sites(db.Model):
 
 class UserData(db.Model):
     __tablename__ = 'user_earning'
+    __table_args__ = (
+        # One row per site, network and day; ingest relies on this to
+        # detect duplicates in the database.
+        db.Index('uq_user_earning_site_channel_day',
+                 'site', 'channel', 'day', unique=True),
+        db.Index('ix_user_earning_site_day', 'site', 'day'),
+        db.Index('ix_user_earning_user_site_day', 'user_id', 'site', 'day'),
+        db.Index('ix_user_earning_channel_day', 'channel', 'day'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     day = db.Column(db.Date)
@@ -87,6 +108,23 @@ class Role(db.Model):
         return '<Role \'%s\'>' % self.name
 
 
+def role_permissions():
+    """
+    Return the current app's read-only `{role id: permissions}` table. It
+    is loaded with one query on first use and dropped in every process
+    whenever a role change is committed. It is also reloaded every
+    ROLE_TABLE_TTL seconds, in case an announcement was missed.
+    """
+    extensions = current_app.extensions
+    table, expires = extensions.get('role_permissions', (None, 0))
+    if table is None or expires < time.time():
+        table = MappingProxyType(
+            dict(db.session.query(Role.id, Role.permissions)))
+        extensions['role_permissions'] = (
+            table, time.time() + current_app.config['ROLE_TABLE_TTL'])
+    return table
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -94,7 +132,9 @@ class User(UserMixin, db.Model):
     first_name = db.Column(db.String(64), index=True)
     # last_name=db.Column(db.String(64), index=True)
     email = db.Column(db.String(64), unique=True, index=True)
-    password_hash = db.Column(db.String(128))
+    # Only checked when logging in or changing credentials, so it is
+    # left out of cached users and loaded on first access.
+    password_hash = db.deferred(db.Column(db.String(128)))
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
 
     def __init__(self, **kwargs):
@@ -106,92 +146,43 @@ class User(UserMixin, db.Model):
             if self.role is None:
                 self.role = Role.query.filter_by(default=True).first()
 
-    def get_user_data(self):
-        d = datetime.today() - timedelta(days=30)
-        print(d)
-        date_format = '%d-%m'
-        date_labels = []
-        for i in range(1, 31):
-            date_labels.append((datetime.today() - timedelta(days=i)).strftime(date_format))
-        user_sites = Sites.query.filter_by(user_id = self.id)
-        out_dict = {
-            "type": "line",
-            "data": {
-                "labels": list(reversed(date_labels)),
-                "datasets": []
-                }
-        }
-        colors = [
-            "rgba(255, 99, 132, 0.9)",
-            "rgba(23, 233, 76, 0.9)"
-        ]
-
-        site_count = 0
-
-
-        for site in user_sites:
-            user_data = reversed(UserData.query.filter_by(user_id=self.id).filter_by(site = site.id).order_by(UserData.day.desc()).limit(30).all()) 
-            current_dataset = {
-                "label": site.link,
-                "data":[],
-                "backgroundColor": "rgba(255, 255, 255, 0)",
-                "borderColor": colors[site_count],
-                "borderWidth": "1"
-            }
-            for row in user_data:
-                if row.day.strftime(date_format) in date_labels:
-                    current_dataset['data'].append(row.revenue)
-                else:
-                    current_dataset['data'].append(0)
-
-
-            site_count += 1
-            out_dict['data']['datasets'].append(current_dataset)
-
-        """user_data = reversed(UserData.query.filter(UserData.day > d).filter_by(
-            user_id=self.id).order_by(UserData.day.desc()).all())
-        
-        x_ = []
-        y_ = []
-        
-        count = 0
-        for row in user_data:
-            date = row.day.strftime(date_format)
-            if count > 0:
-                if x_[count] != x_[count-1]:
-                    x_.append(date)
-                    y_.append(row.revenue)
-                else:
-                    y_[count-1] = y_[count-1] + row.revenue
-            # if not y_[]
-            # y_.append(row.revenue)
-            #out_dict[date] = row.revenue
-        # print(out_dict)
-        count += 1
+    def get_user_data(self, days=30):
+        """
+        Build the Chart.js payload with this user's revenue per site for
+        the last `days` days (today excluded), zero-filling days without
+        data. The dashboard reads `/api/revenue` instead.
+        """
+        from .revenue import revenue_series
+        today = date.today()
+        days, sites = revenue_series(self.id, today - timedelta(days=days),
+                                     today - timedelta(days=1))
+        datasets = [{
+            "label": link,
+            "data": data,
+            "backgroundColor": "rgba(255, 255, 255, 0)",
+            "borderColor": CHART_COLORS[i % len(CHART_COLORS)],
+            "borderWidth": "1"
+        } for i, (_, link, data) in enumerate(sites)]
+
         out_dict = {
             "type": "line",
             "data": {
-                "labels": x_,
-                "datasets": [{
-                    "label": "Revenue last 30 days",
-                    "data": y_,
-                    "backgroundColor": "rgba(255, 99, 132, 0.2)",
-                    "borderColor": "rgba(255,99,132,0.9)",
-                    "borderWidth": "1",
-                }]
+                "labels": [day.strftime('%d-%m') for day in days],
+                "datasets": datasets
             }
         }
-        print(x_)"""
-        # return out_dict
-        # print(json.dumps(out_dict, ensure_ascii=False))
         return json.dumps(out_dict, ensure_ascii=False)
 
     def full_name(self):
         return '%s' % (self.first_name)
 
     def can(self, permissions):
-        return self.role is not None and \
-            (self.role.permissions & permissions) == permissions
+        role = self.__dict__.get('role')
+        if role is not None and role.id != self.role_id:
+            granted = role.permissions  # assigned but not flushed yet
+        else:
+            granted = role_permissions().get(self.role_id)
+        return granted is not None and (granted & permissions) == permissions
 
     def is_admin(self):
         return self.can(Permission.ADMINISTER)
@@ -301,6 +292,20 @@ class User(UserMixin, db.Model):
         return '<User \'%s\'>' % self.full_name()
 
 
+# Case-insensitive keys the admin user listing sorts and searches on,
+# indexed together with the id used to break ties in keyset pagination.
+# The empty string is a literal so queries repeat the indexed expression.
+USER_SORT_KEYS = {
+    'first_name': func.coalesce(func.lower(User.__table__.c.first_name),
+                                literal_column("''")),
+    'email': func.coalesce(func.lower(User.__table__.c.email),
+                           literal_column("''"))
+}
+db.Index('ix_users_first_name_key', USER_SORT_KEYS['first_name'],
+         User.__table__.c.id)
+db.Index('ix_users_email_key', USER_SORT_KEYS['email'], User.__table__.c.id)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def can(self, _):
         return False
@@ -312,6 +317,108 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+def _cached_values(obj):
+    """Return the columns of `obj` to cache, leaving out deferred ones."""
+    return dict((attr.key, getattr(obj, attr.key))
+                for attr in obj.__mapper__.column_attrs if not attr.deferred)
+
+
+def _detached(model, values):
+    """Rebuild an unmodified, detached instance from cached columns."""
+    obj = model.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+    return obj
+
+
+def cache_user(user):
+    user_cache.set('user:%d' % user.id, _cached_values(user))
+    if user.role is not None:
+        user_cache.set('role:%d' % user.role.id, _cached_values(user.role))
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """
+    Load the logged in user with its role from `user_cache`, or with one
+    query on a miss. Cached rows are merged into the session without
+    loading, so authenticated requests run no auth queries while cached.
+    Updating or deleting a user or role invalidates its entry in every
+    process on commit.
+    """
+    # Evictions announced by other processes are heard from now on.
+    invalidations().start_listener()
+    user_id = int(user_id)
+    values = user_cache.get('user:%d' % user_id)
+    role_values = None
+    if values is not None and values['role_id'] is not None:
+        role_values = user_cache.get('role:%d' % values['role_id'])
+    if values is None or (values['role_id'] is not None and
+                          role_values is None):
+        user = User.query.options(joinedload('role')).get(user_id)
+        if user is not None:
+            cache_user(user)
+        return user
+
+    user = _detached(User, values)
+    role = None
+    if role_values is not None:
+        role = _detached(Role, role_values)
+        make_transient_to_detached(role)
+    set_committed_value(user, 'role', role)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+@event.listens_for(Role, 'after_insert')
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def _roles_changed(mapper, connection, target):
+    object_session(target).info['roles_changed'] = True
+
+
+@event.listens_for(User, 'after_insert')
+def _user_added(mapper, connection, target):
+    object_session(target).info['users_added'] = True
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def _stale_cache_entry(mapper, connection, target):
+    key = '%s:%d' % ('user' if isinstance(target, User) else 'role',
+                     target.id)
+    user_cache.delete(key)
+    # Evict again once committed, in case a concurrent request cached
+    # the old row in between.
+    object_session(target).info.setdefault('stale_cache_keys', set()).add(key)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_stale_cache_entries(session):
+    stale = session.info.pop('stale_cache_keys', ())
+    for key in stale:
+        user_cache.delete(key)
+        invalidations().publish('user_cache', key)
+    if session.info.pop('users_added', False) or stale:
+        response_cache.invalidate('users')
+    if session.info.pop('roles_changed', False):
+        invalidations().publish('role_permissions')
+
+
+@invalidation_handler('role_permissions')
+def _forget_role_permissions(key):
+    current_app.extensions.pop('role_permissions', None)
+
+
+@invalidation_handler('user_cache')
+def _forget_cached_user(key):
+    user_cache.forget(key)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_stale_cache_entries(session, previous_transaction):
+    session.info.pop('stale_cache_keys', None)
+    session.info.pop('roles_changed', None)
+    session.info.pop('users_added', None)
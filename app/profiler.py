@@ -0,0 +1,112 @@
+"""
+Profiling of sampled requests.
+
+With PROFILER set, a PROFILER_SAMPLE_RATE fraction of requests (0 to 1)
+runs under cProfile, as does any request by an administrator carrying the
+PROFILER_HEADER header. Profiles are added up per endpoint, for this
+process, and can be downloaded from the admin blueprint as pstats files
+(`python -m pstats`, snakeviz) or read as text.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import threading
+import time
+
+from flask import current_app, g, request
+from flask_login import current_user
+
+
+class EndpointProfile(object):
+    """Profiles of one endpoint's requests, added together."""
+
+    def __init__(self):
+        self.samples = 0
+        self.seconds = 0.0
+        self.stats = None
+
+    def add(self, profile, seconds):
+        self.samples += 1
+        self.seconds += seconds
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+
+    def dump(self):
+        """Return the profile in the format of `pstats.Stats.dump_stats`."""
+        return marshal.dumps(self.stats.stats)
+
+    def text(self, sort='cumulative', limit=50):
+        out = io.StringIO()
+        self.stats.stream = out
+        self.stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def copy(self):
+        copy = EndpointProfile()
+        copy.samples, copy.seconds = self.samples, self.seconds
+        copy.stats = pstats.Stats()
+        copy.stats.add(self.stats)
+        return copy
+
+
+class Profiler(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['profiler'] = {
+            'profiles': {},
+            'lock': threading.Lock()
+        }
+        app.before_request(self.start)
+        app.teardown_request(self.finish)
+
+    @property
+    def enabled(self):
+        return 'profiler' in current_app.extensions
+
+    @property
+    def state(self):
+        return current_app.extensions['profiler']
+
+    def wanted(self):
+        config = current_app.config
+        if random.random() < config['PROFILER_SAMPLE_RATE']:
+            return True
+        return config['PROFILER_HEADER'] in request.headers and \
+            current_user.is_admin()
+
+    def start(self):
+        if self.wanted():
+            g.profile = cProfile.Profile()
+            g.profile_start = time.time()
+            g.profile.enable()
+
+    def finish(self, exception=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        seconds = time.time() - g.pop('profile_start')
+        endpoint = request.endpoint or '<unmatched>'
+        state = self.state
+        with state['lock']:
+            state['profiles'].setdefault(endpoint, EndpointProfile()).add(
+                profile, seconds)
+
+    def profiles(self):
+        """Return copies of the profiles as `{endpoint: EndpointProfile}`."""
+        state = self.state
+        with state['lock']:
+            return {endpoint: profile.copy()
+                    for endpoint, profile in state['profiles'].items()}
+
+    def reset(self):
+        state = self.state
+        with state['lock']:
+            state['profiles'].clear()
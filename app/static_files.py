@@ -0,0 +1,125 @@
+"""
+Serving of the static folder and compression of other responses.
+
+`serve_static` replaces Flask's static view. A text file is sent as its
+`.br` or `.gz` sibling when the client accepts that encoding and the
+sibling exists (`manage.py build_assets` writes them), so nothing is
+compressed per request. Files whose names carry a content hash, as built
+bundles do, may be cached by browsers for a year without revalidation;
+others for SEND_FILE_MAX_AGE_DEFAULT seconds. A single byte range is
+answered with 206 Partial Content. Whole files go out through the WSGI
+file wrapper, which gunicorn sends with sendfile(2), or through the front
+end server with USE_X_SENDFILE.
+
+`Compression` is Flask-Compress for the remaining responses, except that
+it leaves file, streamed and partial responses alone, as well as bodies
+under COMPRESS_MIN_SIZE bytes.
+"""
+import mimetypes
+import os
+import re
+
+from flask import abort, current_app, request, send_file
+from flask_compress import Compress
+from werkzeug.http import parse_range_header
+from werkzeug.security import safe_join
+
+from .asset_manifest import HASH_LENGTH
+
+# Content-Encoding and file suffix of precompressed siblings, preferred
+# first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Mimetypes worth compressing; images, fonts and archives already are.
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/xml', 'image/svg+xml')
+# Names of built bundles, e.g. scripts/vendor.3f2a9c0d41b7.js
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{%d}\.\w+$' % HASH_LENGTH)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CHUNK_SIZE = 64 * 1024
+
+
+def compressible(mimetype):
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def read_range(path, start, stop):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_static(filename):
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or \
+        'application/octet-stream'
+    encoding = None
+    if compressible(mimetype):
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and \
+                    os.path.isfile(path + suffix):
+                encoding, path = name, path + suffix
+                break
+
+    fingerprinted = FINGERPRINTED.search(filename) is not None
+    response = send_file(path, mimetype=mimetype, conditional=True,
+                         cache_timeout=current_app.get_send_file_max_age(
+                             filename))
+    if fingerprinted:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers.pop('Expires', None)
+    if compressible(mimetype):
+        response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Accept-Ranges'] = 'bytes'
+    if response.status_code == 200 and 'Range' in request.headers:
+        response = partial(response, path)
+    return response
+
+
+def partial(response, path):
+    """Turn a whole file `response` into the range the client asked for."""
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range not in (response.headers.get('ETag'),
+                                     response.headers.get('Last-Modified')):
+        return response  # the file changed; send all of it
+    ranges = parse_range_header(request.headers['Range'])
+    if ranges is None or len(ranges.ranges) != 1:
+        return response  # multiple ranges are not worth supporting
+    length = os.path.getsize(path)
+    response.close()
+    response.headers.pop('X-Sendfile', None)
+    span = ranges.range_for_length(length)
+    if span is None:
+        response.status_code = 416
+        response.response = []
+        response.headers['Content-Range'] = 'bytes */{}'.format(length)
+        response.headers['Content-Length'] = 0
+        return response
+    start, stop = span
+    response.status_code = 206
+    response.response = read_range(path, start, stop)
+    response.headers['Content-Range'] = ranges.make_content_range(length)
+    response.headers['Content-Length'] = stop - start
+    return response
+
+
+def init_static(app):
+    """Serve the static folder with `serve_static`."""
+    app.view_functions['static'] = serve_static
+
+
+class Compression(Compress):
+    def after_request(self, response):
+        if response.direct_passthrough or response.is_streamed or \
+                response.status_code == 206:
+            return response
+        return super(Compression, self).after_request(response)
@@ -0,0 +1,256 @@
+"""
+Caching of whole responses of GET views.
+
+Views opt in with `@cached(...)`. A rendered response is stored under a
+key built from the endpoint, the URL and its query string, who is asking
+(`vary='user'` or `vary='role'`), an optional data version and the current
+version of each of the view's tags. `response_cache.invalidate(tag)`
+bumps a tag's version, so every entry rendered under the old version is
+never read again and ages out of the backend. Views needing the data
+version themselves get the one read for the key from `cached_version`.
+
+Backends are chosen with RESPONSE_CACHE_BACKEND: `memory` keeps entries in
+each process, `redis` shares them (and tag versions) between processes
+through the Redis server in REDIS_URL, and `null` disables caching. With
+`memory`, an invalidation reaches only the process making it, so use it
+with a single process only; production defaults to `redis`.
+Pages requested with flash messages pending are neither served from nor
+stored in the cache. `csrf_token()` renders as a placeholder in cached
+pages, replaced by the requesting session's token in every response, so
+one session's token is never served to another. Hits, misses and skips
+are counted per endpoint.
+"""
+import hashlib
+import json
+import pickle
+import threading
+from collections import defaultdict
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from redis import RedisError
+
+from .cache import LRUCache, redis_connection
+
+# Response headers that belong to one response only
+UNCACHED_HEADERS = ('Set-Cookie', 'Content-Length')
+# Stands in for the CSRF token in cached bodies
+CSRF_PLACEHOLDER = '__response_cache_csrf_token__'
+
+
+def csrf_token():
+    """Flask-WTF's `csrf_token()` template global, aware of the cache."""
+    if g.get('response_cache_rendering'):
+        return CSRF_PLACEHOLDER
+    return generate_csrf()
+
+
+def cached_version(version):
+    """
+    Return the data version `@cached` read while serving this request, so
+    a view needing it too does not read it again, or call `version`.
+    """
+    if 'response_cache_version' in g:
+        return g.response_cache_version
+    return version()
+
+
+def fill_csrf_token(response):
+    """Put the session's CSRF token in place of the placeholder."""
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    body = response.get_data()
+    placeholder = CSRF_PLACEHOLDER.encode('ascii')
+    if placeholder in body:
+        response.set_data(body.replace(
+            placeholder, generate_csrf().encode('ascii')))
+    return response
+
+
+class MemoryBackend(object):
+    def __init__(self, size=512, timeout=300):
+        self.entries = LRUCache(size, timeout)
+        self.tags = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, entry, timeout):
+        self.entries.set(key, entry, timeout)
+
+    def tag_versions(self, tags):
+        return [self.tags[tag] for tag in tags]
+
+    def invalidate(self, tag):
+        with self.lock:
+            self.tags[tag] += 1
+
+
+class RedisBackend(object):
+    def __init__(self, redis, prefix='response'):
+        self.redis = redis
+        self.prefix = prefix + ':'
+
+    def get(self, key):
+        entry = self.redis.get(self.prefix + key)
+        return None if entry is None else pickle.loads(entry)
+
+    def set(self, key, entry, timeout):
+        self.redis.setex(self.prefix + key, timeout,
+                         pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+
+    def tag_versions(self, tags):
+        if not tags:
+            return []
+        return [int(v or 0) for v in self.redis.mget(
+            [self.prefix + 'tag:' + tag for tag in tags])]
+
+    def invalidate(self, tag):
+        self.redis.incr(self.prefix + 'tag:' + tag)
+
+
+class NullBackend(object):
+    def get(self, key):
+        return None
+
+    def set(self, key, entry, timeout):
+        pass
+
+    def tag_versions(self, tags):
+        return [0] * len(tags)
+
+    def invalidate(self, tag):
+        pass
+
+
+class ResponseCache(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        name = config.get('RESPONSE_CACHE_BACKEND', 'memory')
+        if name == 'redis':
+            backend = RedisBackend(redis_connection(app))
+        elif name == 'memory':
+            backend = MemoryBackend(
+                config.get('RESPONSE_CACHE_SIZE', 512),
+                config.get('RESPONSE_CACHE_TIMEOUT', 300))
+        else:
+            backend = NullBackend()
+        app.extensions['response_cache'] = {
+            'backend': backend,
+            'stats': defaultdict(lambda: {'hit': 0, 'miss': 0, 'skip': 0}),
+            'lock': threading.Lock()
+        }
+        # Flask-WTF provides `csrf_token` as a global, which imported
+        # macros see, and from a context processor, which pages see.
+        app.add_template_global(csrf_token)
+        app.context_processor(lambda: {'csrf_token': csrf_token})
+
+    @property
+    def state(self):
+        return current_app.extensions['response_cache']
+
+    def invalidate(self, *tags):
+        """Make every response cached under one of `tags` stale."""
+        backend = self.state['backend']
+        for tag in tags:
+            try:
+                backend.invalidate(tag)
+            except RedisError as e:
+                current_app.logger.warning('Could not invalidate %s: %s',
+                                           tag, e)
+
+    def stats(self):
+        """Return `{endpoint: {'hit': n, 'miss': n, 'skip': n}}`."""
+        state = self.state
+        with state['lock']:
+            return dict((endpoint, dict(counts))
+                        for endpoint, counts in state['stats'].items())
+
+    def count(self, outcome):
+        state = self.state
+        with state['lock']:
+            state['stats'][request.endpoint][outcome] += 1
+
+    def key(self, tags, vary, version):
+        who = None
+        if vary is not None and current_user.is_authenticated:
+            # A user's pages also change with their role.
+            who = [current_user.role_id]
+            if vary == 'user':
+                who.append(current_user.id)
+        if version is not None:
+            g.response_cache_version = version()
+        key = json.dumps([
+            request.endpoint, request.path,
+            sorted(request.args.items(multi=True)), vary, who,
+            g.get('response_cache_version'),
+            self.state['backend'].tag_versions(tags)
+        ], default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def serve(self, view, args, kwargs, tags, vary, version, timeout,
+              flashes):
+        if request.method != 'GET' or (flashes and '_flashes' in session):
+            self.count('skip')
+            return view(*args, **kwargs)
+        backend = self.state['backend']
+        try:
+            key = self.key(tags, vary, version)
+            entry = backend.get(key)
+        except RedisError as e:
+            current_app.logger.warning('Response cache: %s', e)
+            key = entry = None
+        if entry is not None:
+            self.count('hit')
+            status, headers, body = entry
+            response = current_app.response_class(
+                body, status=status, headers=headers)
+            return fill_csrf_token(response).make_conditional(request)
+
+        self.count('miss')
+        g.response_cache_rendering = True
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            g.response_cache_rendering = False
+        if key is not None and response.status_code == 200 and \
+                not response.direct_passthrough and \
+                not (flashes and '_flashes' in session):
+            headers = [(name, value) for name, value in response.headers
+                       if name not in UNCACHED_HEADERS]
+            entry = (response.status_code, headers, response.get_data())
+            try:
+                backend.set(key, entry, timeout or
+                            current_app.config['RESPONSE_CACHE_TIMEOUT'])
+            except RedisError as e:
+                current_app.logger.warning('Response cache: %s', e)
+        return fill_csrf_token(response)
+
+
+def cached(tags=(), vary=None, version=None, timeout=None, flashes=True):
+    """
+    Cache a GET view's response. `vary` is `'user'` or `'role'` when the
+    page depends on who is logged in, `version` a callable returning the
+    version of the data the page shows, and `tags` the names passed to
+    `response_cache.invalidate` when that data changes. Pass
+    `flashes=False` for views that never show flashed messages, such as
+    JSON endpoints, so pending messages do not bypass their cache.
+    """
+    from . import response_cache
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            return response_cache.serve(f, args, kwargs, tags, vary, version,
+                                        timeout, flashes)
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,5 @@
+"""
+Stand-alone performance benchmarks. Run them from the project root, e.g.
+
+    python -m benchmarks.user_earning_indexes --help
+"""
@@ -0,0 +1,66 @@
+"""
+Recipients per second rendered for a bulk invite when both templates are
+rendered for every recipient (what `send_email` used to do) versus one
+cached skeleton that only substitutes each recipient's fields.
+
+    python -m benchmarks.bulk_email_render --recipients 10000
+"""
+import argparse
+import time
+
+from flask import render_template
+
+from app import create_app
+from app.email import get_skeleton
+
+
+class User(object):
+    def __init__(self, i):
+        self.email = 'user{}@example.com'.format(i)
+        self.name = 'User {}'.format(i)
+
+    def full_name(self):
+        return self.name
+
+
+def full_render(template, fields):
+    for values in fields:
+        render_template(template + '.txt', **values)
+        render_template(template + '.html', **values)
+
+
+def skeleton_render(template, fields):
+    skeleton = get_skeleton(template, ['user', 'invite_link'])
+    for values in fields:
+        skeleton.render(**values)
+
+
+def run(label, render, template, fields):
+    start = time.perf_counter()
+    render(template, fields)
+    elapsed = time.perf_counter() - start
+    print('  {:<10} {:>8.2f}s {:>12.1f} recipients/s'.format(
+        label, elapsed, len(fields) / elapsed))
+    return len(fields) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--recipients', type=int, default=10000)
+    args = parser.parse_args()
+
+    fields = [{
+        'user': User(i),
+        'invite_link': 'https://example.com/join/{}?token=abc'.format(i)
+    } for i in range(args.recipients)]
+    app = create_app('testing')
+    print('{} recipients'.format(args.recipients))
+    with app.app_context():
+        before = run('full', full_render, 'account/email/invite', fields)
+        after = run('skeleton', skeleton_render, 'account/email/invite',
+                    fields)
+    print('  speed-up   {:>8.1f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Bytes of CSS and JS each page makes the browser download.
+
+Renders a set of routes, as a guest and as an administrator, with the
+testing config, collects the stylesheets and scripts every page links to
+and adds up their sizes, raw and gzipped. A file linked twice on a page
+is counted once. Scripts from other hosts are listed but not counted.
+
+    python -m benchmarks.page_weight
+"""
+import argparse
+import gzip
+import os
+import re
+
+from app import create_app, db
+from app.models import Permission, Role, User
+
+GUEST_ROUTES = ('/', '/account/login', '/account/register')
+ADMIN_ROUTES = ('/', '/about', '/account/manage', '/admin/', '/admin/users',
+                '/admin/new-user')
+LINKS = re.compile(
+    r'<(?:script[^>]*\ssrc|link[^>]*\shref)="([^"]+\.(?:js|css)[^"]*)"')
+
+
+def linked_files(page):
+    """Return `(local paths, external URLs)` a page links to."""
+    local, external = [], []
+    for url in LINKS.findall(page):
+        if url.startswith('/static/'):
+            path = url[len('/static/'):].split('?')[0]
+            if path not in local:
+                local.append(path)
+        elif url not in external:
+            external.append(url)
+    return local, external
+
+
+class Sizes(object):
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.sizes = {}
+
+    def __getitem__(self, path):
+        if path not in self.sizes:
+            with open(os.path.join(self.static_folder, path), 'rb') as f:
+                data = f.read()
+            self.sizes[path] = (len(data), len(gzip.compress(data, 9)))
+        return self.sizes[path]
+
+
+def report(client, sizes, who, routes):
+    for route in routes:
+        page = client.get(route).get_data(as_text=True)
+        local, external = linked_files(page)
+        raw = sum(sizes[path][0] for path in local)
+        compressed = sum(sizes[path][1] for path in local)
+        print('  {:<7} {:<18} {:>3} files {:>9.1f} KB {:>8.1f} KB gzip'
+              '{}'.format(who, route, len(local), raw / 1024.0,
+                          compressed / 1024.0,
+                          '  + ' + ', '.join(external) if external else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.parse_args()
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        try:
+            Role.insert_roles()
+            admin_role = Role.query.filter_by(
+                permissions=Permission.ADMINISTER).first()
+            db.session.add(User(first_name='Admin',
+                                email='admin@example.com',
+                                password='password', confirmed=True,
+                                role=admin_role))
+            db.session.commit()
+
+            client = app.test_client()
+            sizes = Sizes(app.static_folder)
+            print('CSS and JS per page')
+            report(client, sizes, 'guest', GUEST_ROUTES)
+            client.post('/account/login', data={
+                'email': 'admin@example.com', 'password': 'password'})
+            report(client, sizes, 'admin', ADMIN_ROUTES)
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
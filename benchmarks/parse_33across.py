@@ -0,0 +1,102 @@
+"""
+Throughput and peak memory of the 33across report parser.
+
+Writes a synthetic delivery report (one million lines by default, several
+sites interleaved per day as in real exports) and parses it with the old
+DictReader implementation and with the streaming `parse_33across`.
+
+    python -m benchmarks.parse_33across --lines 1000000
+"""
+import argparse
+import contextlib
+import csv
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from app.ingest import parse_33across
+
+HEADER = ('Date,GUID,Login,Region,Device,Ad Type,Ad Size,Ad Requests,'
+          'Blocked Requests,Imp. Served,CPM,Estimated Revenue\n')
+
+
+def legacy_parse_33across(file, site):
+    """The per-row DictReader parser this benchmark replaced."""
+    date_format = '%Y-%m-%d'
+    with open(file) as csvfile:
+        next(csvfile)
+        reader = csv.DictReader(csvfile)
+        data = {}
+        for line in reader:
+            if line['Login'].lower() == site.lower():
+                data_str = str(line['Date'])
+                day = datetime.strptime(data_str, date_format).date()
+                if data_str in data:
+                    revenue = data[data_str]['revenue'] + float(
+                        line['Estimated Revenue'].replace('$', ''))
+                else:
+                    revenue = float(line['Estimated Revenue'].replace('$', ''))
+                data[data_str] = {'revenue': revenue, 'day': day}
+            else:
+                print('not site...:::' + line['Login'].lower())
+    return data
+
+
+def write_report(path, lines, sites):
+    rows_per_day = 40 * sites
+    day = date(2017, 6, 23)
+    with open(path, 'w') as f:
+        f.write('Generated at:,"Sat Jun 24, 06:09:10 AM EDT"\n')
+        f.write(HEADER)
+        for i in range(lines):
+            if i and i % rows_per_day == 0:
+                day -= timedelta(days=1)
+            f.write('{},GUID,site{}.hr,United States,desktop,In-View,'
+                    '728x90,0,0,177,$2.49,${:.2f}\n'.format(
+                        day, i % sites, random.random() * 10))
+
+
+def run(label, parse, lines):
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = parse()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('  {:<10} {:>8.2f}s {:>10.0f} lines/s {:>9.1f} KiB peak '
+          '{:>6} days'.format(label, elapsed, lines / elapsed,
+                              peak / 1024.0, records))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--sites', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(42)
+    path = os.path.join(tempfile.mkdtemp(), 'report.csv')
+    write_report(path, args.lines, args.sites)
+    print('{:,} lines, {:.1f} MiB, {} sites'.format(
+        args.lines, os.path.getsize(path) / 1048576.0, args.sites))
+
+    def legacy():
+        # The old parser printed every foreign row; keep that cost but
+        # not the terminal noise.
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            return len(legacy_parse_33across(path, 'site0.hr'))
+
+    def streaming():
+        return len(set(day for day, _ in parse_33across(path, 'site0.hr')))
+
+    run('legacy', legacy, args.lines)
+    run('streaming', streaming, args.lines)
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
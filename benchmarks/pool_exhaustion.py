@@ -0,0 +1,98 @@
+"""
+How requests fare when they need more database connections than the pool has.
+
+Runs --threads threads, each making --requests requests that check out a
+connection and hold it for --hold seconds, as a slow view would, against
+pools of --pool-size connections and --max-overflow more. While the
+threads fit in the pool nothing waits. Beyond that, requests queue for
+a connection, and those that wait over --timeout seconds fail with
+`TimeoutError`, which is what a worker under too much load sees.
+Uses the testing config's SQLite database.
+
+    python -m benchmarks.pool_exhaustion --threads 4 8 16 --hold 0.2
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy import exc
+
+from app import create_app, db
+from app.database import pool_status
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(args, threads):
+    app = create_app('testing', SQLALCHEMY_POOL_SIZE=args.pool_size,
+                     SQLALCHEMY_MAX_OVERFLOW=args.max_overflow,
+                     SQLALCHEMY_POOL_TIMEOUT=args.timeout)
+    waits, failures = [], []
+    lock = threading.Lock()
+    most_checked_out = [0]
+
+    def requests():
+        for _ in range(args.requests):
+            with app.app_context():
+                start = time.time()
+                try:
+                    db.session.execute('SELECT 1')
+                except exc.TimeoutError:
+                    with lock:
+                        failures.append(time.time() - start)
+                    continue
+                finally:
+                    with lock:
+                        most_checked_out[0] = max(
+                            most_checked_out[0],
+                            pool_status(db.engine)['checked_out'])
+                with lock:
+                    waits.append(time.time() - start)
+                time.sleep(args.hold)
+                db.session.remove()
+
+    start = time.time()
+    workers = [threading.Thread(target=requests) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    with app.app_context():
+        status = pool_status(db.engine)
+        db.engine.dispose()
+    print('  {:>7} {:>6.2f}s {:>6} {:>8} {:>10.0f} {:>10.0f} {:>11}'.format(
+        threads, elapsed, len(waits), len(failures),
+        1000 * percentile(waits, 0.5), 1000 * percentile(waits, 0.95),
+        most_checked_out[0]))
+    assert status['timeouts'] == len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[4, 8, 16, 32])
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--hold', type=float, default=0.2)
+    parser.add_argument('--pool-size', type=int, default=5)
+    parser.add_argument('--max-overflow', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=1.0)
+    args = parser.parse_args()
+
+    print('Pool of {} + {} overflow, {:.0f} ms per request, {:.1f}s '
+          'timeout'.format(args.pool_size, args.max_overflow,
+                           1000 * args.hold, args.timeout))
+    print('  {:>7} {:>7} {:>6} {:>8} {:>10} {:>10} {:>11}'.format(
+        'threads', 'time', 'served', 'timeouts', 'p50 ms', 'p95 ms',
+        'checked out'))
+    for threads in args.threads:
+        run(args, threads)
+
+
+if __name__ == '__main__':
+    main()
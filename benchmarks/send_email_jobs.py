@@ -0,0 +1,72 @@
+"""
+Jobs per second of `send_email` when every job builds its own app (the
+old behaviour) versus reusing the worker's app and pooled SMTP connection.
+
+Jobs are run back to back in this process, as `manage.py run_worker
+--simple` does, with the testing config so no mail actually leaves the
+machine. Forked work horses reuse the worker's app the same way.
+
+    python -m benchmarks.send_email_jobs --jobs 200
+"""
+import argparse
+import os
+import time
+
+from flask import render_template
+from flask_mail import Message
+
+from app import create_app, mail, set_job_app
+from app.email import close_mailer, send_email
+
+
+class User(object):
+    email = 'user@example.com'
+
+    def full_name(self):
+        return 'Benchmark User'
+
+
+def legacy_send_email(recipient, subject, template, **kwargs):
+    """The per-job `create_app` implementation this benchmark replaced."""
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.app_context():
+        msg = Message(
+            app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
+            sender=app.config['EMAIL_SENDER'],
+            recipients=[recipient])
+        msg.body = render_template(template + '.txt', **kwargs)
+        msg.html = render_template(template + '.html', **kwargs)
+        mail.send(msg)
+
+
+def run(label, job, count):
+    start = time.perf_counter()
+    for i in range(count):
+        job(recipient='user{}@example.com'.format(i),
+            subject='You Are Invited To Join',
+            template='account/email/invite',
+            user=User(),
+            invite_link='https://example.com/join/{}'.format(i))
+    elapsed = time.perf_counter() - start
+    print('  {:<12} {:>8.2f}s {:>10.1f} jobs/s'.format(
+        label, elapsed, count / elapsed))
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--jobs', type=int, default=200)
+    args = parser.parse_args()
+
+    # Importing config loads config.env, which may set FLASK_CONFIG.
+    os.environ['FLASK_CONFIG'] = 'testing'
+    set_job_app(create_app('testing'))
+    print('{} jobs'.format(args.jobs))
+    before = run('per-job app', legacy_send_email, args.jobs)
+    after = run('shared app', send_email, args.jobs)
+    close_mailer()
+    print('  speed-up     {:>8.1f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Messages per second delivered to a local stand-in SMTP server when every
+message opens its own connection (Flask-Mail's `mail.send`, the old
+behaviour) versus the batching mailer's pooled connection.
+
+The stand-in server runs in this process, so the numbers measure SMTP
+round trips and connection setup rather than a real provider. Against a
+remote server with TLS and AUTH the per-connection cost is far higher.
+
+    python -m benchmarks.smtp_batching --messages 500 --batch-size 50
+"""
+import argparse
+import time
+
+from flask_mail import Message
+
+from app import create_app, mail
+from app.email import BatchMailer
+from tests.smtp_server import StandInSMTPServer
+
+
+def message(i):
+    return Message('Benchmark', sender='admin@example.com',
+                   recipients=['user{}@example.com'.format(i)],
+                   body='Hello from the benchmark.')
+
+
+def run(label, server, send, count):
+    delivered = len(server.messages)
+    connections = server.connections
+    start = time.perf_counter()
+    send(count)
+    elapsed = time.perf_counter() - start
+    assert len(server.messages) - delivered == count
+    print('  {:<14} {:>8.2f}s {:>10.1f} msgs/s {:>6} connections'.format(
+        label, elapsed, count / elapsed, server.connections - connections))
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    server = StandInSMTPServer().start()
+    server.configure(app)
+
+    def per_message(count):
+        with app.app_context():
+            for i in range(count):
+                mail.send(message(i))
+
+    def batched(count):
+        mailer = BatchMailer(app, batch_size=args.batch_size)
+        for i in range(count):
+            mailer.send(message(i))
+        mailer.close()
+
+    print('{} messages'.format(args.messages))
+    try:
+        before = run('per message', server, per_message, args.messages)
+        after = run('batched', server, batched, args.messages)
+    finally:
+        server.stop()
+    print('  speed-up       {:>8.1f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Start-up time of a fresh process, broken down by phase.
+
+Each run starts a new interpreter that imports the config and the app
+package, loads an entry point (`wsgi` as gunicorn does, `manage` as the
+old Procfile and the worker do, or `job` for the app background jobs
+build) and, for the web entry points, serves a first request. The median
+of every phase over all runs is printed, along with the `create_app`
+phases recorded in `app.extensions['startup']`. `wsgi` and `manage` differ
+by the command line tooling manage.py imports; both load Redis and RQ.
+
+    python -m benchmarks.startup --runs 5 --entry wsgi --entry manage
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ENTRIES = ('wsgi', 'manage', 'job')
+
+
+def child(entry, config_name, path):
+    """Start up in this process and print the phase timings as JSON."""
+    phases = []
+    last = [time.time()]
+
+    def done(phase):
+        now = time.time()
+        phases.append((phase, now - last[0]))
+        last[0] = now
+
+    import config  # noqa
+    done('import config')
+    # config.env is read by the import above; override it afterwards.
+    os.environ['FLASK_CONFIG'] = config_name
+    import app as package
+    done('import app')
+    if entry == 'wsgi':
+        import wsgi
+        app = wsgi.app
+    elif entry == 'manage':
+        import manage
+        app = manage.app
+    else:
+        app = package.job_app()
+    created = list(app.extensions['startup'].items())
+    done('entry point')
+    # Report the entry point's imports apart from create_app itself.
+    entry_seconds = phases.pop()[1] - sum(s for _, s in created)
+    phases.extend(('create_app: ' + p, s) for p, s in created)
+    phases.append(('entry point imports', entry_seconds))
+    if path is not None and entry != 'job':
+        last[0] = time.time()
+        app.test_client().get(path)
+        done('first request ' + path)
+    print(json.dumps(phases))
+
+
+def run(entry, config_name, path):
+    start = time.time()
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child',
+               '--entry', entry, '--config', config_name]
+    if path is not None:
+        command += ['--path', path]
+    output = subprocess.check_output(command, stderr=subprocess.DEVNULL)
+    total = time.time() - start
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1]), total
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--entry', action='append', choices=ENTRIES)
+    parser.add_argument('--config', default='testing')
+    parser.add_argument('--path', default='/account/login',
+                        help='first request to serve, "" for none')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    path = args.path or None
+    if args.child:
+        return child(args.entry[0], args.config, path)
+
+    for entry in args.entry or ENTRIES:
+        runs = [run(entry, args.config, path) for _ in range(args.runs)]
+        print('{} ({} runs, median)'.format(entry, args.runs))
+        for i, (phase, _) in enumerate(runs[0][0]):
+            print('  {:<36} {:>8.1f} ms'.format(
+                phase, 1000 * median([r[0][i][1] for r in runs])))
+        print('  {:<36} {:>8.1f} ms'.format(
+            'process total', 1000 * median([r[1] for r in runs])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Query plans and latency of the `user_earning` access paths with and without
+the composite indexes declared on `UserData`.
+
+Builds a synthetic SQLite table (two million rows by default), times the
+ingest duplicate lookup, the per-site chart query and the rollup refresh
+aggregation, then creates the indexes and repeats the measurements.
+
+    python -m benchmarks.user_earning_indexes --sites 2000 --days 500
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.models import UserData
+
+QUERIES = [
+    ('ingest lookup (day, site, channel)',
+     'SELECT id FROM user_earning WHERE day = ? AND site = ? '
+     'AND channel = ? LIMIT 1',
+     lambda p: (p['day'], p['site'], p['channel'])),
+    ('chart (user_id, site) by day',
+     'SELECT day, revenue FROM user_earning WHERE user_id = ? AND site = ? '
+     'ORDER BY day DESC LIMIT 30',
+     lambda p: (p['user_id'], p['site'])),
+    ('rollup refresh (user_id, 31 days)',
+     'SELECT site, day, SUM(revenue) FROM user_earning WHERE user_id = ? '
+     'AND site IN (?, ?) AND day BETWEEN ? AND ? GROUP BY site, day',
+     lambda p: (p['user_id'], p['site'], p['site'] + 1, p['day'],
+                p['day'] + timedelta(days=30))),
+    ('channel refresh (channel, 31 days)',
+     'SELECT day, SUM(revenue) FROM user_earning WHERE channel = ? '
+     'AND day BETWEEN ? AND ? GROUP BY day',
+     lambda p: (p['channel'], p['day'], p['day'] + timedelta(days=30))),
+]
+
+
+def ddl(element):
+    return str(element.compile(dialect=sqlite.dialect()))
+
+
+def populate(conn, sites, channels, days, sites_per_user):
+    first_day = date(2016, 1, 1)
+    conn.execute(ddl(CreateTable(UserData.__table__)))
+
+    def rows():
+        for d in range(days):
+            day = first_day + timedelta(days=d)
+            for site in range(1, sites + 1):
+                user_id = (site - 1) // sites_per_user + 1
+                for channel in range(1, channels + 1):
+                    yield (user_id, day, channel, site,
+                           random.randint(0, 5000))
+
+    conn.executemany(
+        'INSERT INTO user_earning (user_id, day, channel, site, revenue) '
+        'VALUES (?, ?, ?, ?, ?)', rows())
+    conn.commit()
+    return first_day
+
+
+def samples(count, sites, channels, days, sites_per_user, first_day):
+    out = []
+    for _ in range(count):
+        site = random.randint(1, sites - 1)
+        out.append({
+            'site': site,
+            'user_id': (site - 1) // sites_per_user + 1,
+            'channel': random.randint(1, channels),
+            'day': first_day + timedelta(days=random.randint(0, days - 31))
+        })
+    return out
+
+
+def measure(conn, params):
+    results = []
+    for name, sql, bind in QUERIES:
+        plan = conn.execute('EXPLAIN QUERY PLAN ' + sql,
+                            bind(params[0])).fetchall()
+        start = time.perf_counter()
+        for p in params:
+            conn.execute(sql, bind(p)).fetchall()
+        elapsed = time.perf_counter() - start
+        results.append((name, ' / '.join(row[-1] for row in plan),
+                        elapsed * 1000.0 / len(params)))
+    return results
+
+
+def report(title, results):
+    print('\n{}'.format(title))
+    for name, plan, ms in results:
+        print('  {:<36} {:>10.3f} ms/query'.format(name, ms))
+        print('      plan: {}'.format(plan))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sites', type=int, default=2000)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--days', type=int, default=500)
+    parser.add_argument('--sites-per-user', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--db', help='SQLite file to use (default: temp)')
+    args = parser.parse_args()
+
+    random.seed(42)
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+
+    start = time.perf_counter()
+    first_day = populate(conn, args.sites, args.channels, args.days,
+                         args.sites_per_user)
+    total = conn.execute('SELECT COUNT(*) FROM user_earning').fetchone()[0]
+    print('Loaded {:,} rows into {} in {:.1f}s'.format(
+        total, path, time.perf_counter() - start))
+
+    params = samples(args.queries, args.sites, args.channels, args.days,
+                     args.sites_per_user, first_day)
+    before = measure(conn, params)
+    report('Without indexes', before)
+
+    start = time.perf_counter()
+    for index in UserData.__table__.indexes:
+        conn.execute(ddl(CreateIndex(index)))
+    conn.execute('ANALYZE')
+    conn.commit()
+    print('\nBuilt {} indexes in {:.1f}s'.format(
+        len(UserData.__table__.indexes), time.perf_counter() - start))
+
+    after = measure(conn, params)
+    report('With indexes', after)
+
+    print('\nSpeed-up')
+    for (name, _, slow), (_, _, fast) in zip(before, after):
+        print('  {:<36} {:>10.1f}x'.format(name, slow / fast if fast else 0))
+
+    conn.close()
+    if not args.db:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
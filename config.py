@@ -10,28 +10,57 @@ else:
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-if os.path.exists('config.env'):
-    print('Importing environment from .env file')
-    for line in open('config.env'):
-        var = line.strip().split('=')
-        if len(var) == 2:
-            os.environ[var[0]] = var[1]
+
+def load_env(path='config.env'):
+    """Copy the variables in `path`, if it exists, into the environment."""
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                var = line.strip().split('=')
+                if len(var) == 2:
+                    os.environ[var[0]] = var[1]
+
+
+# Read once, when this module is first imported; the settings below are
+# taken from the environment at that point.
+load_env()
 
 
 class Config:
     APP_NAME = 'MF'
-    if os.environ.get('SECRET_KEY'):
-        SECRET_KEY = os.environ.get('SECRET_KEY')
-    else:
-        SECRET_KEY = 'SECRET_KEY_ENV_VAR_NOT_SET'
-        print('SECRET KEY ENV VAR NOT SET! SHOULD NOT SEE IN PRODUCTION')
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'SECRET_KEY_ENV_VAR_NOT_SET'
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
+    # Each process keeps up to SQLALCHEMY_POOL_SIZE connections open and
+    # opens up to SQLALCHEMY_MAX_OVERFLOW more under load. A request
+    # waits SQLALCHEMY_POOL_TIMEOUT seconds for one before failing.
+    # Connections are replaced after SQLALCHEMY_POOL_RECYCLE seconds and,
+    # with SQLALCHEMY_POOL_PRE_PING, tested before use. In web requests
+    # PostgreSQL cancels statements running over
+    # SQLALCHEMY_STATEMENT_TIMEOUT seconds; jobs and commands have no
+    # limit. See app/database.py.
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10)
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 10)
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    SQLALCHEMY_POOL_PRE_PING = True
+    SQLALCHEMY_STATEMENT_TIMEOUT = float(
+        os.environ.get('DB_STATEMENT_TIMEOUT') or 30)
 
     MAIL_SERVER = 'smtp.sendgrid.net'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    # Worker email is sent over pooled SMTP connections; connections idle
+    # longer than MAIL_KEEPALIVE seconds are checked before reuse. Bulk
+    # email jobs send MAIL_BATCH_SIZE messages per connection. Transient
+    # failures are retried MAIL_MAX_RETRIES times, starting
+    # MAIL_RETRY_BACKOFF seconds apart and doubling each time.
+    MAIL_BATCH_SIZE = 20
+    MAIL_POOL_SIZE = 1
+    MAIL_KEEPALIVE = 60
+    MAIL_MAX_RETRIES = 3
+    MAIL_RETRY_BACKOFF = 0.5
 
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or 'password'
     ADMIN_EMAIL = os.environ.get(
@@ -42,6 +71,67 @@ class Config:
 
     REDIS_URL = os.getenv('REDISTOGO_URL') or 'http://localhost:6379'
 
+    # Logged in users and roles are cached for USER_CACHE_TTL seconds, up
+    # to USER_CACHE_SIZE per process. With USER_CACHE_REDIS set they are
+    # shared through Redis too, so every process skips the query. Changes
+    # evict them from every process at once with CACHE_PUBSUB, and after
+    # USER_CACHE_TTL seconds at the latest without it.
+    USER_CACHE_SIZE = 4096
+    USER_CACHE_TTL = 60
+    USER_CACHE_REDIS = bool(os.environ.get('USER_CACHE_REDIS'))
+    # Rendered pages are cached in each process (memory), shared through
+    # Redis (redis) or not at all (null), for RESPONSE_CACHE_TIMEOUT
+    # seconds at most. With memory, data changed in one process, or in
+    # the RQ worker, leaves stale pages in the others, so it only suits
+    # a single process. See app/view_cache.py.
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') or \
+        'memory'
+    RESPONSE_CACHE_SIZE = 512
+    RESPONSE_CACHE_TIMEOUT = 300
+    # Seconds before the role permission table is reloaded. Role changes
+    # reach every process at once with CACHE_PUBSUB; this picks them up
+    # without it, or after an announcement was missed.
+    ROLE_TABLE_TTL = 300
+    # Editable HTML blocks and logged in users are kept in each process.
+    # With CACHE_PUBSUB set, changes are announced over Redis so every
+    # process drops its copy at once. See app/cache.py.
+    CACHE_PUBSUB = bool(os.environ.get('CACHE_PUBSUB'))
+    # Record per-endpoint timings, SQL and template time and response
+    # sizes, served at /metrics (behind METRICS_TOKEN if set). Requests
+    # over SLOW_REQUEST_THRESHOLD seconds are logged. See
+    # app/instrumentation.py.
+    INSTRUMENTATION = bool(os.environ.get('INSTRUMENTATION'))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SLOW_REQUEST_THRESHOLD = float(
+        os.environ.get('SLOW_REQUEST_THRESHOLD') or 1.0)
+    # Profile a PROFILER_SAMPLE_RATE fraction of requests, and those of
+    # administrators sending PROFILER_HEADER. Profiles are downloaded
+    # from /admin/profiles. See app/profiler.py.
+    PROFILER = bool(os.environ.get('PROFILER'))
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0)
+    PROFILER_HEADER = 'X-Profile'
+
+    # Rows per INSERT statement when ingesting reports. Five columns per
+    # row keeps a batch under SQLite's 999 bound parameter limit.
+    INGEST_BATCH_SIZE = 150
+    # Seconds a background report import may run before RQ kills it.
+    INGEST_JOB_TIMEOUT = 3600
+
+    # Set up the CSS and JS bundles. Processes that render no pages, like
+    # background workers, turn it off to start faster. With
+    # ASSETS_USE_MANIFEST set, pages link to the bundles `manage.py
+    # build_assets` listed in ASSETS_MANIFEST_FILE instead of building
+    # them.
+    ASSETS_PIPELINE = True
+    ASSETS_USE_MANIFEST = False
+    ASSETS_MANIFEST_FILE = os.path.join(basedir, 'app', 'static',
+                                        'manifest.json')
+
+    # Responses smaller than this fit in a packet or two and are not
+    # worth compressing. Static files are never compressed per request;
+    # see app/static_files.py.
+    COMPRESS_MIN_SIZE = 1400
+
     # RAYGUN_APIKEY = os.environ.get('RAYGUN_APIKEY')
 
     # Parse the REDIS_URL to set RQ config variables
@@ -64,7 +154,9 @@ class Config:
 
     @staticmethod
     def init_app(app):
-        pass
+        if app.config['SECRET_KEY'] == 'SECRET_KEY_ENV_VAR_NOT_SET':
+            app.logger.warning(
+                'SECRET KEY ENV VAR NOT SET! SHOULD NOT SEE IN PRODUCTION')
 
 
 class DevelopmentConfig(Config):
@@ -72,7 +164,13 @@ class DevelopmentConfig(Config):
     ASSETS_DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
-    print('THIS APP IS IN DEBUG MODE. YOU SHOULD NOT SEE THIS IN PRODUCTION.  ' + SQLALCHEMY_DATABASE_URI)
+
+    @classmethod
+    def init_app(cls, app):
+        Config.init_app(app)
+        app.logger.warning('THIS APP IS IN DEBUG MODE. YOU SHOULD NOT SEE '
+                           'THIS IN PRODUCTION.  ' +
+                           app.config['SQLALCHEMY_DATABASE_URI'])
 
 
 class TestingConfig(Config):
@@ -80,12 +178,25 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
     WTF_CSRF_ENABLED = False
+    # Enough for the test client; benchmarks override it.
+    SQLALCHEMY_POOL_SIZE = 2
+    SQLALCHEMY_MAX_OVERFLOW = 2
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
     SSL_DISABLE = (os.environ.get('SSL_DISABLE') or 'True') == 'True'
+    CACHE_PUBSUB = (os.environ.get('CACHE_PUBSUB') or 'True') == 'True'
+    ASSETS_USE_MANIFEST = \
+        (os.environ.get('ASSETS_USE_MANIFEST') or 'True') == 'True'
+    # Several gunicorn workers and the RQ worker must see each other's
+    # invalidations.
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') or \
+        'redis'
+    # Gunicorn workers x (size + overflow) must stay under the server's
+    # max_connections.
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 5)
 
     @classmethod
     def init_app(cls, app):
@@ -5,11 +5,9 @@ from config import Config
 
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager, Shell
-from redis import Redis
-from rq import Connection, Queue, Worker
 
-from app import create_app, db
-from app.models import Role, User
+from app import create_app, db, set_job_app
+from app.models import Role, User, rebuild_revenue_rollups
 
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -45,6 +43,27 @@ def recreate_db():
     db.session.commit()
 
 
+@manager.command
+def rebuild_rollups():
+    """Recomputes every revenue rollup table from the raw earnings."""
+    rebuild_revenue_rollups()
+
+
+@manager.command
+def build_assets():
+    """
+    Builds the CSS and JS bundles into fingerprinted, compressed files and
+    writes their manifest, for ASSETS_USE_MANIFEST. Also compresses the
+    other static text files.
+    """
+    from app.assets import build_assets, compress_static
+
+    for name, path in sorted(build_assets(app).items()):
+        print('{:<12} {}'.format(name, path))
+    print('Wrote {}'.format(app.config['ASSETS_MANIFEST_FILE']))
+    print('Compressed {} static files'.format(compress_static(app)))
+
+
 @manager.option(
     '-n',
     '--number-users',
@@ -89,9 +108,21 @@ def setup_general():
             print('Added administrator {}'.format(user.full_name()))
 
 
-@manager.command
-def run_worker():
-    """Initializes a slim rq task queue."""
+@manager.option(
+    '--simple',
+    action='store_true',
+    default=False,
+    help='Run jobs in the worker process instead of forking for each',
+    dest='simple')
+def run_worker(simple):
+    """
+    Initializes a slim rq task queue. Each job runs in a forked work
+    horse that inherits this process's app, or with --simple in this
+    process, which also keeps SMTP connections open across jobs.
+    """
+    from redis import Redis
+    from rq import Connection, Queue, SimpleWorker, Worker
+
     listen = ['default']
     conn = Redis(
         host=app.config['RQ_DEFAULT_HOST'],
@@ -99,8 +130,12 @@ def run_worker():
         db=0,
         password=app.config['RQ_DEFAULT_PASSWORD'])
 
+    # Set before forking, so work horses inherit the app instead of
+    # creating one per job.
+    set_job_app(app)
+    worker_class = SimpleWorker if simple else Worker
     with Connection(conn):
-        worker = Worker(map(Queue, listen))
+        worker = worker_class(map(Queue, listen))
         worker.work()
 
 
@@ -0,0 +1,59 @@
+"""Composite indexes and unique (site, channel, day) on user_earning
+
+Revision ID: 3f1c2a9d7b10
+Revises: a61d0c7e2b94
+Create Date: 2017-07-03 10:12:44.318209
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = 'a61d0c7e2b94'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.env')
+
+INDEXES = [
+    ('uq_user_earning_site_channel_day', ['site', 'channel', 'day'], True),
+    ('ix_user_earning_site_day', ['site', 'day'], False),
+    ('ix_user_earning_user_site_day', ['user_id', 'site', 'day'], False),
+    ('ix_user_earning_channel_day', ['channel', 'day'], False),
+]
+
+# Rows sharing a (site, channel, day) with a newer row
+DUPLICATES = (
+    'FROM user_earning '
+    'WHERE site IS NOT NULL AND channel IS NOT NULL '
+    'AND day IS NOT NULL AND id NOT IN ('
+    'SELECT max_id FROM (SELECT MAX(id) AS max_id FROM user_earning '
+    'GROUP BY site, channel, day) AS keep)')
+
+
+def upgrade():
+    # Databases made with `manage.py recreate_db` already have the indexes.
+    inspector = sa.engine.reflection.Inspector.from_engine(op.get_bind())
+    existing = [i['name'] for i in inspector.get_indexes('user_earning')]
+    if 'uq_user_earning_site_channel_day' not in existing:
+        # The unique index needs one row per (site, channel, day). Keep the
+        # newest, as importing a report again replaces the rows it holds.
+        duplicates = op.get_bind().execute(
+            'SELECT COUNT(*) ' + DUPLICATES).scalar()
+        if duplicates:
+            logger.warning('Deleting %d user_earning rows superseded by a '
+                           'newer row for the same site, channel and day',
+                           duplicates)
+            op.execute('DELETE ' + DUPLICATES)
+    for name, columns, unique in INDEXES:
+        if name not in existing:
+            op.create_index(name, 'user_earning', columns, unique=unique)
+
+
+def downgrade():
+    for name, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name='user_earning')
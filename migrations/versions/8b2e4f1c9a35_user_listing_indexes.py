@@ -0,0 +1,42 @@
+"""Case-insensitive sort and search indexes on users
+
+Revision ID: 8b2e4f1c9a35
+Revises: 3f1c2a9d7b10
+Create Date: 2017-07-18 15:40:12.602114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4f1c9a35'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def has_index(name):
+    # Expression indexes are not reflected, so ask the catalog.
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'index' " \
+            'AND name = :name'
+    else:
+        query = 'SELECT 1 FROM pg_indexes WHERE indexname = :name'
+    return bind.execute(sa.text(query), name=name).scalar() is not None
+
+
+def upgrade():
+    # Databases made with `manage.py recreate_db` already have the indexes.
+    if not has_index('ix_users_first_name_key'):
+        op.create_index('ix_users_first_name_key', 'users', [
+            sa.text("coalesce(lower(first_name), '')"), sa.text('id')])
+    if not has_index('ix_users_email_key'):
+        op.create_index('ix_users_email_key', 'users', [
+            sa.text("coalesce(lower(email), '')"), sa.text('id')])
+
+
+def downgrade():
+    op.drop_index('ix_users_email_key', table_name='users')
+    op.drop_index('ix_users_first_name_key', table_name='users')
@@ -0,0 +1,36 @@
+"""Revenue per user, site and day rollup
+
+Revision ID: a61d0c7e2b94
+Revises: None
+Create Date: 2017-06-27 16:21:05.447391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a61d0c7e2b94'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases made with `manage.py recreate_db` already have the table.
+    inspector = sa.engine.reflection.Inspector.from_engine(op.get_bind())
+    if 'revenue_site_daily' in inspector.get_table_names():
+        return
+    op.create_table(
+        'revenue_site_daily',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('site_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('revenue', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['site_id'], ['user_sites.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'site_id', 'day'))
+
+
+def downgrade():
+    op.drop_table('revenue_site_daily')
@@ -0,0 +1,32 @@
+"""Revenue rollup version counter
+
+Revision ID: c4e7a2f9d813
+Revises: 8b2e4f1c9a35
+Create Date: 2017-07-31 11:05:38.920417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a2f9d813'
+down_revision = '8b2e4f1c9a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases made with `manage.py recreate_db` already have the table.
+    inspector = sa.engine.reflection.Inspector.from_engine(op.get_bind())
+    if 'revenue_version' in inspector.get_table_names():
+        return
+    op.create_table(
+        'revenue_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('revenue_version')
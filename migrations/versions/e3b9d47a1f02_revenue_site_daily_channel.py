@@ -0,0 +1,57 @@
+"""Split the revenue rollup by channel
+
+Revision ID: e3b9d47a1f02
+Revises: c4e7a2f9d813
+Create Date: 2017-08-14 10:42:17.305118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b9d47a1f02'
+down_revision = 'c4e7a2f9d813'
+branch_labels = None
+depends_on = None
+
+
+def create_rollup(channel):
+    """Create `revenue_site_daily` and fill it from `user_earning`."""
+    columns = [
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('site_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('revenue', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['site_id'], ['user_sites.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'])
+    ]
+    key = ['user_id', 'site_id', 'day']
+    if channel:
+        columns.insert(3, sa.Column('channel', sa.Integer(), nullable=False))
+        key.append('channel')
+    columns.append(sa.PrimaryKeyConstraint(*key))
+    op.create_table('revenue_site_daily', *columns)
+    # The rollup is derived data, so rebuild it rather than convert it.
+    group = 'user_id, site, day' + \
+        (', COALESCE(channel, 0)' if channel else '')
+    op.execute(
+        'INSERT INTO revenue_site_daily ({}, revenue) '
+        'SELECT {}, SUM(revenue) FROM user_earning '
+        'WHERE user_id IS NOT NULL AND site IS NOT NULL '
+        'GROUP BY {}'.format(', '.join(key), group, group))
+
+
+def upgrade():
+    # Databases made with `manage.py recreate_db` already have the column.
+    inspector = sa.engine.reflection.Inspector.from_engine(op.get_bind())
+    if 'channel' in [c['name'] for c in
+                     inspector.get_columns('revenue_site_daily')]:
+        return
+    op.drop_table('revenue_site_daily')
+    create_rollup(channel=True)
+
+
+def downgrade():
+    op.drop_table('revenue_site_daily')
+    create_rollup(channel=False)
@@ -0,0 +1,36 @@
+"""
+A stand-in for the Redis client `Invalidations` uses. Its listener
+subscribes, receives the given messages and then stops. Functions
+among the messages are called instead, e.g. to fill a cache after the
+listener has subscribed.
+"""
+
+
+class StandInPubSub(object):
+    def __init__(self, messages):
+        self.messages = messages
+
+    def subscribe(self, channel):
+        self.channel = channel
+
+    def listen(self):
+        yield {'type': 'subscribe', 'channel': self.channel, 'data': 1}
+        for message in self.messages:
+            if callable(message):
+                message()
+                continue
+            yield {'type': 'message', 'channel': self.channel,
+                   'data': message.encode('utf-8')}
+        raise SystemExit  # stop the listener thread
+
+
+class StandInRedis(object):
+    def __init__(self, messages=()):
+        self.messages = list(messages)
+        self.published = []
+
+    def pubsub(self):
+        return StandInPubSub(self.messages)
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
@@ -0,0 +1,68 @@
+"""
+A local stand-in SMTP server for tests and benchmarks.
+
+It accepts every message, keeps the envelope of each and counts the
+connections it was sent over, so callers can check both delivery and
+connection reuse without talking to a real mail server. It is built on
+`smtpd` and `asyncore`, which Python 3.12 removed; importing it fails
+there.
+"""
+import asyncore
+import smtpd
+import threading
+
+from app import mail
+
+
+class StandInSMTPServer(smtpd.SMTPServer):
+    def __init__(self, host='127.0.0.1', port=0):
+        self.map = {}
+        smtpd.SMTPServer.__init__(
+            self, (host, port), None, map=self.map, decode_data=False)
+        self.host, self.port = self.socket.getsockname()[:2]
+        self.messages = []
+        self.connections = 0
+        self.thread = None
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append((mailfrom, rcpttos))
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=asyncore.loop, kwargs={'timeout': 0.01, 'map': self.map})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        for channel in list(self.map.values()):
+            channel.close()
+        self.thread.join()
+
+    def configure(self, app):
+        """Point `app`'s mail settings at this server."""
+        app.config.update(MAIL_SERVER=self.host, MAIL_PORT=self.port,
+                          MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                          MAIL_USERNAME=None, MAIL_PASSWORD=None,
+                          MAIL_SUPPRESS_SEND=False)
+        mail.init_app(app)
+
+
+class FlakySMTPServer(StandInSMTPServer):
+    """Answers the first `failures` messages with `reply`."""
+
+    def __init__(self, failures, reply='451 Try again later'):
+        StandInSMTPServer.__init__(self)
+        self.failures = failures
+        self.reply = reply
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            return self.reply
+        return StandInSMTPServer.process_message(self, peer, mailfrom,
+                                                 rcpttos, data)
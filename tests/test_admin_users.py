@@ -0,0 +1,96 @@
+import json
+import unittest
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Permission, Role, User
+
+
+class RegisteredUsersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        admin_role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        self.admin = User(first_name='Admin', email='admin@example.com',
+                          password='password', confirmed=True,
+                          role=admin_role)
+        db.session.add(self.admin)
+        for i in range(120):
+            db.session.add(User(first_name='user%03d' % (i % 60),
+                                email='u%03d@example.com' % i,
+                                confirmed=True))
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post('/account/login', data={
+            'email': 'admin@example.com', 'password': 'password'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, **params):
+        response = self.client.get('/admin/users.json', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data(as_text=True))
+
+    def test_keyset_pages_cover_every_user_once(self):
+        seen, after = [], None
+        while True:
+            params = {'limit': 50}
+            if after:
+                params['after'] = after
+            page = self.get(**params)
+            seen.extend(page['users'])
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(len(seen), 121)
+        self.assertEqual(len(set(u['id'] for u in seen)), 121)
+        names = [u['first_name'].lower() for u in seen]
+        self.assertEqual(names, sorted(names))
+
+    def test_search_and_role_filter(self):
+        page = self.get(q='USER01')
+        self.assertEqual(len(page['users']), 20)
+        self.assertTrue(all(u['first_name'].startswith('user01')
+                            for u in page['users']))
+        self.assertEqual(len(self.get(q='u119@')['users']), 1)
+        admins = self.get(role=self.admin.role_id)['users']
+        self.assertEqual([u['email'] for u in admins], ['admin@example.com'])
+        self.assertEqual(admins[0]['role'], 'Administrator')
+
+    def test_sort_by_email(self):
+        emails = [u['email'] for u in self.get(sort='email', limit=5)['users']]
+        self.assertEqual(emails, sorted(emails))
+        self.assertEqual(emails[0], 'admin@example.com')
+
+    def test_page_query_count_does_not_grow(self):
+        queries = []
+        listener = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            self.get(limit=100)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertLessEqual(len(queries), 3)
+
+    def test_sort_key_is_indexed(self):
+        plan = db.engine.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM users "
+            "ORDER BY coalesce(lower(first_name), ''), id LIMIT 10").fetchall()
+        self.assertIn('ix_users_first_name_key', str(plan))
+
+    def test_bad_cursor(self):
+        response = self.client.get('/admin/users.json?after=nope')
+        self.assertEqual(response.status_code, 400)
+
+    def test_listing_page(self):
+        response = self.client.get('/admin/users')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Load more users', response.get_data(as_text=True))
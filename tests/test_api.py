@@ -0,0 +1,148 @@
+import json
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+from app import create_app, db
+from app.models import (Permission, Role, RevenueVersion, Sites, User,
+                        UserData, rebuild_revenue_rollups)
+
+
+class RevenueAPITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(first_name='Jane', email='jane@example.com',
+                         password='password', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.site = Sites(user_id=self.user.id, link='one.example.com')
+        db.session.add(self.site)
+        db.session.commit()
+        self.yesterday = date.today() - timedelta(days=1)
+        db.session.add_all([
+            UserData(user_id=self.user.id, site=self.site.id, channel=1,
+                     revenue=3, day=self.yesterday),
+            UserData(user_id=self.user.id, site=self.site.id, channel=2,
+                     revenue=4, day=self.yesterday),
+            UserData(user_id=self.user.id, site=self.site.id, channel=1,
+                     revenue=5, day=self.yesterday - timedelta(days=40)),
+        ])
+        db.session.commit()
+        rebuild_revenue_rollups()
+        self.client = self.app.test_client()
+        self.client.post('/account/login', data={
+            'email': 'jane@example.com', 'password': 'password'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, headers=None, **params):
+        return self.client.get('/api/revenue', query_string=params,
+                               headers=headers)
+
+    def test_default_range(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(body['periods']), 30)
+        self.assertEqual(body['end'], self.yesterday.isoformat())
+        self.assertEqual(body['sites'][0]['label'], 'one.example.com')
+        self.assertEqual(body['sites'][0]['data'][-1], 7)
+        self.assertEqual(sum(body['sites'][0]['data']), 7)
+        self.assertIn('private', response.headers['Cache-Control'])
+
+    def test_month_granularity_and_channel_filter(self):
+        start = (self.yesterday - timedelta(days=40)).isoformat()
+        body = json.loads(self.get(start=start, granularity='month',
+                                   channel=2).get_data(as_text=True))
+        self.assertEqual(sum(body['sites'][0]['data']), 4)
+        self.assertTrue(all(p.endswith('-01') for p in body['periods']))
+        body = json.loads(self.get(start=start, granularity='month')
+                          .get_data(as_text=True))
+        self.assertEqual(sum(body['sites'][0]['data']), 12)
+
+    def test_conditional_get(self):
+        etag = self.get().headers['ETag']
+        response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertNotEqual(self.get(granularity='month').headers['ETag'],
+                            etag)
+
+        version = RevenueVersion.current()
+        rebuild_revenue_rollups()
+        self.assertEqual(RevenueVersion.current(), version + 1)
+        response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_version_is_read_once(self):
+        reads = []
+        current = RevenueVersion.current
+
+        def counted():
+            reads.append(1)
+            return current()
+
+        with mock.patch.object(RevenueVersion, 'current', counted):
+            self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(len(reads), 1)
+
+    def test_default_range_moves_with_the_date(self):
+        etag = self.get().headers['ETag']
+
+        class Tomorrow(date):
+            @classmethod
+            def today(cls):
+                return date.today() + timedelta(days=1)
+
+        with mock.patch('app.api.views.date', Tomorrow):
+            response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.get_data(as_text=True))
+        self.assertEqual(body['end'],
+                         (self.yesterday + timedelta(days=1)).isoformat())
+
+    def test_site_changes(self):
+        etag = self.get().headers['ETag']
+        site = Sites(user_id=self.user.id, link='two.example.com')
+        db.session.add(site)
+        db.session.commit()
+        response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(body['sites']), 2)
+
+        etag = response.headers['ETag']
+        db.session.delete(site)
+        db.session.commit()
+        response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(body['sites']), 1)
+
+    def test_bad_arguments(self):
+        self.assertEqual(self.get(start='yesterday').status_code, 400)
+        self.assertEqual(self.get(granularity='hour').status_code, 400)
+        self.assertEqual(self.get(start='2020-01-02',
+                                  end='2020-01-01').status_code, 400)
+        self.assertEqual(self.get(start='2010-01-01').status_code, 400)
+
+    def test_only_admins_choose_the_user(self):
+        other = User(first_name='Bob', email='bob@example.com',
+                     password='password', confirmed=True)
+        db.session.add(other)
+        db.session.commit()
+        body = json.loads(self.get(user_id=other.id).get_data(as_text=True))
+        self.assertEqual(len(body['sites']), 1)
+        self.user.role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        db.session.commit()
+        body = json.loads(self.get(user_id=other.id).get_data(as_text=True))
+        self.assertEqual(body['sites'], [])
@@ -0,0 +1,70 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+from app.assets import BUNDLES, build_assets
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.tmp, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_build(self):
+        # app_css needs the sass program, so build the other bundles.
+        app = create_app('testing', ASSETS_MANIFEST_FILE=self.manifest)
+        # Build into a scratch folder rather than app/static
+        app.static_folder = os.path.join(self.tmp, 'static')
+        manifest = build_assets(app, ['app_js', 'vendor_css'])
+        built = [os.path.join(app.static_folder, path)
+                 for path in manifest.values()]
+        with open(self.manifest) as f:
+            self.assertEqual(json.load(f), manifest)
+        self.assertRegex(manifest['app_js'],
+                         r'^scripts/app\.[0-9a-f]{12}\.js$')
+        self.assertRegex(manifest['vendor_css'],
+                         r'^styles/vendor\.[0-9a-f]{12}\.css$')
+        for path in built:
+            with open(path, 'rb') as f, gzip.open(path + '.gz') as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_pages_use_manifest(self):
+        with open(self.manifest, 'w') as f:
+            json.dump({
+                'app_css': 'styles/app.0123456789ab.css',
+                'app_js': 'scripts/app.0123456789ab.js',
+                'vendor_css': 'styles/vendor.0123456789ab.css',
+                'vendor_js': 'scripts/vendor.0123456789ab.js'
+            }, f)
+        app = create_app('testing', ASSETS_USE_MANIFEST=True,
+                         ASSETS_MANIFEST_FILE=self.manifest)
+        self.assertNotIn('assets_environment', app.jinja_env.__dict__)
+        page = app.test_client().get('/account/login').get_data(as_text=True)
+        self.assertIn('href="/static/styles/vendor.0123456789ab.css"', page)
+        self.assertIn('src="/static/scripts/app.0123456789ab.js"', page)
+
+    def test_page_bundles(self):
+        with open(self.manifest, 'w') as f:
+            json.dump({name: name + '.js' for name in BUNDLES}, f)
+        app = create_app('testing', ASSETS_USE_MANIFEST=True,
+                         ASSETS_MANIFEST_FILE=self.manifest)
+        client = app.test_client()
+        page = client.get('/account/login').get_data(as_text=True)
+        self.assertIn('/static/vendor_js.js', page)
+        self.assertNotIn('password_js', page)
+        self.assertNotIn('chart_js', page)
+        page = client.get('/account/register').get_data(as_text=True)
+        self.assertEqual(page.count('/static/vendor_js.js'), 1)
+        self.assertIn('src="/static/password_js.js" async', page)
+
+    def test_missing_manifest_falls_back(self):
+        app = create_app('testing', ASSETS_USE_MANIFEST=True,
+                         ASSETS_MANIFEST_FILE=self.manifest)
+        self.assertIn('assets_environment', app.jinja_env.__dict__)
@@ -21,3 +21,12 @@ class BasicsTestCase(unittest.TestCase):
 
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
+
+    def test_startup_phases(self):
+        self.assertEqual(list(current_app.extensions['startup']),
+                         ['config', 'extensions', 'assets', 'blueprints'])
+
+    def test_without_assets_pipeline(self):
+        app = create_app('testing', ASSETS_PIPELINE=False)
+        self.assertNotIn('assets_environment', app.jinja_env.__dict__)
+        self.assertIn('main.index', app.view_functions)
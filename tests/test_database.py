@@ -0,0 +1,114 @@
+import json
+import unittest
+
+from sqlalchemy import exc
+
+from app import create_app, db
+from app.database import TimedQueuePool, pool_status, statement_timeout
+from app.models import Permission, Role, User
+
+
+class FakeCursor(object):
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, statement):
+        self.executed.append(statement)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """Stands in for a PostgreSQL `Connection` and its DBAPI connection."""
+
+    def __init__(self):
+        self.executed = []
+        self.dialect = self
+        self.name = 'postgresql'
+        self.connection = self
+
+    def cursor(self):
+        return FakeCursor(self.executed)
+
+
+class DatabasePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing', SQLALCHEMY_POOL_TIMEOUT=0.1)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        admin_role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        db.session.add(User(first_name='Admin', email='admin@example.com',
+                            password='password', confirmed=True,
+                            role=admin_role))
+        db.session.commit()
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_pool_config(self):
+        pool = db.engine.pool
+        self.assertIsInstance(pool, TimedQueuePool)
+        self.assertEqual(pool.size(), 2)
+        self.assertEqual(pool._max_overflow, 2)
+        self.assertEqual(pool._recycle, 1800)
+
+    def test_exhaustion(self):
+        connections = [db.engine.connect() for _ in range(4)]
+        status = pool_status(db.engine)
+        self.assertEqual(status['checked_out'], 4)
+        self.assertEqual(status['overflow'], 2)
+        with self.assertRaises(exc.TimeoutError):
+            db.engine.connect()
+        self.assertEqual(pool_status(db.engine)['timeouts'], 1)
+        self.assertGreaterEqual(pool_status(db.engine)['max_wait_seconds'],
+                                0.1)
+        for connection in connections:
+            connection.close()
+        status = pool_status(db.engine)
+        self.assertEqual(status['checked_out'], 0)
+        self.assertEqual(status['checked_in'], 2)
+
+    def test_pre_ping_replaces_closed_connection(self):
+        connection = db.engine.raw_connection()
+        dbapi_connection = connection.connection
+        connection.close()
+        # As if the server dropped it while it sat in the pool
+        dbapi_connection.close()
+        self.assertEqual(db.engine.scalar('SELECT 1'), 1)
+        self.assertEqual(pool_status(db.engine)['disconnects'], 1)
+
+    def test_admin_endpoint(self):
+        client = self.app.test_client()
+        self.assertNotEqual(client.get('/admin/db/pool').status_code, 200)
+        client.post('/account/login', data={
+            'email': 'admin@example.com', 'password': 'password'})
+        status = json.loads(client.get('/admin/db/pool').data.decode())
+        self.assertEqual(status['pool'], 'TimedQueuePool')
+        self.assertGreater(status['checkouts'], 0)
+
+    def test_metrics(self):
+        app = create_app('testing', INSTRUMENTATION=True)
+        text = app.test_client().get('/metrics').get_data(as_text=True)
+        self.assertIn('db_pool_size 2', text)
+        self.assertIn('db_pool_checked_out ', text)
+        self.assertIn('db_pool_wait_seconds_total ', text)
+
+    def test_statement_timeout_only_in_requests(self):
+        conn = FakeConnection()
+        statement_timeout(conn)
+        # As in `manage.py` commands
+        with self.app.test_request_context():
+            statement_timeout(conn)
+        self.assertEqual(conn.executed, [])
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            statement_timeout(conn)
+        self.assertEqual(conn.executed,
+                         ['SET LOCAL statement_timeout = 30000'])
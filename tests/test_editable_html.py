@@ -0,0 +1,75 @@
+import unittest
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.cache import Invalidations
+from app.models import EditableHTML
+from app.models.miscellaneous import editable_html_cache
+from tests.pubsub import StandInRedis
+
+
+class EditableHTMLTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add(EditableHTML(editor_name='about', value='First'))
+        db.session.commit()
+        self.queries = 0
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count(self, *args):
+        self.queries += 1
+
+    def test_read_from_cache(self):
+        self.assertEqual(EditableHTML.get_editable_html('about').value,
+                         'First')
+        self.queries = 0
+        self.assertEqual(EditableHTML.get_editable_html('about').value,
+                         'First')
+        self.assertEqual(EditableHTML.get_editable_html('missing').value, '')
+        self.assertEqual(EditableHTML.get_editable_html('missing').value, '')
+        self.assertEqual(self.queries, 1)
+
+    def test_set_invalidates(self):
+        EditableHTML.get_editable_html('about')
+        EditableHTML.set_editable_html('about', 'Second')
+        self.assertEqual(EditableHTML.get_editable_html('about').value,
+                         'Second')
+        EditableHTML.set_editable_html('new', 'Added')
+        self.assertEqual(EditableHTML.get_editable_html('new').value,
+                         'Added')
+
+    def test_stale_read_is_not_stored(self):
+        cache = editable_html_cache()
+        value, version = cache.get('about')
+        cache.invalidate('about')
+        cache.set('about', 'Stale', version)
+        self.assertEqual(cache.get('about'), (None, version + 1))
+
+    def test_edits_from_other_processes(self):
+        self.app.config['CACHE_PUBSUB'] = True
+        invalidations = self.app.extensions['invalidations'] = \
+            Invalidations(self.app)
+        invalidations.redis = StandInRedis(
+            messages=['editable_html:about'])
+        cache = editable_html_cache()
+        cache.blocks['about'] = 'Old'
+        # Not trusted before the listener has subscribed
+        self.assertIsNone(cache.get('about')[0])
+        invalidations.listener.join(1)
+        self.assertTrue(invalidations.subscribed)
+        self.assertEqual(cache.blocks, {})
+        self.assertEqual(cache.version, 2)
+
+        EditableHTML.set_editable_html('about', 'Second')
+        self.assertEqual(invalidations.redis.published,
+                         [('invalidate', 'editable_html:about')])
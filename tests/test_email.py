@@ -0,0 +1,193 @@
+import os
+import unittest
+from unittest import mock
+
+import app as app_package
+from app import create_app, job_app, mail
+from app.email import (BatchMailer, EmailSkeleton, close_mailer, get_mailer,
+                       send_bulk_email, send_email)
+from flask import render_template
+from flask_mail import Message
+
+try:
+    import smtpd  # noqa: F401
+except ImportError:  # removed, with asyncore, in Python 3.12
+    FlakySMTPServer = StandInSMTPServer = None
+else:
+    from tests.smtp_server import FlakySMTPServer, StandInSMTPServer
+
+
+class FakeUser(object):
+    def __init__(self, name='Jane', email='user@example.com'):
+        self.name = name
+        self.email = email
+
+    def full_name(self):
+        return self.name
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        close_mailer()
+        self.app_context.pop()
+
+    def test_send_email_is_sent_at_once(self):
+        with mail.record_messages() as outbox:
+            send_email('user@example.com', 'Hello', 'account/email/invite',
+                       user=FakeUser(), invite_link='http://example.com/x')
+            self.assertEqual(len(outbox), 1)
+            send_email('user@example.com', 'Hello', 'account/email/invite',
+                       user=FakeUser(), invite_link='http://example.com/y')
+        self.assertEqual(len(get_mailer().queue), 0)
+        self.assertEqual(len(outbox), 2)
+        self.assertIn('Dear Jane', outbox[0].body)
+        self.assertIn('http://example.com/y', outbox[1].html)
+        self.assertEqual(get_mailer().pool.opened, 1)
+
+    def test_skeleton_matches_full_render(self):
+        user = FakeUser('Tom & <Jerry>', 'tom@example.com')
+        link = 'http://example.com/join?a=1&b=2'
+        skeleton = EmailSkeleton('account/email/invite', ['user',
+                                                          'invite_link'])
+        body, html = skeleton.render(user=user, invite_link=link)
+        self.assertEqual(body, render_template(
+            'account/email/invite.txt', user=user, invite_link=link))
+        self.assertEqual(html, render_template(
+            'account/email/invite.html', user=user, invite_link=link))
+        self.assertIn('Tom &amp; &lt;Jerry&gt;', html)
+
+    def test_send_bulk_email(self):
+        recipients = [{
+            'recipient': 'user{}@example.com'.format(i),
+            'user': FakeUser('User {}'.format(i)),
+            'invite_link': 'http://example.com/{}'.format(i)
+        } for i in range(3)]
+        with mail.record_messages() as outbox:
+            sent = send_bulk_email(recipients, 'Hello',
+                                   'account/email/invite')
+        self.assertEqual(sent, 3)
+        self.assertEqual(outbox[2].recipients, ['user2@example.com'])
+        self.assertIn('Dear User 2', outbox[2].body)
+        self.assertIn('http://example.com/2', outbox[2].html)
+        self.assertEqual(len(self.app.extensions['email_skeletons']), 1)
+
+
+@unittest.skipIf(StandInSMTPServer is None, 'smtpd is not available')
+class BatchMailerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.sleeps = []
+
+    def message(self, i):
+        return Message('Hello', sender='admin@example.com',
+                       recipients=['user{}@example.com'.format(i)],
+                       body='Hello')
+
+    def mailer(self, server, **kwargs):
+        server.configure(self.app)
+        return BatchMailer(self.app, sleep=self.sleeps.append, **kwargs)
+
+    def test_batches_share_one_connection(self):
+        server = StandInSMTPServer().start()
+        try:
+            mailer = self.mailer(server)
+            with mailer.batches(10):
+                for i in range(25):
+                    mailer.send(self.message(i))
+                self.assertEqual(len(mailer.queue), 5)
+            self.assertEqual(len(mailer.queue), 0)
+            mailer.close()
+        finally:
+            server.stop()
+        self.assertEqual(len(server.messages), 25)
+        self.assertEqual(server.messages[24][1], ['user24@example.com'])
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(mailer.stats['batches'], 3)
+
+    def test_unbatched_send_raises_permanent_errors(self):
+        server = FlakySMTPServer(failures=1,
+                                 reply='550 No such user').start()
+        try:
+            mailer = self.mailer(server)
+            with self.assertRaises(Exception):
+                mailer.send(self.message(0))
+            mailer.send(self.message(1))
+            mailer.close()
+        finally:
+            server.stop()
+        self.assertEqual(server.messages,
+                         [('admin@example.com', ['user1@example.com'])])
+        self.assertEqual(self.sleeps, [])
+
+    def test_failed_batch_is_not_left_queued(self):
+        server = FlakySMTPServer(failures=5).start()
+        try:
+            mailer = self.mailer(server, max_retries=1)
+            with self.assertRaises(Exception):
+                with mailer.batches(10):
+                    for i in range(3):
+                        mailer.send(self.message(i))
+            self.assertEqual(len(mailer.queue), 0)
+            self.assertEqual(mailer.batch_size, 1)
+            mailer.close()
+        finally:
+            server.stop()
+        self.assertEqual(server.messages, [])
+
+    def test_transient_failure_is_retried_with_backoff(self):
+        server = FlakySMTPServer(failures=2).start()
+        try:
+            mailer = self.mailer(server, batch_size=1, backoff=0.5)
+            mailer.send(self.message(0))
+            mailer.close()
+        finally:
+            server.stop()
+        self.assertEqual(len(server.messages), 1)
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+        self.assertEqual(mailer.stats['retries'], 2)
+        self.assertEqual(server.connections, 3)
+
+    def test_gives_up_after_max_retries(self):
+        server = FlakySMTPServer(failures=5).start()
+        try:
+            mailer = self.mailer(server, batch_size=1, max_retries=2)
+            with self.assertRaises(Exception):
+                mailer.send(self.message(0))
+            mailer.close()
+        finally:
+            server.stop()
+        self.assertEqual(server.messages, [])
+        self.assertEqual(mailer.stats['failed'], 1)
+
+
+class JobAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.previous = app_package._job_app
+        app_package.set_job_app(None)
+        self.flask_config = os.environ.get('FLASK_CONFIG')
+        os.environ['FLASK_CONFIG'] = 'testing'
+
+    def tearDown(self):
+        app_package.set_job_app(self.previous)
+        if self.flask_config is None:
+            del os.environ['FLASK_CONFIG']
+        else:
+            os.environ['FLASK_CONFIG'] = self.flask_config
+
+    def test_job_app_is_created_once(self):
+        # As in a worker; `manage.py test` runs inside the manage app.
+        with mock.patch('flask.has_app_context', return_value=False):
+            first = job_app()
+            self.assertIs(job_app(), first)
+        self.assertTrue(first.config['TESTING'])
+        self.assertIs(app_package._job_app, first)
+
+    def test_job_app_prefers_current_app(self):
+        app = create_app('testing')
+        with app.app_context():
+            self.assertIs(job_app(), app)
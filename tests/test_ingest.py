@@ -0,0 +1,296 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+from app import create_app, db, jobs
+from app.ingest import (JobProgress, ReportParser, SiteRouter,
+                        bulk_upsert_user_data, get_parser, ingest_report,
+                        iter_report, parse_33across, rows_from_parsed,
+                        run_ingest)
+from app.models import (Channels, Permission, Role, Sites, SiteRevenueDaily,
+                        User, UserData)
+
+
+def row(site, day, revenue, channel=1, user_id=1):
+    return {'user_id': user_id, 'site': site, 'channel': channel,
+            'day': day, 'revenue': revenue}
+
+
+class BulkIngestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_insert_and_skip(self):
+        result = bulk_upsert_user_data(
+            [row(1, date(2017, 6, day), day) for day in range(1, 11)],
+            batch_size=4)
+        self.assertEqual(result.inserted, 10)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(result.first_day, date(2017, 6, 1))
+        self.assertEqual(result.last_day, date(2017, 6, 10))
+
+        result = bulk_upsert_user_data(
+            [row(1, date(2017, 6, day), 100) for day in range(5, 15)])
+        self.assertEqual((result.inserted, result.updated, result.skipped),
+                         (4, 0, 6))
+        self.assertEqual(UserData.query.count(), 14)
+        self.assertEqual(UserData.query.filter_by(
+            day=date(2017, 6, 5)).one().revenue, 5)
+
+    def test_update(self):
+        bulk_upsert_user_data(
+            [row(1, date(2017, 6, 1), 1), row(1, date(2017, 6, 2), 2)])
+        result = bulk_upsert_user_data(
+            [row(1, date(2017, 6, 1), 1), row(1, date(2017, 6, 2), 20),
+             row(1, date(2017, 6, 3), 3)], update=True)
+        self.assertEqual((result.inserted, result.updated, result.skipped),
+                         (1, 1, 1))
+        self.assertEqual(UserData.query.filter_by(
+            day=date(2017, 6, 2)).one().revenue, 20)
+
+    def test_rows_sharing_a_key_are_summed(self):
+        result = bulk_upsert_user_data(
+            [row(1, date(2017, 6, 1), 1), row(1, date(2017, 6, 1), 2),
+             row(1, date(2017, 6, 1), 3, channel=2)])
+        self.assertEqual(result.inserted, 2)
+        self.assertEqual(UserData.query.filter_by(
+            channel=1).one().revenue, 3)
+
+    def test_rows_sharing_a_key_across_batches_are_summed(self):
+        bulk_upsert_user_data([row(1, date(2017, 6, 1), 10)])
+        result = bulk_upsert_user_data(
+            [row(1, date(2017, 6, 1), 1), row(1, date(2017, 6, 2), 2),
+             row(1, date(2017, 6, 2), 3), row(1, date(2017, 6, 3), 4),
+             row(1, date(2017, 6, 2), 5), row(1, date(2017, 6, 1), 6)],
+            batch_size=2)
+        self.assertEqual((result.inserted, result.skipped), (2, 1))
+        self.assertEqual(result.batches, 3)
+        revenue = dict(db.session.query(UserData.day, UserData.revenue))
+        # The existing row is left alone, the new ones hold the sums.
+        self.assertEqual(revenue, {date(2017, 6, 1): 10,
+                                   date(2017, 6, 2): 10,
+                                   date(2017, 6, 3): 4})
+
+        result = bulk_upsert_user_data(
+            [row(1, date(2017, 6, 1), 1), row(1, date(2017, 6, 2), 2),
+             row(1, date(2017, 6, 1), 6)], update=True, batch_size=2)
+        self.assertEqual(result.updated, 2)
+        self.assertEqual(UserData.query.filter_by(
+            day=date(2017, 6, 1)).one().revenue, 7)
+
+    def test_progress_while_reading(self):
+        written = []
+
+        def rows():
+            for day in range(1, 6):
+                yield row(1, date(2017, 6, day), day)
+                # Earlier batches are written before the rest is read.
+                self.assertEqual(len(written), day // 2)
+
+        bulk_upsert_user_data(
+            rows(), batch_size=2,
+            progress=lambda result: written.append(result.inserted))
+        self.assertEqual(written, [2, 4, 5])
+
+    def test_site_router(self):
+        db.session.add_all([Sites(link='Dnevno.hr', user_id=1),
+                            Sites(link='other.hr', user_id=2)])
+        db.session.commit()
+        router = SiteRouter()
+        result = bulk_upsert_user_data(router.rows([
+            ('dnevno.hr', date(2017, 6, 1), 1),
+            ('other.hr', date(2017, 6, 1), 2),
+            ('unknown.hr', date(2017, 6, 1), 3)
+        ], channel_id=7))
+        self.assertEqual(result.inserted, 2)
+        self.assertEqual(result.user_ids, set([1, 2]))
+        self.assertEqual(router.unmatched, set(['unknown.hr']))
+        self.assertEqual(UserData.query.filter_by(
+            user_id=2, channel=7).one().revenue, 2)
+
+    def test_old_sqlite(self):
+        with mock.patch('sqlite3.sqlite_version_info', (3, 22, 0)):
+            with self.assertRaisesRegex(ValueError, '3.24'):
+                bulk_upsert_user_data([row(1, date(2017, 6, 1), 1)])
+
+    def test_rows_from_parsed(self):
+        rows = list(rows_from_parsed([(date(2017, 6, 1), 1.5)], 1, 2, 3))
+        self.assertEqual(rows, [{'user_id': 1, 'site': 2, 'channel': 3,
+                                 'day': date(2017, 6, 1), 'revenue': 1.5}])
+
+
+REPORT = """Generated at:,"Sat Jun 24, 06:09:10 AM EDT"
+Date,GUID,Login,Region,Estimated Revenue
+2017-06-23,a,Dnevno.hr,United States,$0.91
+2017-06-23,a,dnevno.hr,Rest of the World,$1.86
+2017-06-23,b,other.hr,United States,$9.00
+2017-06-22,a,dnevno.hr,United States,$0.29
+
+2017-06-23,a,dnevno.hr,United States,$1.00
+"""
+
+
+class ParserTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write(REPORT)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_parse_33across(self):
+        records = [(day, round(revenue, 2))
+                   for day, revenue in parse_33across(self.path, 'DNEVNO.hr')]
+        self.assertEqual(records, [(date(2017, 6, 23), 2.77),
+                                   (date(2017, 6, 22), 0.29),
+                                   (date(2017, 6, 23), 1.0)])
+
+    def test_parse_33across_unknown_site(self):
+        self.assertEqual(list(parse_33across(self.path, 'nope.hr')), [])
+
+    def test_iter_report_all_sites(self):
+        records = [(site, day, round(revenue, 2)) for site, day, revenue
+                   in iter_report(self.path, get_parser('33Across'))]
+        self.assertEqual(sorted(records[:2]), [
+            ('dnevno.hr', date(2017, 6, 23), 2.77),
+            ('other.hr', date(2017, 6, 23), 9.0)])
+        self.assertEqual(records[2:], [('dnevno.hr', date(2017, 6, 22), 0.29),
+                                       ('dnevno.hr', date(2017, 6, 23), 1.0)])
+
+    def test_custom_parser(self):
+        with open(self.path, 'w') as f:
+            f.write('day;domain;earnings\n'
+                    '23.06.2017;a.hr;1.234,50 EUR\n')
+        parser = ReportParser('custom', 'day', 'domain', 'earnings',
+                              date_format='%d.%m.%Y', currency='EUR',
+                              thousands='.', decimal=',', delimiter=';')
+        self.assertEqual(list(iter_report(self.path, parser)),
+                         [('a.hr', date(2017, 6, 23), 1234.5)])
+
+
+class FakeJob(object):
+    def __init__(self):
+        self.meta = {}
+        self.saves = 0
+
+    def save(self):
+        self.saves += 1
+
+
+class IngestJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write(REPORT)
+
+    def tearDown(self):
+        os.remove(self.path)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_run_ingest(self):
+        db.session.add_all([Sites(link='dnevno.hr', user_id=1),
+                            Sites(link='other.hr', user_id=2)])
+        db.session.commit()
+        job = FakeJob()
+        summary = run_ingest(self.path, '33across', 1,
+                             progress=JobProgress(job))
+        self.assertEqual(summary['inserted'], 3)
+        self.assertEqual(summary['sites'], 2)
+        self.assertEqual(job.meta['stage'], 'done')
+        self.assertEqual(job.meta['rows_parsed'], 4)
+        self.assertEqual(job.meta['rows_written'], 3)
+        self.assertTrue(job.saves >= 4)
+        self.assertEqual(SiteRevenueDaily.query.count(), 3)
+
+    def test_run_ingest_selected_sites(self):
+        dnevno = Sites(link='dnevno.hr', user_id=1)
+        db.session.add_all([dnevno, Sites(link='other.hr', user_id=2)])
+        db.session.commit()
+        summary = run_ingest(self.path, '33across', 1, site_ids=[dnevno.id])
+        self.assertEqual(summary['inserted'], 2)
+        self.assertEqual(summary['unmatched'], [])
+        self.assertEqual(UserData.query.filter_by(user_id=2).count(), 0)
+
+    def test_run_ingest_unknown_network(self):
+        with self.assertRaises(ValueError):
+            run_ingest(self.path, 'nope', 1)
+
+    def test_ingest_report_deletes_the_upload(self):
+        ingest_report(self.path, '33across', 1)
+        self.assertFalse(os.path.exists(self.path))
+        open(self.path, 'w').close()  # for tearDown
+
+
+class RecordingQueue(object):
+    """Keeps the arguments of enqueued jobs instead of running them."""
+
+    def __init__(self):
+        self.kwargs = []
+
+    def enqueue(self, f, **kwargs):
+        self.kwargs.append(kwargs['kwargs'])
+        job = FakeJob()
+        job.id, job.data = str(len(self.kwargs)), b''
+        return job
+
+
+class UploadReportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        admin_role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        db.session.add(User(first_name='Admin', email='admin@example.com',
+                            password='password', confirmed=True,
+                            role=admin_role))
+        db.session.add(Channels(name='33across'))
+        db.session.commit()
+        self.queue = RecordingQueue()
+        self.get_queue = jobs.get_queue
+        jobs.get_queue = lambda: self.queue
+
+    def tearDown(self):
+        jobs.get_queue = self.get_queue
+        shutil.rmtree(self.app.config['UPLOAD_FOLDER'])
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_same_file_name_uploads_are_kept_apart(self):
+        client = self.app.test_client()
+        client.post('/account/login', data={
+            'email': 'admin@example.com', 'password': 'password'})
+        for report in (REPORT, REPORT.replace('dnevno.hr', 'other.hr')):
+            client.post('/admin/upload-report', data={
+                'network': '1',
+                'upload': (io.BytesIO(report.encode('utf-8')), 'report.csv')
+            })
+        first, second = [kwargs['path'] for kwargs in self.queue.kwargs]
+        self.assertNotEqual(first, second)
+        with open(first) as f:
+            self.assertIn('dnevno.hr', f.read())
+        with open(second) as f:
+            self.assertNotIn('dnevno.hr', f.read())
@@ -0,0 +1,61 @@
+import unittest
+
+from app import create_app, db, instrumentation
+from app.models import EditableHTML, Role
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(EditableHTML(editor_name='about', value='About us'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_disabled_by_default(self):
+        self.assertEqual(self.app.test_client().get('/metrics').status_code,
+                         404)
+
+    def test_records_requests(self):
+        app = create_app('testing', INSTRUMENTATION=True)
+        client = app.test_client()
+        client.get('/about')
+        client.get('/about')
+        with app.app_context():
+            stats = instrumentation.stats()['main.about']
+        self.assertEqual(stats.count, 2)
+        self.assertGreater(stats.queries, 0)
+        self.assertGreater(stats.template_seconds, 0)
+        self.assertGreater(stats.bytes, 0)
+        self.assertEqual(stats.buckets[-1], 2)
+
+        text = client.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="main.about"} 2', text)
+        self.assertIn('db_queries_total{endpoint="main.about"}', text)
+        self.assertIn('response_cache_requests_total'
+                      '{endpoint="main.about",result="hit"} 1', text)
+
+    def test_slow_request_log(self):
+        app = create_app('testing', INSTRUMENTATION=True,
+                         SLOW_REQUEST_THRESHOLD=0)
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            app.test_client().get('/about?page=1')
+        self.assertIn('Slow request: GET /about?page=1 (main.about)',
+                      logs.output[0])
+
+    def test_metrics_token(self):
+        app = create_app('testing', INSTRUMENTATION=True,
+                         METRICS_TOKEN='secret')
+        client = app.test_client()
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        response = client.get('/metrics', headers={
+            'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
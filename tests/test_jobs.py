@@ -0,0 +1,78 @@
+import pickle
+import unittest
+
+from redis import StrictRedis
+from rq.job import Job
+
+from app import create_app, db
+from app import jobs
+from app.email import MailUser, send_email
+from app.models import Role, User
+
+
+class StandInQueue(object):
+    """Builds jobs like `Queue.enqueue` without pushing them to Redis."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, f, *args, **kwargs):
+        args = kwargs.pop('args', args)
+        kwargs = kwargs.pop('kwargs', kwargs)
+        job = Job.create(f, args=args, kwargs=kwargs,
+                         connection=StrictRedis())
+        self.jobs.append(job)
+        return job
+
+
+class EnqueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(first_name='Jane', email='jane@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+        self.queue = StandInQueue()
+        self.get_queue = jobs.get_queue
+        jobs.get_queue = lambda: self.queue
+        jobs._stats.clear()
+
+    def tearDown(self):
+        jobs.get_queue = self.get_queue
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_mail_user_payload(self):
+        job = jobs.enqueue(send_email, recipient=self.user.email,
+                           subject='Hello', template='account/email/invite',
+                           user=MailUser.of(self.user),
+                           invite_link='http://example.com/x')
+        user = pickle.loads(job.data)[3]['user']
+        self.assertEqual((user.id, user.full_name(), user.email),
+                         (self.user.id, 'Jane', 'jane@example.com'))
+        self.assertLess(len(job.data), len(pickle.dumps(
+            self.user, pickle.HIGHEST_PROTOCOL)))
+
+    def test_orm_instances_are_rejected(self):
+        with self.assertRaises(TypeError):
+            jobs.enqueue(send_email, recipient=self.user.email,
+                         subject='Hello', template='account/email/invite',
+                         user=self.user)
+        with self.assertRaises(TypeError):
+            jobs.enqueue(send_email, kwargs={'user': self.user})
+        self.assertEqual(self.queue.jobs, [])
+
+    def test_stats_per_job_type(self):
+        for _ in range(2):
+            jobs.enqueue(send_email, recipient=self.user.email,
+                         subject='Hello', template='account/email/invite',
+                         user=MailUser.of(self.user),
+                         invite_link='http://example.com/x')
+        stats = jobs.enqueue_stats()['app.email.send_email']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['max_bytes'], len(self.queue.jobs[0].data))
+        self.assertGreaterEqual(stats['max_ms'], 0)
@@ -0,0 +1,80 @@
+import marshal
+import unittest
+
+from app import create_app, db
+from app.models import EditableHTML, Permission, Role, User
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing', PROFILER=True)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        admin_role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        db.session.add(User(first_name='Admin', email='admin@example.com',
+                            password='password', confirmed=True,
+                            role=admin_role))
+        db.session.add(User(first_name='User', email='user@example.com',
+                            password='password', confirmed=True))
+        db.session.add(EditableHTML(editor_name='about', value='About us'))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, email):
+        self.client.post('/account/login', data={
+            'email': email, 'password': 'password'})
+
+    def profiles(self):
+        self.login('admin@example.com')
+        response = self.client.get('/admin/profiles')
+        self.client.get('/account/logout')
+        return response
+
+    def test_admin_header(self):
+        self.client.get('/about', headers={'X-Profile': '1'})
+        self.login('user@example.com')
+        self.client.get('/about', headers={'X-Profile': '1'})
+        self.client.get('/account/logout')
+        self.assertNotIn(b'main.about', self.profiles().data)
+
+        self.login('admin@example.com')
+        self.client.get('/about', headers={'X-Profile': '1'})
+        self.client.get('/about', headers={'X-Profile': '1'})
+        self.client.get('/about')
+        self.assertIn(b'"samples": 2', self.client.get(
+            '/admin/profiles').data)
+
+        response = self.client.get('/admin/profiles/main.about')
+        self.assertIn('main.about.prof',
+                      response.headers['Content-Disposition'])
+        self.assertTrue(marshal.loads(response.data))
+        text = self.client.get(
+            '/admin/profiles/main.about?format=text&sort=tottime')
+        self.assertIn(b'function calls', text.data)
+        self.assertEqual(self.client.get(
+            '/admin/profiles/main.about?format=text&sort=bogus').status_code,
+            400)
+
+        self.client.post('/admin/profiles/reset')
+        self.assertEqual(self.client.get(
+            '/admin/profiles/main.about').status_code, 404)
+
+    def test_sampling(self):
+        self.app.config['PROFILER_SAMPLE_RATE'] = 1
+        self.client.get('/about')
+        self.assertIn(b'main.about', self.profiles().data)
+
+    def test_disabled(self):
+        app = create_app('testing')
+        client = app.test_client()
+        client.post('/account/login', data={
+            'email': 'admin@example.com', 'password': 'password'})
+        self.assertEqual(client.get('/admin/profiles').status_code, 404)
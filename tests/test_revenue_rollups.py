@@ -0,0 +1,89 @@
+import unittest
+from datetime import date
+
+from sqlalchemy import func
+
+from app import create_app, db
+from app.models import (SiteRevenueDaily, Sites, UserData,
+                        rebuild_revenue_rollups, refresh_revenue_rollups,
+                        revenue_series)
+
+
+class RevenueRollupsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_earning(self, user_id, site, channel, day, revenue):
+        db.session.add(UserData(user_id=user_id, site=site, channel=channel,
+                                day=day, revenue=revenue))
+        db.session.commit()
+
+    def site_day(self, user_id, site_id, day):
+        return db.session.query(func.sum(SiteRevenueDaily.revenue)) \
+            .filter_by(user_id=user_id, site_id=site_id, day=day).scalar()
+
+    def test_rebuild(self):
+        self.add_earning(1, 10, 100, date(2017, 6, 1), 5)
+        self.add_earning(1, 10, 101, date(2017, 6, 1), 2)
+        self.add_earning(1, 11, 100, date(2017, 6, 2), 3)
+        self.add_earning(2, 20, 100, date(2017, 7, 1), 4)
+        rebuild_revenue_rollups()
+
+        self.assertEqual(self.site_day(1, 10, date(2017, 6, 1)), 7)
+        self.assertEqual(self.site_day(1, 11, date(2017, 6, 2)), 3)
+        self.assertEqual(self.site_day(2, 20, date(2017, 7, 1)), 4)
+        self.assertEqual(SiteRevenueDaily.query.filter_by(
+            site_id=10, channel=101).one().revenue, 2)
+        self.assertEqual(SiteRevenueDaily.query.count(), 4)
+
+    def test_monthly_series_from_rollup(self):
+        db.session.add_all([Sites(id=10, link='a.hr', user_id=1),
+                            Sites(id=11, link='b.hr', user_id=1)])
+        self.add_earning(1, 10, 100, date(2017, 6, 1), 5)
+        self.add_earning(1, 10, 101, date(2017, 6, 30), 2)
+        self.add_earning(1, 11, 100, date(2017, 7, 2), 3)
+        rebuild_revenue_rollups()
+        keys, sites = revenue_series(1, date(2017, 6, 1), date(2017, 7, 31),
+                                     granularity='month')
+        self.assertEqual(keys, [date(2017, 6, 1), date(2017, 7, 1)])
+        self.assertEqual(sites, [(10, 'a.hr', [7, 0]), (11, 'b.hr', [0, 3])])
+
+    def test_channel_series_from_rollup(self):
+        db.session.add(Sites(id=10, link='a.hr', user_id=1))
+        self.add_earning(1, 10, 100, date(2017, 6, 1), 5)
+        self.add_earning(1, 10, 101, date(2017, 6, 1), 2)
+        self.add_earning(1, 10, None, date(2017, 6, 2), 3)
+        rebuild_revenue_rollups()
+        first_day, last_day = date(2017, 6, 1), date(2017, 6, 2)
+        self.assertEqual(revenue_series(1, first_day, last_day)[1],
+                         [(10, 'a.hr', [7, 3])])
+        self.assertEqual(revenue_series(1, first_day, last_day,
+                                        channel_ids=[101])[1],
+                         [(10, 'a.hr', [2, 0])])
+
+    def test_incremental_refresh_is_scoped(self):
+        self.add_earning(1, 10, 100, date(2017, 6, 1), 5)
+        self.add_earning(2, 20, 100, date(2017, 6, 1), 4)
+        rebuild_revenue_rollups()
+
+        self.add_earning(1, 10, 100, date(2017, 6, 30), 6)
+        self.add_earning(2, 20, 100, date(2017, 6, 30), 1)
+        refresh_revenue_rollups(
+            date(2017, 6, 30), date(2017, 6, 30), user_ids=[1])
+
+        self.assertEqual(self.site_day(1, 10, date(2017, 6, 30)), 6)
+        self.assertEqual(self.site_day(1, 10, date(2017, 6, 1)), 5)
+        # User 2 was not part of the refresh and has no row for that day.
+        self.assertEqual(SiteRevenueDaily.query.filter_by(
+            user_id=2, day=date(2017, 6, 30)).count(), 0)
+
+        refresh_revenue_rollups(date(2017, 6, 30), date(2017, 6, 30))
+        self.assertEqual(self.site_day(2, 20, date(2017, 6, 30)), 1)
@@ -0,0 +1,93 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+from app.assets import BUNDLES, compress_static
+
+SCRIPT = b'var answer = 42;\n' * 200
+
+
+class StaticFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        static_folder = tempfile.mkdtemp()
+        # Pages link to built bundles, so error pages build nothing here.
+        manifest = os.path.join(static_folder, 'manifest.json')
+        with open(manifest, 'w') as f:
+            json.dump({name: name for name in BUNDLES}, f)
+        self.app = create_app('testing', ASSETS_USE_MANIFEST=True,
+                              ASSETS_MANIFEST_FILE=manifest)
+        self.app.static_folder = static_folder
+        for name in ('app.js', 'app.0123456789ab.js'):
+            with open(os.path.join(self.app.static_folder, name), 'wb') as f:
+                f.write(SCRIPT)
+        with open(os.path.join(self.app.static_folder, 'small.css'),
+                  'wb') as f:
+            f.write(b'body {}')
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.app.static_folder)
+
+    def get(self, path, **headers):
+        return self.client.get('/static/' + path, headers=headers)
+
+    def test_compress_static(self):
+        self.assertGreaterEqual(compress_static(self.app), 2)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.app.static_folder, 'small.css.gz')))
+        self.assertEqual(compress_static(self.app), 0)
+
+    def test_precompressed_sibling(self):
+        compress_static(self.app)
+        response = self.get('app.js', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.data), SCRIPT)
+
+        response = self.get('app.js')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, SCRIPT)
+
+    def test_no_dynamic_compression(self):
+        response = self.get('app.js', **{'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, SCRIPT)
+
+    def test_cache_headers(self):
+        response = self.get('app.0123456789ab.js')
+        self.assertEqual(response.headers['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        response = self.get('app.js')
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+        etag = response.headers['ETag']
+        self.assertEqual(self.get('app.js', **{
+            'If-None-Match': etag}).status_code, 304)
+
+    def test_range(self):
+        response = self.get('app.js', Range='bytes=17-33')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, SCRIPT[17:34])
+        self.assertEqual(response.headers['Content-Range'],
+                         'bytes 17-33/{}'.format(len(SCRIPT)))
+
+        response = self.get('app.js', Range='bytes=99999-')
+        self.assertEqual(response.status_code, 416)
+
+        response = self.get('app.js', Range='bytes=0-9', **{
+            'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, SCRIPT)
+
+    def test_missing(self):
+        self.assertEqual(self.get('nothing.js').status_code, 404)
+        self.assertEqual(self.get('../config.py').status_code, 404)
+
+    def test_dynamic_compression_of_pages(self):
+        client = create_app('testing').test_client()
+        response = client.get('/account/login', headers={
+            'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
@@ -0,0 +1,155 @@
+import unittest
+
+from sqlalchemy import event
+
+from app import create_app, db, user_cache
+from app.cache import Invalidations, LRUCache
+from app.models import Permission, Role, User, load_user, role_permissions
+from tests.pubsub import StandInRedis
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_eviction_and_ttl(self):
+        now = [0]
+        cache = LRUCache(size=2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')),
+                         (1, None, 3))
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        user = User(first_name='Jane', email='jane@example.com',
+                    password='password', confirmed=True)
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.remove()
+        self.queries = []
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count(self, conn, cursor, statement, *args):
+        self.queries.append(statement)
+
+    def test_cached_user_needs_no_queries(self):
+        load_user(str(self.user_id)).can(Permission.GENERAL)
+        db.session.remove()
+        del self.queries[:]
+        user = load_user(str(self.user_id))
+        self.assertTrue(user.confirmed)
+        self.assertTrue(user.can(Permission.GENERAL))
+        self.assertFalse(user.is_admin())
+        self.assertEqual(user.full_name(), 'Jane')
+        self.assertEqual(self.queries, [])
+        self.assertIs(db.session.query(User).get(self.user_id), user)
+
+    def test_changes_invalidate_entry(self):
+        user = load_user(str(self.user_id))
+        user.email = 'jane@example.org'
+        user.role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        db.session.commit()
+        self.assertIsNone(user_cache.get('user:%d' % self.user_id))
+        db.session.remove()
+        user = load_user(str(self.user_id))
+        self.assertEqual(user.email, 'jane@example.org')
+        self.assertTrue(user.is_admin())
+
+    def test_password_hash_is_not_cached(self):
+        load_user(str(self.user_id))
+        self.assertNotIn('password_hash',
+                         user_cache.get('user:%d' % self.user_id))
+        db.session.remove()
+        user = load_user(str(self.user_id))
+        del self.queries[:]
+        self.assertTrue(user.verify_password('password'))
+        self.assertEqual(len(self.queries), 1)
+
+    def test_evictions_reach_other_processes(self):
+        invalidations = self.app.extensions['invalidations'] = \
+            Invalidations(self.app)
+        user = load_user(str(self.user_id))
+        user_key, role_key = 'user:%d' % user.id, 'role:%d' % user.role_id
+        local = user_cache.tiers[0]
+
+        def refill():
+            self.assertEqual(len(local), 0)
+            local.set(user_key, {'id': user.id})
+            local.set(role_key, {'id': user.role_id})
+
+        invalidations.redis = StandInRedis(
+            messages=[refill, 'user_cache:' + user_key])
+        invalidations.subscribed = False
+        invalidations.start_listener()
+        invalidations.listener.join(1)
+        self.assertTrue(invalidations.subscribed)
+        self.assertIsNone(user_cache.get(user_key))
+        self.assertEqual(user_cache.get(role_key), {'id': user.role_id})
+
+        user.email = 'jane@example.org'
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(invalidations.redis.published,
+                         [('invalidate', 'user_cache:' + user_key)])
+
+    def test_role_change_invalidates_entry(self):
+        role = load_user(str(self.user_id)).role
+        role.permissions = Permission.ADMINISTER
+        db.session.commit()
+        db.session.remove()
+        self.assertTrue(load_user(str(self.user_id)).is_admin())
+
+    def test_permission_table(self):
+        user = User.query.get(self.user_id)
+        self.assertTrue(user.can(Permission.GENERAL))
+        del self.queries[:]
+        self.assertFalse(user.can(Permission.ADMINISTER))
+        self.assertEqual(self.queries, [])
+        with self.assertRaises(TypeError):
+            role_permissions()[user.role_id] = Permission.ADMINISTER
+        user.role.permissions = Permission.ADMINISTER
+        db.session.commit()
+        self.assertTrue(user.can(Permission.ADMINISTER))
+
+    def test_role_changes_reach_other_processes(self):
+        invalidations = self.app.extensions['invalidations'] = \
+            Invalidations(self.app)
+        user = User.query.get(self.user_id)
+        self.assertFalse(user.can(Permission.ADMINISTER))
+        stale = self.app.extensions['role_permissions']
+        db.session.commit()
+        # Changed by another process, bypassing this one's listeners
+        db.engine.execute(Role.__table__.update().values(
+            permissions=Permission.ADMINISTER))
+        self.assertFalse(user.can(Permission.ADMINISTER))
+
+        def restore():
+            self.app.extensions['role_permissions'] = stale
+
+        invalidations.redis = StandInRedis(
+            messages=[restore, 'role_permissions'])
+        invalidations.subscribed = False
+        invalidations.start_listener()
+        invalidations.listener.join(1)
+        self.assertTrue(user.can(Permission.ADMINISTER))
+
+        user.role.permissions = Permission.GENERAL
+        db.session.commit()
+        self.assertIn(('invalidate', 'role_permissions'),
+                      invalidations.redis.published)
@@ -1,8 +1,11 @@
+import json
 import time
 import unittest
+from datetime import date, timedelta
 
 from app import create_app, db
-from app.models import AnonymousUser, Permission, Role, User
+from app.models import (AnonymousUser, Permission, Role, Sites, User,
+                        UserData, rebuild_revenue_rollups)
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -131,3 +134,39 @@ class UserModelTestCase(unittest.TestCase):
     def test_anonymous(self):
         u = AnonymousUser()
         self.assertFalse(u.can(Permission.GENERAL))
+
+    def test_user_data_series(self):
+        u = User(email='user@example.com', password='password')
+        db.session.add(u)
+        db.session.commit()
+        s1 = Sites(user_id=u.id, link='one.example.com')
+        s2 = Sites(user_id=u.id, link='two.example.com')
+        db.session.add_all([s1, s2])
+        db.session.commit()
+        today = date.today()
+        db.session.add_all([
+            UserData(user_id=u.id, site=s1.id, channel=1, revenue=3,
+                     day=today - timedelta(days=1)),
+            UserData(user_id=u.id, site=s1.id, channel=2, revenue=4,
+                     day=today - timedelta(days=1)),
+            UserData(user_id=u.id, site=s1.id, channel=1, revenue=5,
+                     day=today - timedelta(days=30)),
+            UserData(user_id=u.id, site=s1.id, channel=1, revenue=7,
+                     day=today - timedelta(days=31)),
+            UserData(user_id=u.id, site=s1.id, channel=1, revenue=9,
+                     day=today)
+        ])
+        db.session.commit()
+        rebuild_revenue_rollups()
+        chart = json.loads(u.get_user_data())
+        labels = chart['data']['labels']
+        datasets = chart['data']['datasets']
+        self.assertEqual(len(labels), 30)
+        self.assertEqual(labels[-1],
+                         (today - timedelta(days=1)).strftime('%d-%m'))
+        self.assertEqual([d['label'] for d in datasets],
+                         ['one.example.com', 'two.example.com'])
+        self.assertEqual(datasets[0]['data'][0], 5)
+        self.assertEqual(datasets[0]['data'][-1], 7)
+        self.assertEqual(sum(datasets[0]['data']), 12)
+        self.assertEqual(datasets[1]['data'], [0] * 30)
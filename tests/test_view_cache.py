@@ -0,0 +1,116 @@
+import re
+import unittest
+
+from app import create_app, db, response_cache
+from app.models import EditableHTML, Permission, Role, User
+from app.view_cache import CSRF_PLACEHOLDER
+
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        admin_role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        db.session.add(User(first_name='Admin', email='admin@example.com',
+                            password='password', confirmed=True,
+                            role=admin_role))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        self.client.post('/account/login', data={
+            'email': 'admin@example.com', 'password': 'password'})
+        self.client.get('/account/manage')  # show the login flash
+
+    def about(self):
+        return self.client.get('/about').get_data(as_text=True)
+
+    def test_about_is_cached_until_edited(self):
+        db.session.add(EditableHTML(editor_name='about', value='First'))
+        db.session.commit()
+        self.assertIn('First', self.about())
+        EditableHTML.query.first().value = 'Second'
+        db.session.commit()
+        self.assertIn('First', self.about())
+        self.assertEqual(response_cache.stats()['main.about'],
+                         {'hit': 1, 'miss': 1, 'skip': 0})
+
+        self.login()
+        response = self.client.post('/admin/_update_editor_contents', data={
+            'editor_name': 'about', 'edit_data': 'Third'})
+        self.assertEqual(response.status_code, 200)
+        self.client.get('/account/logout')
+        self.assertIn('Third', self.about())
+
+    def test_vary_by_role(self):
+        self.about()
+        self.login()
+        self.about()
+        self.assertEqual(response_cache.stats()['main.about']['miss'], 2)
+
+    def test_flashes_skip_the_cache(self):
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('info', 'Hello')]
+        self.assertIn('Hello', self.about())
+        self.assertEqual(response_cache.stats()['main.about']['skip'], 1)
+
+    def test_registered_users_invalidated_by_new_user(self):
+        self.login()
+        self.assertNotIn('bob@example.com',
+                         self.client.get('/admin/users').get_data(
+                             as_text=True))
+        db.session.add(User(first_name='Bob', email='bob@example.com'))
+        db.session.commit()
+        self.assertIn('bob@example.com',
+                      self.client.get('/admin/users').get_data(
+                          as_text=True))
+
+    def test_cached_api_response_is_conditional(self):
+        self.login()
+        etag = self.client.get('/api/revenue').headers['ETag']
+        response = self.client.get('/api/revenue',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response_cache.stats()['api.revenue']['hit'], 1)
+
+    def test_csrf_token_is_per_session(self):
+        app = create_app('testing', WTF_CSRF_ENABLED=True)
+        db.session.add(User(first_name='Other', email='other@example.com',
+                            password='password', confirmed=True,
+                            role=User.query.first().role))
+        db.session.add(EditableHTML(editor_name='about', value='First'))
+        db.session.commit()
+
+        def token(client, path):
+            page = client.get(path).get_data(as_text=True)
+            self.assertNotIn(CSRF_PLACEHOLDER, page)
+            return CSRF_TOKEN.search(page).group(1)
+
+        pages = []
+        for email in ('admin@example.com', 'other@example.com'):
+            client = app.test_client()
+            client.post('/account/login', data={
+                'email': email, 'password': 'password',
+                'csrf_token': token(client, '/account/login')})
+            client.get('/account/manage')  # show the login flash
+            pages.append((client, token(client, '/about')))
+        with app.app_context():
+            self.assertEqual(response_cache.stats()['main.about']['hit'], 1)
+        (first, first_token), (second, second_token) = pages
+        self.assertNotEqual(first_token.split('##')[1],
+                            second_token.split('##')[1])
+        response = second.post('/admin/_update_editor_contents', data={
+            'csrf_token': second_token, 'editor_name': 'about',
+            'edit_data': 'Second'})
+        self.assertEqual(response.status_code, 200)
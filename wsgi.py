@@ -0,0 +1,11 @@
+"""
+Entry point for the web processes: `gunicorn wsgi:app`. Unlike manage.py
+it does not import the command line tooling (Flask-Script, Flask-Migrate
+and Alembic), so web workers boot faster. Redis and RQ are still loaded:
+the caches use Redis and views enqueue background jobs.
+"""
+import os
+
+from app import create_app
+
+app = create_app(os.getenv('FLASK_CONFIG') or 'default')